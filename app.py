@@ -3,7 +3,7 @@
 from dotenv import load_dotenv
 load_dotenv() # Carga las variables del archivo .env
 
-from flask import Flask, redirect, request, flash
+from flask import Flask, redirect, request, flash, jsonify
 from routes.auth_routes import auth_bp
 from routes.dashboard_routes import dashboard_bp
 from routes.ventas_routes import ventas_bp
@@ -11,9 +11,10 @@ from routes.seremi_routes import seremi_bp
 from routes.config_routes import config_bp
 from datetime import timedelta
 from routes.contab_routes import contab_bp
-from utils.sheet_cache import refrescar_todo_el_cache, obtener_fecha_actualizacion
+from utils.sheet_cache import refrescar_todo_en_segundo_plano, obtener_estado_refresco, obtener_fecha_actualizacion
+from utils.cache_respuestas import obtener_estadisticas
 from flask import redirect, request
-from utils.auth import tiene_permiso
+from utils.auth import tiene_permiso, login_requerido
 from routes.finanzas_routes import finanzas_bp
 from routes.sucursales_routes import sucursales_bp
 from routes.fabrica_routes import fabrica_bp
@@ -73,11 +74,23 @@ def utility_processor():
 
 @app.route("/refresh")
 def refresh_global():
-    from utils.sheet_cache import refrescar_todo_el_cache
-    refrescar_todo_el_cache()
-    flash("✅ Datos actualizados con éxito", "success")
+    # La recarga corre en segundo plano: mientras tanto se siguen mostrando los datos anteriores
+    refrescar_todo_en_segundo_plano()
+    flash("🔄 Actualización de datos en curso. Los cambios se verán en unos momentos.", "info")
     return redirect(request.referrer or "/")
 
+@app.route("/refresh/estado")
+@login_requerido
+def refresh_estado():
+    """Estado de la última recarga de cada fuente (estado, duración y último error)."""
+    return jsonify(obtener_estado_refresco())
+
+@app.route("/refresh/cache-respuestas")
+@login_requerido
+def refresh_cache_respuestas():
+    """Hits y misses del caché de respuestas del dashboard."""
+    return jsonify(obtener_estadisticas())
+
 
 
 
@@ -3,11 +3,14 @@ import base64
 import requests
 import pandas as pd
 import json
-import tempfile
 from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, send_from_directory, flash, current_app, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, send_from_directory, flash, current_app, jsonify
 from utils.auth import login_requerido, permiso_modulo
 from utils.sheet_cache import obtener_datos
+from utils.mayor_periodos import obtener_mayor_normalizado, obtener_mayor_completo, obtener_periodo_mayor
+from utils.utils_excel import respuesta_exportacion
+from services.prorrateo_service import invalidar_prorrateos
+from services.informe_gestion_service import tensor_periodos, matriz_pyg, armar_reporte_pyg, resolver_rango, meses_del_rango, RANGOS, DIMENSIONES, COLUMNAS_TENSOR
 
 contab_bp = Blueprint("contab", __name__, url_prefix="/contab")
 
@@ -140,9 +143,8 @@ def descargar_detalle():
     df["CLASIFICACION"] = df["CUENTA"].str[0].map({"1": "Activo", "2": "Pasivo", "3": "Gastos", "4": "Ingresos"}).fillna("Otros")
     if clasif != "Todas": df = df[df["CLASIFICACION"] == clasif]
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        df.to_excel(tmp.name, index=False)
-        return send_file(tmp.name, as_attachment=True, download_name="detalle.xlsx")
+    # Se envía en chunks y el temporal se borra al terminar (antes quedaba en /tmp)
+    return respuesta_exportacion(df, "detalle", request.args.get("formato", "xlsx"), columnas_numericas=["DEBE", "HABER"])
 
 # ==============================================================================
 # 4. RUTAS DE CONFIGURACIÓN (PRORRATEOS Y CLASIFICACIÓN)
@@ -191,20 +193,13 @@ def prorrateos():
             "nombre": nombre, "tipo": cfg.get("tipo", ""), "activo": bool(cfg.get("activo", True))
         })
 
-    df = obtener_datos("mayor")
+    df = obtener_mayor_completo()
     if not df.empty:
-        df["CUENTA_STR"] = df["CUENTA"].astype(str)
-        todas_las_cuentas = sorted(df[df["CUENTA_STR"].str.startswith("3")]["NOMBRE"].dropna().unique().tolist())
+        todas_las_cuentas = sorted(df[df["CLASE"] == "3"]["NOMBRE"].dropna().unique().tolist())
 
-        df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
-        y, m = map(int, periodo.split("-"))
-        df_mes = df[(df["FECHA"].dt.year == y) & (df["FECHA"].dt.month == m)].copy()
+        df_mes = obtener_periodo_mayor(periodo)
 
         if not df_mes.empty:
-            for col in ["DEBE", "HABER"]: df_mes[col] = pd.to_numeric(df_mes[col], errors="coerce").fillna(0)
-            df_mes["SALDO"] = df_mes["DEBE"] - df_mes["HABER"]
-            df_mes["CENTRO COSTO"] = df_mes["CENTRO COSTO"].astype(str)
-            
             df_v = df_mes[df_mes["CUENTA"].astype(str).str.startswith("41")]
             if not df_v.empty:
                 # FIX: .astype(float) para evitar errores de JSON con int64
@@ -314,6 +309,7 @@ def api_config_cuenta_global():
     elif accion == "eliminar": 
         if nombre in config: del config[nombre]
     guardar_prorrateos(prorrateos)
+    invalidar_prorrateos()
     return {"ok": True}
 
 @contab_bp.route("/api/guardar_clasificacion", methods=["POST"])
@@ -335,6 +331,7 @@ def api_guardar_prorrateo_serv_generales():
     data = cargar_prorrateos()
     data.setdefault("reglas_mensuales", {}).setdefault(periodo, {}).setdefault("serv_generales", {})[cuenta] = dist
     guardar_prorrateos(data)
+    invalidar_prorrateos([periodo], hacia_adelante=True)
     return {"ok": True}
 
 @contab_bp.route("/api/prorrateos/cuenta_manual", methods=["POST"])
@@ -347,6 +344,7 @@ def api_guardar_prorrateo_cuenta_manual():
     data = cargar_prorrateos()
     data.setdefault("reglas_mensuales", {}).setdefault(periodo, {}).setdefault("cuentas_globales", {})[cuenta] = dist
     guardar_prorrateos(data)
+    invalidar_prorrateos([periodo])
     return {"ok": True}
 
 @contab_bp.route("/api/prorrateos/fabrica_costeo", methods=["POST"])
@@ -375,6 +373,7 @@ def api_guardar_prorrateo_fabrica_costanera():
     data = cargar_prorrateos()
     data.setdefault("fabrica_empanadas", {}).setdefault("costanera_prorrateos", {})[periodo] = reglas_limpias
     guardar_prorrateos(data)
+    invalidar_prorrateos([periodo], hacia_adelante=True)
     return {"ok": True}
 
 @contab_bp.route("/guardar_comentario", methods=["POST"])
@@ -452,198 +451,33 @@ def api_guardar_matriz_sg():
         reglas[m]["serv_generales"] = d_mes
         
     guardar_prorrateos(data)
+    invalidar_prorrateos(payload.keys(), hacia_adelante=True)
     return jsonify({"ok": True})
 
 # ==============================================================================
 # 6. REPORTES GERENCIALES (MOTOR CENTRALIZADO)
 # ==============================================================================
-
-def calcular_matriz_gestion(df, periodo, switch_sg, switch_fab, data_config):
-    """
-    Función CENTRALIZADA que aplica toda la matemática de prorrateos.
-    Devuelve un DataFrame 'df_procesado' listo para ser agrupado.
-    """
-    config_cuentas = data_config.get("config_cuentas", {})
-    reglas_mensuales = data_config.get("reglas_mensuales", {})
-    costanera_prorrateos = data_config.get("fabrica_empanadas", {}).get("costanera_prorrateos", {})
-
-    pool_sg = {}
-    pool_fab = {}
-    for p, d in reglas_mensuales.items():
-        if "serv_generales" in d: pool_sg[p] = d["serv_generales"]
-    for p, d in costanera_prorrateos.items(): pool_fab[p] = d
-
-    def get_regla(pool, per):
-        if per in pool: return pool[per]
-        ants = [p for p in pool.keys() if p < per]
-        return pool[max(ants)] if ants else {}
-
-    # Pre-cálculos Ventas
-    df_ventas = df[df["CUENTA"].str.startswith("41")]
-    # Ventas totales por mes (para ratio global)
-    vtas_tot_mes = df_ventas[df_ventas["SALDO_REAL"] > 0].groupby("PERIODO_STR")["SALDO_REAL"].sum().to_dict()
-    # Ventas por sucursal por mes (para ratio específico)
-    vtas_suc_mes = df_ventas[df_ventas["SALDO_REAL"] > 0].groupby(["PERIODO_STR", "CENTRO COSTO"])["SALDO_REAL"].sum().to_dict()
-
-    # Ratios Empanada (4101004)
-    dist_empanadas = {}
-    df_emp = df[df["CUENTA"] == "4101004"]
-    if not df_emp.empty:
-        grupos = df_emp.groupby(["PERIODO_STR", "CENTRO COSTO"])["SALDO_REAL"].sum()
-        for per in grupos.index.get_level_values(0).unique():
-            v_mes = grupos[per]
-            tot = v_mes.sum()
-            if tot > 0: dist_empanadas[per] = (v_mes / tot).to_dict()
-
-    mov_fab = df[(df["CUENTA"]=="3101002") & (abs(df["SALDO_REAL"])>1)]
-    meses_activos_fab = set(mov_fab["PERIODO_STR"].unique())
-
-    filas_finales = []
-    filas_trabajo = df.to_dict("records")
-    cache_sg = {}
-    cache_fab = {}
-
-    for row in filas_trabajo:
-        per = row["PERIODO_STR"]
-        cc = row["CENTRO COSTO"]
-        nom = row["NOMBRE"]
-        monto = row["SALDO_REAL"]
-        
-        # --- 1. CUENTAS GLOBALES ---
-        cfg = config_cuentas.get(nom)
-        es_global_procesada = False
-        
-        if cfg and cfg.get("activo"):
-            tipo = cfg["tipo"]
-            es_global_procesada = True
-            
-            # Caso Ventas (Automático)
-            if tipo == "VENTAS_SUCURSAL":
-                tot = vtas_tot_mes.get(per, 0)
-                if tot > 0:
-                    keys_periodo = [k for k in vtas_suc_mes.keys() if k[0] == per]
-                    for key in keys_periodo:
-                        cc_dest = key[1]
-                        venta_suc = vtas_suc_mes[key]
-                        asig = monto * (venta_suc / tot)
-                        if asig != 0:
-                            r = row.copy()
-                            r["CENTRO COSTO"] = cc_dest
-                            r["SALDO_REAL"] = asig
-                            filas_finales.append(r)
-                else:
-                    filas_finales.append(row)
-
-            # Caso Manual
-            elif tipo == "MANUAL_SUCURSAL":
-                reglas_glob_mes = reglas_mensuales.get(per, {}).get("cuentas_globales", {})
-                if nom in reglas_glob_mes:
-                    dist = reglas_glob_mes[nom]
-                    for dst, pct in dist.items():
-                        asig = monto * pct
-                        if asig != 0:
-                            r = row.copy()
-                            r["CENTRO COSTO"] = dst
-                            r["SALDO_REAL"] = asig
-                            filas_finales.append(r)
-                else:
-                    es_global_procesada = False # Si no tiene regla, pasa normal
-
-        if es_global_procesada: continue
-
-        # --- 2. SWITCHES ---
-        generadas = []
-        borrar = False
-        
-        # A. SG
-        if switch_sg and "servicios generales" in cc.lower():
-            if per not in cache_sg: cache_sg[per] = get_regla(pool_sg, per)
-            reg = cache_sg[per].get(nom)
-            if reg:
-                borrar = True
-                for dst, pct in reg.items():
-                    n = row.copy()
-                    n["CENTRO COSTO"] = dst
-                    n["SALDO_REAL"] = monto * pct
-                    generadas.append(n)
-
-        # B. Fábrica
-        elif switch_fab:
-            es_costanera = "costanera" in cc.lower()
-            es_fabrica = "fca" in cc.lower() or "fabrica" in cc.lower()
-            
-            if per in meses_activos_fab:
-                # Caso B1: Costanera -> Sucursales
-                if es_costanera:
-                    if per not in cache_fab: cache_fab[per] = get_regla(pool_fab, per)
-                    pct = cache_fab[per].get(row["CUENTA"])
-                    
-                    if pct and pct > 0:
-                        traslado = monto * pct
-                        r1 = row.copy()
-                        r1["SALDO_REAL"] = -traslado
-                        generadas.append(r1)
-                        
-                        mapa_ventas = dist_empanadas.get(per, {})
-                        if mapa_ventas:
-                            for cc_dest, ratio in mapa_ventas.items():
-                                r2 = row.copy()
-                                r2["CENTRO COSTO"] = cc_dest
-                                r2["CUENTA"] = "3101002"
-                                r2["NOMBRE"] = f"{nom} (Absorbido Fca)"
-                                r2["SALDO_REAL"] = traslado * ratio
-                                generadas.append(r2)
-                        else:
-                            r2 = row.copy()
-                            r2["CENTRO COSTO"] = "Fca de Empanadas"
-                            r2["CUENTA"] = "3101002"
-                            r2["SALDO_REAL"] = traslado
-                            generadas.append(r2)
-
-                # Caso B2: Vaciar Fábrica -> Sucursales
-                elif es_fabrica:
-                    mapa_ventas = dist_empanadas.get(per, {})
-                    if mapa_ventas:
-                        borrar = True 
-                        for cc_dest, ratio in mapa_ventas.items():
-                            n = row.copy()
-                            n["CENTRO COSTO"] = cc_dest
-                            n["CUENTA"] = "3101002"
-                            n["NOMBRE"] = f"{nom} (Absorbido Fca)"
-                            n["SALDO_REAL"] = monto * ratio
-                            generadas.append(n)
-
-        for f in generadas: filas_finales.append(f)
-        if not borrar: filas_finales.append(row)
-
-    return pd.DataFrame(filas_finales)
-
 # --- RUTAS DE VISTAS ---
 
 @contab_bp.route("/informe_gerencial")
 @login_requerido
 @permiso_modulo("reporte")
 def informe_gerencial():
-    df = obtener_datos("mayor")
+    mayor = obtener_mayor_normalizado()
     data_config = {"config_cuentas": cargar_prorrateos().get("config_cuentas", {}),
                    "reglas_mensuales": cargar_prorrateos().get("reglas_mensuales", {}),
                    "fabrica_empanadas": cargar_prorrateos().get("fabrica_empanadas", {})}
     data_clasif = cargar_clasificaciones()
 
-    df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
-    periodo = request.args.get("periodo")
-    if not periodo:
-        max_fecha = df["FECHA"].max() if not df.empty else datetime.now()
-        periodo = max_fecha.strftime("%Y-%m") if pd.notna(max_fecha) else datetime.now().strftime("%Y-%m")
-
-    # Filtros
-    df["SALDO_REAL"] = (df["DEBE"] - df["HABER"]) * -1
-    df["PERIODO_STR"] = df["FECHA"].dt.strftime("%Y-%m")
-    df["CENTRO COSTO"] = df["CENTRO COSTO"].astype(str).str.strip()
-    df["CUENTA"] = df["CUENTA"].astype(str).str.strip()
-    df["NOMBRE"] = df["NOMBRE"].astype(str).str.strip()
-    df = df[df["CUENTA"].str.startswith(('3', '4'))]
-    df = df[df["PERIODO_STR"] == periodo].copy()
+    # Rango: "periodo" (o "hasta") es el último mes; "rango" define desde dónde se suma
+    # (mes, trimestre, ytd, ltm) y con desde=YYYY-MM es un rango personalizado.
+    hasta = request.args.get("hasta") or request.args.get("periodo")
+    if not hasta:
+        max_fecha = mayor["fecha_max"] if not mayor["completo"].empty else datetime.now()
+        hasta = max_fecha.strftime("%Y-%m") if pd.notna(max_fecha) else datetime.now().strftime("%Y-%m")
+    rango = request.args.get("rango") or ("personalizado" if request.args.get("desde") else "mes")
+    if rango not in RANGOS: rango = "mes"
+    desde, hasta = resolver_rango(rango, hasta, request.args.get("desde"))
 
 # Revisa si el formulario mandó el campo oculto "form_enviado"
     if request.args.get("form_enviado"):
@@ -654,91 +488,26 @@ def informe_gerencial():
         # Si NO lo envió (es la primera vez que cargas la página), préndelos por defecto
         switch_sg = True
         switch_fab = True
-    
-    df_final = calcular_matriz_gestion(df, periodo, switch_sg, switch_fab, data_config)
-    
+
+    # Cada mes se prorratea una vez (y queda guardado); el rango suma sus meses
+    tensor = tensor_periodos(meses_del_rango(desde, hasta), switch_sg, switch_fab, data_config)
+
     todos_cc = sorted(list(set(obtener_datos("mayor")["CENTRO COSTO"].dropna().unique())))
-    matriz = {}
-    for _, row in df_final.iterrows():
-        cta = row["CUENTA"]
-        if cta not in matriz: matriz[cta] = {"nombre": row["NOMBRE"], "montos": {}}
-        matriz[cta]["montos"][row["CENTRO COSTO"]] = matriz[cta]["montos"].get(row["CENTRO COSTO"], 0) + row["SALDO_REAL"]
-
-    macros_data = {}
-    for grp in data_clasif.get("grupos", []):
-        m = grp.get("macro_categoria", "Otros")
-        if m not in macros_data: macros_data[m] = {"grupos": [], "totales_cc": {c:0.0 for c in todos_cc}}
-        fg = {"nombre": grp["nombre"], "tipo": grp["tipo"], "totales_cc": {c:0.0 for c in todos_cc}, "detalle_cuentas": []}
-        for cta_id in grp["cuentas"]:
-            cid = str(cta_id)
-            if cid in matriz:
-                data_cta = matriz[cid]
-                for cc, val in data_cta["montos"].items():
-                    fg["totales_cc"][cc] += val
-                    macros_data[m]["totales_cc"][cc] += val
-                fg["detalle_cuentas"].append({"codigo": cid, "nombre": data_cta["nombre"], "montos_cc": data_cta["montos"]})
-        macros_data[m]["grupos"].append(fg)
-
-    sin_clasif = {"nombre": "Pendientes", "totales_cc": {c:0.0 for c in todos_cc}, "detalle_cuentas": []}
-    procesadas = set([str(c) for g in data_clasif.get("grupos", []) for c in g["cuentas"]])
-    hay_pend = False
-    for cta, data in matriz.items():
-        if cta not in procesadas and sum(abs(v) for v in data["montos"].values()) > 1:
-            hay_pend = True
-            for cc, val in data["montos"].items(): sin_clasif["totales_cc"][cc] += val
-            sin_clasif["detalle_cuentas"].append({"codigo": cta, "nombre": data["nombre"], "montos_cc": data["montos"]})
-    if hay_pend:
-        if "Sin Clasificar" not in macros_data: macros_data["Sin Clasificar"] = {"grupos": [], "totales_cc": {c:0.0 for c in todos_cc}}
-        macros_data["Sin Clasificar"]["grupos"].append(sin_clasif)
-        for cc in todos_cc: macros_data["Sin Clasificar"]["totales_cc"][cc] += sin_clasif["totales_cc"][cc]
-
-    ESTRUCTURA = [
-        {"id": "ingresos_op", "titulo": "INGRESOS DE EXPLOTACIÓN", "tipo": "macro", "fuente": ["Ingresos Operacionales", "Ingresos Venta"]},
-        {"id": "costo_directo", "titulo": "COSTO DIRECTO (COSTO DE VENTA)", "tipo": "macro", "fuente": ["Costo Venta"]},
-        {"id": "margen_op", "titulo": "MARGEN OPERACIONAL (BRUTO)", "tipo": "calculo", "color": "primary", "operacion": ["ingresos_op", "costo_directo"]},
-        {"id": "costos_fijos", "titulo": "GASTOS FIJOS LOCALES", "tipo": "macro", "fuente": ["Costos de Explotación"]},
-        {"id": "margen", "titulo": "MARGEN DE EXPLOTACIÓN", "tipo": "calculo", "color": "warning", "operacion": ["margen_op", "costos_fijos"]},
-        {"id": "gastos_adm", "titulo": "GASTOS DE ADMINISTRACIÓN Y VENTAS", "tipo": "macro", "fuente": ["Gastos de Administración y Ventas"]},
-        {"id": "res_op", "titulo": "RESULTADO OPERACIONAL", "tipo": "calculo", "color": "info", "operacion": ["margen", "gastos_adm"]},
-        {"id": "no_op", "titulo": "INGRESOS Y EGRESOS NO OPERACIONALES", "tipo": "macro", "fuente": ["Ingresos No Operacionales"]},
-        {"id": "res_final", "titulo": "RESULTADO ANTES DE IMPTO", "tipo": "calculo", "color": "success", "operacion": ["res_op", "no_op"]},
-        {"id": "otros", "titulo": "SIN CLASIFICAR / OTROS", "tipo": "macro", "fuente": ["Sin Clasificar", "Otros"]}
-    ]
-    
-    reporte = []
-    cache = {}
-    for l in ESTRUCTURA:
-        f = {"titulo": l["titulo"], "tipo": l["tipo"], "color": l.get("color", "secondary"), "grupos": [], "totales_cc": {c:0.0 for c in todos_cc}}
-        if l["tipo"] == "macro":
-            enc = False
-            for src in l["fuente"]:
-                if src in macros_data:
-                    d = macros_data[src]
-                    f["grupos"].extend(d["grupos"])
-                    for cc in todos_cc: f["totales_cc"][cc] += d["totales_cc"][cc]
-                    enc = True
-            cache[l["id"]] = f["totales_cc"]
-            if enc or l["id"] == "otros": reporte.append(f)
-        elif l["tipo"] == "calculo":
-            for op in l["operacion"]:
-                tot = cache.get(op, {})
-                for cc in todos_cc: f["totales_cc"][cc] += tot.get(cc, 0)
-            cache[l["id"]] = f["totales_cc"]
-            reporte.append(f)
-
-    return render_template("contab/informe_gerencial.html", periodo=periodo, reporte=reporte, columnas_cc=todos_cc, switch_sg=switch_sg, switch_fab=switch_fab)
+    matriz, nombres = matriz_pyg(tensor, "CENTRO COSTO")
+    reporte = armar_reporte_pyg(matriz, nombres, data_clasif.get("grupos", []), todos_cc)
+
+    return render_template("contab/informe_gerencial.html", periodo=hasta, desde=desde, hasta=hasta, rango=rango, reporte=reporte, columnas_cc=todos_cc, switch_sg=switch_sg, switch_fab=switch_fab)
 
 @contab_bp.route("/comparativo_gestion")
 @login_requerido
 @permiso_modulo("reporte")
 def comparativo_gestion():
-    df = obtener_datos("mayor")
+    mayor = obtener_mayor_normalizado()
     data_config = {"config_cuentas": cargar_prorrateos().get("config_cuentas", {}),
                    "reglas_mensuales": cargar_prorrateos().get("reglas_mensuales", {}),
                    "fabrica_empanadas": cargar_prorrateos().get("fabrica_empanadas", {})}
     data_clasif = cargar_clasificaciones()
 
-    df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
     comp_cc = request.args.get("comp_cc", "Total Empresa")
     comp_modo = request.args.get("comp_modo", "last_6")
     
@@ -747,7 +516,7 @@ def comparativo_gestion():
     
     
     
-    if not df.empty: fecha_fin = df["FECHA"].max()
+    if not mayor["completo"].empty: fecha_fin = mayor["fecha_max"]
     else: fecha_fin = datetime.now()
 
     # Si el usuario eligió un mes para la comparativa anual, lo usamos. Si no, usamos el último con datos.
@@ -762,14 +531,6 @@ def comparativo_gestion():
         # Ahora compara el "mes_base" de los últimos 3 años (ej: Feb 2024, Feb 2025, Feb 2026)
         for i in range(2, -1, -1): cols.append(datetime(fecha_fin.year - i, mes_base, 1).strftime("%Y-%m"))
 
-    df["SALDO_REAL"] = (df["DEBE"] - df["HABER"]) * -1
-    df["PERIODO_STR"] = df["FECHA"].dt.strftime("%Y-%m")
-    df["CENTRO COSTO"] = df["CENTRO COSTO"].astype(str).str.strip()
-    df["CUENTA"] = df["CUENTA"].astype(str).str.strip()
-    df["NOMBRE"] = df["NOMBRE"].astype(str).str.strip()
-    df = df[df["CUENTA"].str.startswith(('3', '4'))]
-    df = df[df["PERIODO_STR"].isin(cols)]
-
     # Lógica de los switches por defecto ACTIVADOS
     if request.args.get("form_enviado"):
         switch_sg = request.args.get("distribuir_sg") == "on"
@@ -778,83 +539,12 @@ def comparativo_gestion():
         switch_sg = True
         switch_fab = True
 
-    # Calculo centralizado
-    df_final = calcular_matriz_gestion(df, None, switch_sg, switch_fab, data_config)
-    
-    if comp_cc != "Total Empresa":
-        df_final = df_final[df_final["CENTRO COSTO"] == comp_cc]
-
-    matriz = {}
-    for _, row in df_final.iterrows():
-        cta = row["CUENTA"]
-        p = row["PERIODO_STR"]
-        if cta not in matriz: matriz[cta] = {"nombre": row["NOMBRE"], "montos": {}}
-        matriz[cta]["montos"][p] = matriz[cta]["montos"].get(p, 0) + row["SALDO_REAL"]
-
-    macros_data = {}
-    for grp in data_clasif.get("grupos", []):
-        m = grp.get("macro_categoria", "Otros")
-        if m not in macros_data: macros_data[m] = {"grupos": [], "totales_col": {c:0.0 for c in cols}}
-        fg = {"nombre": grp["nombre"], "tipo": grp["tipo"], "totales_col": {c:0.0 for c in cols}, "detalle_cuentas": []}
-        for cta_id in grp["cuentas"]:
-            cid = str(cta_id)
-            if cid in matriz:
-                data_cta = matriz[cid]
-                for c in cols:
-                    val = data_cta["montos"].get(c, 0)
-                    fg["totales_col"][c] += val
-                    macros_data[m]["totales_col"][c] += val
-                fg["detalle_cuentas"].append({"codigo": cid, "nombre": data_cta["nombre"], "montos_col": data_cta["montos"]})
-        macros_data[m]["grupos"].append(fg)
-
-    sin_clasif = {"nombre": "Pendientes", "totales_col": {c:0.0 for c in cols}, "detalle_cuentas": []}
-    procesadas = set([str(c) for g in data_clasif.get("grupos", []) for c in g["cuentas"]])
-    hay_pend = False
-    for cta, data in matriz.items():
-        if cta not in procesadas and sum(abs(v) for v in data["montos"].values()) > 1:
-            hay_pend = True
-            for c in cols:
-                val = data["montos"].get(c, 0)
-                sin_clasif["totales_col"][c] += val
-            sin_clasif["detalle_cuentas"].append({"codigo": cta, "nombre": data["nombre"], "montos_col": data["montos"]})
-    if hay_pend:
-        if "Sin Clasificar" not in macros_data: macros_data["Sin Clasificar"] = {"grupos": [], "totales_col": {c:0.0 for c in cols}}
-        macros_data["Sin Clasificar"]["grupos"].append(sin_clasif)
-        for c in cols: macros_data["Sin Clasificar"]["totales_col"][c] += sin_clasif["totales_col"][c]
-
-    ESTRUCTURA = [
-        {"id": "ingresos_op", "titulo": "INGRESOS DE EXPLOTACIÓN", "tipo": "macro", "fuente": ["Ingresos Operacionales", "Ingresos Venta"]},
-        {"id": "costo_directo", "titulo": "COSTO DIRECTO (COSTO DE VENTA)", "tipo": "macro", "fuente": ["Costo Venta"]},
-        {"id": "margen_op", "titulo": "MARGEN OPERACIONAL (BRUTO)", "tipo": "calculo", "color": "primary", "operacion": ["ingresos_op", "costo_directo"]},
-        {"id": "costos_fijos", "titulo": "GASTOS FIJOS LOCALES", "tipo": "macro", "fuente": ["Costos de Explotación"]},
-        {"id": "margen", "titulo": "MARGEN DE EXPLOTACIÓN", "tipo": "calculo", "color": "warning", "operacion": ["margen_op", "costos_fijos"]},
-        {"id": "gastos_adm", "titulo": "GASTOS DE ADMINISTRACIÓN Y VENTAS", "tipo": "macro", "fuente": ["Gastos de Administración y Ventas"]},
-        {"id": "res_op", "titulo": "RESULTADO OPERACIONAL", "tipo": "calculo", "color": "info", "operacion": ["margen", "gastos_adm"]},
-        {"id": "no_op", "titulo": "INGRESOS Y EGRESOS NO OPERACIONALES", "tipo": "macro", "fuente": ["Ingresos No Operacionales"]},
-        {"id": "res_final", "titulo": "RESULTADO ANTES DE IMPTO", "tipo": "calculo", "color": "success", "operacion": ["res_op", "no_op"]},
-        {"id": "otros", "titulo": "SIN CLASIFICAR / OTROS", "tipo": "macro", "fuente": ["Sin Clasificar", "Otros"]}
-    ]
-
-    reporte = []
-    cache = {}
-    for l in ESTRUCTURA:
-        f = {"titulo": l["titulo"], "tipo": l["tipo"], "color": l.get("color", "secondary"), "grupos": [], "totales_col": {c:0.0 for c in cols}}
-        if l["tipo"] == "macro":
-            enc = False
-            for src in l["fuente"]:
-                if src in macros_data:
-                    d = macros_data[src]
-                    f["grupos"].extend(d["grupos"])
-                    for c in cols: f["totales_col"][c] += d["totales_col"][c]
-                    enc = True
-            cache[l["id"]] = f["totales_col"]
-            if enc or l["id"] == "otros": reporte.append(f)
-        elif l["tipo"] == "calculo":
-            for op in l["operacion"]:
-                tot = cache.get(op, {})
-                for c in cols: f["totales_col"][c] += tot.get(c, 0)
-            cache[l["id"]] = f["totales_col"]
-            reporte.append(f)
+    # Calculo centralizado (tensores por mes ya prorrateados)
+    tensor = tensor_periodos(cols, switch_sg, switch_fab, data_config)
+
+    centro = comp_cc if comp_cc != "Total Empresa" else None
+    matriz, nombres = matriz_pyg(tensor, "PERIODO_STR", centro_costo=centro)
+    reporte = armar_reporte_pyg(matriz, nombres, data_clasif.get("grupos", []), cols)
 
     todos_cc = sorted(list(set(obtener_datos("mayor")["CENTRO COSTO"].dropna().unique())))
     return render_template("contab/comparativo_gestion.html", reporte=reporte, columnas=cols, todos_cc=todos_cc, comp_cc=comp_cc, comp_modo=comp_modo, switch_sg=switch_sg, switch_fab=switch_fab, mes_anual=mes_base)
@@ -863,33 +553,24 @@ def comparativo_gestion():
 @login_requerido
 @permiso_modulo("reporte")
 def dashboard_gestion():
-    df = obtener_datos("mayor")
+    mayor = obtener_mayor_normalizado()
     data_config = {"config_cuentas": cargar_prorrateos().get("config_cuentas", {}),
                    "reglas_mensuales": cargar_prorrateos().get("reglas_mensuales", {}),
                    "fabrica_empanadas": cargar_prorrateos().get("fabrica_empanadas", {})}
     data_clasif = cargar_clasificaciones()
     grupos_config = data_clasif.get("grupos", [])
 
-    df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
-    if df.empty: return render_template("contab/dashboard_gestion.html", dash_cc="Total", kpis={}, charts={})
+    if mayor["completo"].empty: return render_template("contab/dashboard_gestion.html", dash_cc="Total", kpis={}, charts={})
 
     per_solicitado = request.args.get("periodo")
     if per_solicitado:
         max_f = pd.to_datetime(per_solicitado + "-01") + pd.offsets.MonthEnd(0)
     else:
-        max_f = df["FECHA"].max()
+        max_f = mayor["fecha_max"]
 
     anio_act = max_f.year
     anio_ant = anio_act - 1
     
-    df["SALDO_REAL"] = (df["DEBE"] - df["HABER"]) * -1
-    df["PERIODO_STR"] = df["FECHA"].dt.strftime("%Y-%m")
-    df["CENTRO COSTO"] = df["CENTRO COSTO"].astype(str).str.strip()
-    df["CUENTA"] = df["CUENTA"].astype(str).str.strip()
-    df["NOMBRE"] = df["NOMBRE"].astype(str).str.strip()
-    df = df[df["CUENTA"].str.startswith(('3', '4'))]
-    df = df[df["FECHA"].dt.year >= anio_ant].copy()
-
     dash_cc = request.args.get("dash_cc", "Total Empresa")
     
     # Calculo centralizado (siempre ON para dashboard)
@@ -901,26 +582,31 @@ def dashboard_gestion():
         switch_sg = True
         switch_fab = True
 
-    # Calculo centralizado dinámico
-    df_final = calcular_matriz_gestion(df, None, switch_sg, switch_fab, data_config)
-    
-    
+    # Solo hacen falta los totales por mes de los dos años: tensores por mes ya prorrateados
+    tensor = tensor_periodos(meses_del_rango(f"{anio_ant}-01", f"{anio_act}-12"), switch_sg, switch_fab, data_config)
+    celdas = tensor.reset_index() if not tensor.empty else pd.DataFrame(columns=DIMENSIONES + COLUMNAS_TENSOR)
+    celdas = celdas.sort_values(["ORIGEN", "POS"], kind="stable")
+
     if dash_cc != "Total Empresa":
-        df_final = df_final[df_final["CENTRO COSTO"] == dash_cc]
+        celdas = celdas[celdas["CENTRO COSTO"] == dash_cc]
 
     ult_mes_str = max_f.strftime("%Y-%m")
     ant_mes_str = (max_f - pd.DateOffset(years=1)).strftime("%Y-%m")
 
-    def get_kpi(dframe, per):
-        d = dframe[dframe["PERIODO_STR"] == per]
-        i = d[d["CUENTA"].str.startswith("4")]["SALDO_REAL"].sum()
-        g = d[d["CUENTA"].str.startswith("3")]["SALDO_REAL"].sum()
+    es_ingreso = celdas["CUENTA"].str.startswith("4")
+    es_gasto = celdas["CUENTA"].str.startswith("3")
+    ingresos_mes = celdas[es_ingreso].groupby("PERIODO_STR")["SALDO_REAL"].sum()
+    gastos_mes = celdas[es_gasto].groupby("PERIODO_STR")["SALDO_REAL"].sum()
+
+    def get_kpi(per):
+        i = ingresos_mes.get(per, 0.0)
+        g = gastos_mes.get(per, 0.0)
         res = i + g
         m = (res/i*100) if i > 0 else 0
         return i, g, res, m
 
-    v_act, g_act, r_act, m_act = get_kpi(df_final, ult_mes_str)
-    v_ant, _, r_ant, _ = get_kpi(df_final, ant_mes_str)
+    v_act, g_act, r_act, m_act = get_kpi(ult_mes_str)
+    v_ant, _, r_ant, _ = get_kpi(ant_mes_str)
 
     kpis = {
         "venta": v_act,
@@ -931,23 +617,21 @@ def dashboard_gestion():
         "costo_total": g_act
     }
 
-    df_final["MES_NUM"] = pd.to_datetime(df_final["PERIODO_STR"] + "-01").dt.month
-    df_final["YEAR"] = pd.to_datetime(df_final["PERIODO_STR"] + "-01").dt.year
-    
-    ing = df_final[df_final["CUENTA"].str.startswith("4")]
-    v_curr = ing[ing["YEAR"] == anio_act].groupby("MES_NUM")["SALDO_REAL"].sum().reindex(range(1,13), fill_value=0)
-    v_prev = ing[ing["YEAR"] == anio_ant].groupby("MES_NUM")["SALDO_REAL"].sum().reindex(range(1,13), fill_value=0)
+    def ventas_anio(anio):
+        meses = [f"{anio}-{m:02d}" for m in range(1, 13)]
+        return ingresos_mes.reindex(meses, fill_value=0)
+
+    v_curr = ventas_anio(anio_act)
+    v_prev = ventas_anio(anio_ant)
 
-    mix = {}
-    gastos_mes = df_final[(df_final["PERIODO_STR"] == ult_mes_str) & (df_final["CUENTA"].str.startswith("3"))]
     mapa = {}
     for g in grupos_config:
         m = g.get("macro_categoria", "Otros")
         for c in g["cuentas"]: mapa[str(c)] = m
-    
-    for _, r in gastos_mes.iterrows():
-        m = mapa.get(r["CUENTA"], "Sin Clasificar")
-        mix[m] = mix.get(m, 0) + abs(r["SALDO_REAL"])
+
+    gastos_ult = celdas[es_gasto & (celdas["PERIODO_STR"] == ult_mes_str)]
+    macro = gastos_ult["CUENTA"].map(mapa).fillna("Sin Clasificar")
+    mix = gastos_ult["ABS"].groupby(macro, sort=False).sum().to_dict()
     
     mix_ord = sorted(mix.items(), key=lambda x: x[1], reverse=True)[:5]
     
@@ -970,20 +654,18 @@ def comparativo():
     centro_costo = request.args.get("centro_costo", "Todos")
     modo = request.args.get("modo", "normal")
 
-    df = obtener_datos("mayor")
+    df = obtener_mayor_completo()
     excluir = ["COMPROBANTE DE APERTURA", "COMPROBANTE DE CIERRE", "COMPROBANTE DE REGULARIZACIÓN"]
-    df["CONCEPTO"] = df["CONCEPTO"].astype(str).str.upper()
-    df = df[~df["CONCEPTO"].isin(excluir)]
-    todos_centros = sorted(df["CENTRO COSTO"].astype(str).str.strip().unique().tolist())
+    df = df[~df["CONCEPTO"].astype(str).str.upper().isin(excluir)]
+    todos_centros = sorted(df["CENTRO COSTO"].astype(str).unique().tolist())
 
-    if centro_costo != "Todos": df = df[df["CENTRO COSTO"].astype(str).str.strip().str.upper() == centro_costo.upper()]
+    if centro_costo != "Todos": df = df[df["CENTRO COSTO"].str.upper() == centro_costo.upper()]
     if fecha_corte: df = df[df["FECHA"] <= pd.to_datetime(fecha_corte)]
 
-    df["CUENTA"] = df["CUENTA"].astype(str)
-    df["CLASIFICACION"] = df["CUENTA"].str[0].map({"3": "Gastos", "4": "Ingresos"}).fillna("Otros")
+    df["CLASIFICACION"] = df["CLASE"].map({"3": "Gastos", "4": "Ingresos"}).fillna("Otros")
     if clasif != "Todas": df = df[df["CLASIFICACION"] == clasif]
 
-    df["PERIODO_DT"] = df["FECHA"].apply(lambda x: datetime(x.year, x.month, 1))
+    df["PERIODO_DT"] = pd.to_datetime(df["PERIODO_STR"], format="%Y-%m")
     ultimos_12_dt = sorted(df["PERIODO_DT"].unique())[-12:]
     meses_es = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
     etiquetas = [f"{meses_es[d.month - 1]}-{d.year}" for d in ultimos_12_dt]
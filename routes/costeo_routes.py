@@ -1,10 +1,12 @@
 from flask import Blueprint, render_template, request, jsonify
 from utils.auth import login_requerido, permiso_modulo
 from utils.sheet_cache import obtener_datos
-from utils.costeo_manager import cargar_reglas, guardar_mapeo, guardar_costo_directo, guardar_regla_gasto, obtener_costos_efectivos, guardar_prorrateo_adm, obtener_prorrateo_adm, copiar_reglas_gastos
+from utils.costeo_manager import cargar_reglas, guardar_mapeo, guardar_mapeos, guardar_costo_directo, guardar_costos_directos, guardar_regla_gasto, obtener_costos_efectivos, guardar_prorrateo_adm, obtener_prorrateo_adm, copiar_reglas_gastos
 import pandas as pd
 from datetime import datetime
-from routes.contab_routes import calcular_matriz_gestion, cargar_prorrateos
+from routes.contab_routes import cargar_prorrateos
+from utils.mayor_periodos import obtener_periodo_mayor
+from services.costeo_service import obtener_alias_sucursal, correr_motor_costeo_lote, obtener_indice_alias, universo_sucursales, centros_sin_sucursal
 import io
 from flask import send_file
 from openpyxl import load_workbook
@@ -12,19 +14,6 @@ from utils.utils_excel import aplicar_formato_numerico_excel
 
 costeo_bp = Blueprint("costeo", __name__, url_prefix="/costeo")
 
-def obtener_alias_sucursal(sucursal):
-    s = str(sucursal).upper().strip().replace("Ñ", "N")
-    alias = [s]
-    if "FOOD" in s or "ESC" in s or "MILITAR" in s:
-        alias.extend(["ESC. MILITAR", "ESCUELA MILITAR", "FOOD TRUCK", "FOODTRUCK"])
-    if "WEB" in s:
-        alias.extend(["WEB", "PAGINA WEB", "PAGINAWEB"])
-    if "COSTANERA" in s:
-        alias.extend(["COSTANERA", "COSTANERA CENTER"])
-    if "EGANA" in s or "EGAÑA" in s:
-        alias.extend(["PLAZA EGANA", "PLAZA EGAÑA"])
-    return list(set(alias))
-
 @costeo_bp.route("/mapeo")
 @login_requerido
 @permiso_modulo("contab")
@@ -67,6 +56,15 @@ def api_guardar_mapeo():
     guardar_mapeo(producto, cuenta)
     return jsonify({"success": True})
 
+@costeo_bp.route("/api/guardar_mapeos", methods=["POST"])
+@login_requerido
+@permiso_modulo("contab")
+def api_guardar_mapeos():
+    data = request.get_json()
+    mapeos = data.get("mapeos") or {}
+    guardar_mapeos(mapeos)
+    return jsonify({"success": True, "guardados": len(mapeos)})
+
 @costeo_bp.route("/costos_directos")
 @login_requerido
 @permiso_modulo("contab")
@@ -107,6 +105,15 @@ def api_guardar_costo():
     guardar_costo_directo(data.get("producto"), data.get("costo"), data.get("periodo"))
     return jsonify({"success": True})
 
+@costeo_bp.route("/api/guardar_costos", methods=["POST"])
+@login_requerido
+@permiso_modulo("contab")
+def api_guardar_costos():
+    data = request.get_json()
+    costos = data.get("costos") or {}
+    guardar_costos_directos(costos, data.get("periodo"))
+    return jsonify({"success": True, "guardados": len(costos)})
+
 @costeo_bp.route("/reglas")
 @login_requerido
 @permiso_modulo("contab")
@@ -191,17 +198,11 @@ def gav_corporativo():
     asignado_sg_por_sucursal = {s: 0.0 for s in sucursales}
 
     if not df_mayor_raw.empty and "FECHA" in df_mayor_raw.columns:
-        df_mayor_raw["FECHA_DT"] = pd.to_datetime(df_mayor_raw["FECHA"], errors="coerce")
-        df_mayor_raw["PERIODO_STR"] = df_mayor_raw["FECHA_DT"].dt.strftime("%Y-%m")
-        df_mes = df_mayor_raw[df_mayor_raw["PERIODO_STR"] == periodo].copy()
+        # Mes ya normalizado (SALDO_REAL, CUENTA/NOMBRE/CENTRO COSTO sin espacios)
+        df_mes = obtener_periodo_mayor(periodo)
         
         if not df_mes.empty:
-            df_mes["DEBE"] = pd.to_numeric(df_mes["DEBE"], errors="coerce").fillna(0)
-            df_mes["HABER"] = pd.to_numeric(df_mes["HABER"], errors="coerce").fillna(0)
-            df_mes["SALDO_REAL"] = (df_mes["DEBE"] - df_mes["HABER"]) * -1
-            df_mes["CENTRO COSTO"] = df_mes["CENTRO COSTO"].astype(str).str.strip().str.upper()
-            df_mes["CUENTA"] = df_mes["CUENTA"].astype(str).str.strip()
-            df_mes["NOMBRE"] = df_mes["NOMBRE"].astype(str).str.strip()
+            df_mes["CENTRO COSTO"] = df_mes["CENTRO COSTO"].str.upper()
 
             mask_gastos = df_mes["CUENTA"].str.startswith("3")
             df_gastos = df_mes[mask_gastos]
@@ -257,318 +258,19 @@ def api_guardar_gav_adm():
     guardar_prorrateo_adm(data.get("distribucion", {}))
     return jsonify({"success": True})
 
+def _data_config_prorrateos():
+    prorrateos_data = cargar_prorrateos()
+    return {
+        "config_cuentas": prorrateos_data.get("config_cuentas", {}),
+        "reglas_mensuales": prorrateos_data.get("reglas_mensuales", {}),
+        "fabrica_empanadas": prorrateos_data.get("fabrica_empanadas", {})
+    }
+
 def correr_motor_costeo(periodo, sucursal, escenario="Escenario 1"):
     """Motor matemático centralizado. Devuelve la rentabilidad calculada lista para usar."""
-    # 1. Obtener lista de sucursales
-    df_ventas_raw = obtener_datos("comercial")
-    sucursales = []
-    if not df_ventas_raw.empty and "SUCURSAL" in df_ventas_raw.columns:
-        sucursales = sorted(df_ventas_raw["SUCURSAL"].dropna().unique().tolist())
-        if not sucursal and sucursales:
-            sucursal = sucursales[0]
-
-    # 2. Filtrar ventas
-    df_ventas = pd.DataFrame()
-    if not df_ventas_raw.empty and "FECHA" in df_ventas_raw.columns:
-        df_ventas_raw["FECHA_DT"] = pd.to_datetime(df_ventas_raw["FECHA"], errors="coerce")
-        df_ventas_raw["PERIODO"] = df_ventas_raw["FECHA_DT"].dt.strftime("%Y-%m")
-        df_ventas = df_ventas_raw[(df_ventas_raw["PERIODO"] == periodo) & (df_ventas_raw["SUCURSAL"] == sucursal)].copy()
-
-    ventas_prod = {}
-    if not df_ventas.empty:
-        if "FAMILIA" not in df_ventas.columns:
-            df_ventas["FAMILIA"] = "SIN FAMILIA"
-        for _, row in df_ventas.groupby(["DESCRIPCION", "FAMILIA"]).agg({"NETO": "sum", "CANTIDAD": "sum"}).reset_index().iterrows():
-            if row["CANTIDAD"] > 0:
-                ventas_prod[row["DESCRIPCION"]] = {
-                    "familia": str(row["FAMILIA"]).strip().upper(),
-                    "ingreso": float(row["NETO"]),
-                    "unidades": float(row["CANTIDAD"]),
-                    "gasto_asignado": 0.0,
-                        "desglose_gastos": {},
-                        "gav_asignado": 0.0,
-                        "desglose_gav": {}
-                }
-
-    # 3. Filtrar gastos (AHORA CON MOTOR GERENCIAL DE PRORRATEOS INCLUIDO)
-    df_mayor_raw = obtener_datos("mayor")
-    gastos_cuenta = {}
-    data_config = {}
-    df_procesado = pd.DataFrame()
-    if not df_mayor_raw.empty and "FECHA" in df_mayor_raw.columns:
-        df_mayor_raw["FECHA_DT"] = pd.to_datetime(df_mayor_raw["FECHA"], errors="coerce")
-        df_mayor_raw["PERIODO_STR"] = df_mayor_raw["FECHA_DT"].dt.strftime("%Y-%m")
-        df_mes = df_mayor_raw[df_mayor_raw["PERIODO_STR"] == periodo].copy()
-        
-        if not df_mes.empty:
-            # A. Formatear para el motor de prorrateos
-            df_mes["DEBE"] = pd.to_numeric(df_mes["DEBE"], errors="coerce").fillna(0)
-            df_mes["HABER"] = pd.to_numeric(df_mes["HABER"], errors="coerce").fillna(0)
-            df_mes["SALDO_REAL"] = (df_mes["DEBE"] - df_mes["HABER"]) * -1
-            df_mes["CENTRO COSTO"] = df_mes["CENTRO COSTO"].astype(str).str.strip().str.upper()
-            df_mes["CUENTA"] = df_mes["CUENTA"].astype(str).str.strip()
-            df_mes["NOMBRE"] = df_mes["NOMBRE"].astype(str).str.strip()
-            
-            # B. Cargar configuraciones de prorrateo
-            prorrateos_data = cargar_prorrateos()
-            data_config = {
-                "config_cuentas": prorrateos_data.get("config_cuentas", {}),
-                "reglas_mensuales": prorrateos_data.get("reglas_mensuales", {}),
-                "fabrica_empanadas": prorrateos_data.get("fabrica_empanadas", {})
-            }
-            
-            # C. Juguera Gerencial: Apagamos SG para aislarlo, dejamos Fábrica encendida
-            df_procesado = calcular_matriz_gestion(df_mes, periodo, switch_sg=False, switch_fab=True, data_config=data_config)
-            
-            # D. Extraer solo los gastos (3) propios de la sucursal (Búsqueda Flexible)
-            df_gastos = pd.DataFrame()
-            if not df_procesado.empty and "CUENTA" in df_procesado.columns and "CENTRO COSTO" in df_procesado.columns:
-                aliases_suc = obtener_alias_sucursal(sucursal)
-                cc_normalized = df_procesado["CENTRO COSTO"].astype(str).str.upper().str.strip().str.replace("Ñ", "N", regex=False)
-                mask_cc = cc_normalized.apply(lambda x: any((a in x or x in a) for a in aliases_suc) if str(x).strip() else False)
-                mask = (df_procesado["CUENTA"].str.startswith("3")) & mask_cc
-                df_gastos = df_procesado[mask].copy()
-            
-            costo_total_piz = 0.0
-            
-            if not df_gastos.empty:
-                df_gastos["DISPLAY"] = df_gastos["CUENTA"] + " - " + df_gastos["NOMBRE"]
-                
-                for _, row in df_gastos.groupby(["CUENTA", "DISPLAY"])["SALDO_REAL"].sum().reset_index().iterrows():
-                    # Los gastos en SALDO_REAL son negativos. Pasamos a absoluto.
-                    saldo_positivo = abs(float(row["SALDO_REAL"]))
-                    if saldo_positivo > 0:
-                        cuenta_str = str(row["CUENTA"]).strip()
-                        if cuenta_str == "3101002":
-                            pass # Excluido de fijos locales: el costo de la empanada frita ahora es un Costo Estándar Global
-                        elif cuenta_str == "3101003":
-                            costo_total_piz += saldo_positivo
-                        else:
-                            gastos_cuenta[row["DISPLAY"]] = saldo_positivo
-
-    # Calcular costos unitarios directos automáticos
-    
-    # 1. EMPANADA DE QUESO FRITA: Costo Estándar Global
-    costo_uni_emp = 0.0
-    if not df_procesado.empty and "CUENTA" in df_procesado.columns:
-        costo_fabrica_global = abs(df_procesado[df_procesado["CUENTA"].astype(str).str.strip() == "3101002"]["SALDO_REAL"].sum())
-        empanadas_elaboradas = float(data_config.get("fabrica_empanadas", {}).get("costeo_periodos", {}).get(periodo, {}).get("empanadas_elaboradas", 0))
-        
-        if empanadas_elaboradas > 0:
-            costo_uni_emp = costo_fabrica_global / empanadas_elaboradas
-        else:
-            # Fallback: total de empanadas fritas vendidas globalmente si no hay dato de producción
-            df_ventas_global = df_ventas_raw[df_ventas_raw["PERIODO"] == periodo] if not df_ventas_raw.empty and "PERIODO" in df_ventas_raw.columns else pd.DataFrame()
-            if not df_ventas_global.empty:
-                unidades_global_emp = df_ventas_global[df_ventas_global["DESCRIPCION"].astype(str).str.upper().str.contains("EMPANADA DE QUESO FRITA", na=False)]["CANTIDAD"].sum()
-                if unidades_global_emp > 0:
-                    costo_uni_emp = costo_fabrica_global / unidades_global_emp
-
-    # 2. PIZZA: Costo Directo Local (Mantiene la regla anterior)
-    unidades_piz = sum(d["unidades"] for d in ventas_prod.values() if "PIZZA" in d["familia"])
-    costo_uni_piz = costo_total_piz / unidades_piz if unidades_piz > 0 else 0
-
-    # 4. Aplicar reglas
-    reglas = cargar_reglas()
-    reglas_gastos_todas = reglas.get("reglas_gastos", {})
-    reglas_gastos = reglas_gastos_todas.get(sucursal, {}).get(escenario, {})
-    costos_directos, _ = obtener_costos_efectivos(periodo)
-
-    gastos_no_asignados = {}
-
-    for cta_display, monto_gasto in gastos_cuenta.items():
-        regla = reglas_gastos.get(cta_display)
-        
-        # Fallback inteligente: Si el motor renombró la cuenta, buscar por código numérico
-        if not regla:
-            codigo_cuenta = str(cta_display).split(" - ")[0].strip()
-            for key_json, rule_json in reglas_gastos.items():
-                if str(key_json).startswith(codigo_cuenta + " -"):
-                    regla = rule_json
-                    break
-                    
-        if not regla:
-            gastos_no_asignados[cta_display] = {"monto": monto_gasto, "motivo": "Sin regla configurada en el Paso 3"}
-            continue
-        
-        alcance = regla.get("alcance", "global")
-        metodo = regla.get("metodo", "venta_dinero")
-
-        if metodo == "porcentaje_manual":
-            porcentajes = regla.get("porcentajes", {})
-            sum_pct = 0.0
-            
-            # 1. Asignar a los manuales específicos
-            for p, pct_val in porcentajes.items():
-                if p in ventas_prod and ventas_prod[p]["unidades"] > 0:
-                    try:
-                        pct_decimal = min(float(pct_val) / 100.0, 1.0)
-                    except ValueError:
-                        pct_decimal = 0.0
-                    
-                    if pct_decimal > 0:
-                        sum_pct += pct_decimal
-                        asignado = monto_gasto * pct_decimal
-                        ventas_prod[p]["gasto_asignado"] += asignado
-                        ventas_prod[p]["desglose_gastos"][cta_display] = asignado
-            
-            # 2. El resto (Híbrido) se reparte por ingresos ($) a los demás
-            resto_pct = max(0.0, 1.0 - sum_pct)
-            monto_resto = monto_gasto * resto_pct
-            
-            if monto_resto > 0:
-                prods_resto = [p for p in ventas_prod.keys() if p not in porcentajes and ventas_prod[p]["unidades"] > 0]
-                base_total = sum(ventas_prod[p]["ingreso"] for p in prods_resto)
-                
-                if base_total > 0:
-                    for p in prods_resto:
-                        proporcion = ventas_prod[p]["ingreso"] / base_total
-                        asignado = monto_resto * proporcion
-                        ventas_prod[p]["gasto_asignado"] += asignado
-                        ventas_prod[p]["desglose_gastos"][f"{cta_display} (Resto Híbrido)"] = asignado
-                else:
-                    gastos_no_asignados[f"{cta_display} (Resto Híbrido)"] = {"monto": monto_resto, "motivo": "Resto del híbrido sin ingresos en otros productos"}
-            continue
-
-        afectados = regla.get("productos_afectados", []) if alcance == "especifico" else list(ventas_prod.keys())
-        
-        prods_validos = [p for p in afectados if p in ventas_prod and ventas_prod[p]["unidades"] > 0]
-        if not prods_validos:
-            gastos_no_asignados[cta_display] = {"monto": monto_gasto, "motivo": "Productos afectados no tienen ventas este mes"}
-            continue
-            
-        if metodo == "venta_dinero":
-            base_total = sum(ventas_prod[p]["ingreso"] for p in prods_validos)
-        else:
-            base_total = sum(ventas_prod[p]["unidades"] for p in prods_validos)
-            
-        if base_total == 0:
-            gastos_no_asignados[cta_display] = {"monto": monto_gasto, "motivo": "Base de reparto (ventas/volumen) es 0"}
-            continue
-            
-        for p in prods_validos:
-            base_prod = ventas_prod[p]["ingreso"] if metodo == "venta_dinero" else ventas_prod[p]["unidades"]
-            proporcion = base_prod / base_total
-            asignado = monto_gasto * proporcion
-            ventas_prod[p]["gasto_asignado"] += asignado
-            ventas_prod[p]["desglose_gastos"][cta_display] = asignado
-
-    # ========================================================
-    # 5. NUEVO CÁLCULO GAV (SG + ADMINISTRACIÓN)
-    # ========================================================
-    total_gav_sucursal = 0.0
-    desglose_gav_total = {}
-    
-    # A. SG (Histórico desde el motor gerencial)
-    pool_sg = {}
-    for p_key, d in data_config.get("reglas_mensuales", {}).items():
-        if "serv_generales" in d: pool_sg[p_key] = d["serv_generales"]
-    ants = [p_key for p_key in pool_sg.keys() if p_key <= periodo]
-    regla_efectiva_sg = pool_sg[max(ants)] if ants else {}
-    
-    if not df_procesado.empty and "CUENTA" in df_procesado.columns and "CENTRO COSTO" in df_procesado.columns:
-        mask_sg = (df_procesado["CUENTA"].str.startswith("3")) & (df_procesado["CENTRO COSTO"].str.contains("SERVICIOS GENERALES", na=False))
-        for _, row in df_procesado[mask_sg].iterrows():
-            cta_nombre = str(row["NOMBRE"])
-            monto = abs(float(row["SALDO_REAL"]))
-            pct = 0.0
-            aliases_suc = obtener_alias_sucursal(sucursal)
-            for branch_key, val in regla_efectiva_sg.get(cta_nombre, {}).items():
-                b_search = branch_key.upper().strip().replace("Ñ", "N")
-                if any(a in b_search or b_search in a for a in aliases_suc):
-                    pct = float(val)
-                    break
-            if pct > 0:
-                asignado = monto * pct
-                total_gav_sucursal += asignado
-                desglose_gav_total[f"{row['CUENTA']} - {row['NOMBRE']} (SS.GG)"] = asignado
-
-        # B. Administración (Desde la nueva pestaña)
-        prorrateo_adm = obtener_prorrateo_adm()
-        pct_adm = float(prorrateo_adm.get(sucursal, 0)) / 100.0
-        mask_adm = (df_procesado["CUENTA"].str.startswith("3")) & (df_procesado["CENTRO COSTO"].str.contains("ADMINISTRACION", na=False))
-        for _, row in df_procesado[mask_adm].iterrows():
-            monto = abs(float(row["SALDO_REAL"]))
-            if pct_adm > 0 and monto > 0:
-                asignado = monto * pct_adm
-                total_gav_sucursal += asignado
-                desglose_gav_total[f"{row['CUENTA']} - {row['NOMBRE']} (ADM)"] = asignado
-
-    # C. Distribuir el GAV total en base al Ingreso ($)
-    total_ingreso_sucursal = sum(p["ingreso"] for p in ventas_prod.values())
-    
-    for p, data in ventas_prod.items():
-        proporcion_ingreso = data["ingreso"] / total_ingreso_sucursal if total_ingreso_sucursal > 0 else 0
-        data["gav_asignado"] = total_gav_sucursal * proporcion_ingreso
-        data["desglose_gav"] = {k: v * proporcion_ingreso for k, v in desglose_gav_total.items()}
-
-    # 5. Formatear vista
-    resultados = []
-    total_gasto_sucursal = sum(gastos_cuenta.values())
-
-    gasto_asignado_total = sum(p["gasto_asignado"] for p in ventas_prod.values())
-    total_costo_directo = 0.0
-    total_margen_op = 0.0
-
-    for prod, data in ventas_prod.items():
-        uni = data["unidades"]
-        ing = data["ingreso"]
-        precio_prom = ing / uni
-        familia = data.get("familia", "") # e.g., "PIZZA"
-
-        # Nueva lógica de Costo Directo con prioridades
-        # 1. El costo manual (Paso 2) tiene la máxima prioridad (si es mayor a 0).
-        costo_manual = costos_directos.get(prod)
-
-        if costo_manual is not None and float(costo_manual) > 0:
-            c_dir_uni = float(costo_manual)
-        else:
-            # 2. Si no hay costo manual, se aplica la lógica automática.
-            if "EMPANADA DE QUESO FRITA" in prod.upper():
-                c_dir_uni = costo_uni_emp
-            elif "PIZZA" in familia:
-                c_dir_uni = costo_uni_piz
-            else:
-                # 3. Si no hay costo manual ni regla automática, el costo es 0.
-                c_dir_uni = 0.0
-
-        c_dir_tot = c_dir_uni * uni
-        total_costo_directo += c_dir_tot
-        
-        margen_op_uni = precio_prom - c_dir_uni
-        margen_op_pct = (margen_op_uni / precio_prom * 100) if precio_prom > 0 else 0
-        total_margen_op += (margen_op_uni * uni)
-        
-        g_asig_tot = data["gasto_asignado"]
-        g_asig_uni = g_asig_tot / uni
-        gav_tot = data["gav_asignado"]
-        gav_uni = gav_tot / uni
-        c_tot_uni = c_dir_uni + g_asig_uni + gav_uni
-        margen_uni = precio_prom - c_tot_uni
-        margen_pct = (margen_uni / precio_prom * 100) if precio_prom > 0 else 0
-        
-        resultados.append({
-            "producto": prod,
-            "unidades": int(uni),
-            "ingreso": ing,
-            "precio_prom": precio_prom,
-            "costo_directo_uni": c_dir_uni,
-            "margen_op_uni": margen_op_uni,
-            "margen_op_pct": margen_op_pct,
-            "gasto_fijo_uni": g_asig_uni,
-            "gasto_fijo_tot": g_asig_tot,
-            "gav_uni": gav_uni,
-            "gav_tot": gav_tot,
-            "costo_total_uni": c_tot_uni,
-            "margen_uni": margen_uni,
-            "margen_pct": margen_pct,
-            "desglose": data["desglose_gastos"],
-            "desglose_gav": data["desglose_gav"]
-        })
-
-    resultados.sort(key=lambda x: x["ingreso"], reverse=True)
-
-    return sucursales, sucursal, resultados, total_ingreso_sucursal, total_gasto_sucursal, gasto_asignado_total, gastos_cuenta, gastos_no_asignados, total_costo_directo, total_margen_op
+    sucursales, resultados, _ = correr_motor_costeo_lote([(periodo, sucursal, escenario)], _data_config_prorrateos(), procesos=1)
+    (_, sucursal, _), resultado = resultados[0]
+    return (sucursales, sucursal, *resultado)
 
 @costeo_bp.route("/simulador")
 @login_requerido
@@ -700,4 +402,59 @@ def rentabilidad_gerencia():
                            margen_neto=margen_neto,
                            margen_pct=margen_pct,
                            nombres_grafico=nombres_grafico,
-                           margenes_grafico=margenes_grafico)
\ No newline at end of file
+                           margenes_grafico=margenes_grafico)
+
+@costeo_bp.route("/api/rentabilidad_lote")
+@login_requerido
+@permiso_modulo("reporte")
+def api_rentabilidad_lote():
+    """
+    Matriz de rentabilidad sucursal × mes en una sola pasada.
+    Parámetros: hasta (YYYY-MM, por defecto el mes actual), meses (12), escenario
+    y sucursal (repetible; por defecto todas).
+    """
+    hasta = request.args.get("hasta", datetime.now().strftime("%Y-%m"))
+    escenario = request.args.get("escenario", "Escenario 1")
+    try:
+        meses = max(1, min(int(request.args.get("meses", 12)), 36))
+        fin = pd.Period(hasta, freq="M")
+    except (ValueError, TypeError):
+        return jsonify({"error": "Parámetros inválidos"}), 400
+    periodos = [str(fin - i) for i in range(meses - 1, -1, -1)]
+
+    df_ventas = obtener_datos("comercial")
+    todas = sorted(df_ventas["SUCURSAL"].dropna().unique().tolist()) if not df_ventas.empty and "SUCURSAL" in df_ventas.columns else []
+    sucursales = request.args.getlist("sucursal") or todas
+
+    combinaciones = [(p, s, escenario) for s in sucursales for p in periodos]
+    _, resultados, sin_sucursal = correr_motor_costeo_lote(combinaciones, _data_config_prorrateos())
+
+    matriz = {}
+    for (periodo, sucursal, _), resultado in resultados:
+        filas, total_ingreso, total_gasto, gasto_asignado, _, gastos_no_asignados, total_costo_directo, total_margen_op = resultado
+        costo_total_op = sum(r["costo_total_uni"] * r["unidades"] for r in filas)
+        margen_neto = total_ingreso - costo_total_op
+        matriz.setdefault(sucursal, {})[periodo] = {
+            "ingreso": total_ingreso,
+            "costo_directo": total_costo_directo,
+            "margen_op": total_margen_op,
+            "gasto_fijo": total_gasto,
+            "gasto_asignado": gasto_asignado,
+            "gasto_no_asignado": sum(g["monto"] for g in gastos_no_asignados.values()),
+            "costo_total": costo_total_op,
+            "margen_neto": margen_neto,
+            "margen_pct": (margen_neto / total_ingreso * 100) if total_ingreso > 0 else 0,
+        }
+
+    return jsonify({"periodos": periodos, "sucursales": sucursales, "escenario": escenario, "matriz": matriz,
+                    "centros_sin_sucursal": sin_sucursal})
+
+@costeo_bp.route("/api/centros_sin_sucursal")
+@login_requerido
+@permiso_modulo("contab")
+def api_centros_sin_sucursal():
+    """Centros de costo del mayor que el costeo no logra asociar a ninguna sucursal."""
+    df_ventas = obtener_datos("comercial")
+    sucursales = df_ventas["SUCURSAL"].dropna().unique().tolist() if not df_ventas.empty and "SUCURSAL" in df_ventas.columns else []
+    indice = obtener_indice_alias(universo_sucursales(sucursales))
+    return jsonify({"sucursales": list(indice["sucursales"]), "centros": centros_sin_sucursal(indice)})
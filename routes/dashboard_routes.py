@@ -1,13 +1,50 @@
 from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify
+import numpy as np
 from utils.sheet_cache import obtener_datos, forzar_actualizacion, obtener_fecha_actualizacion
 from utils.filters import filtrar_dataframe
+from services.cubo_ventas import obtener_cubo, filtrar_cubo, ventas_por_periodo
 from utils.auth import login_requerido, permiso_modulo # ← importar el decorador
+from utils.cache_respuestas import cache_respuesta_json
 import pandas as pd
 
 
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+
+def _numeros_o_cero(serie):
+    """Lista de floats de la columna; los nulos quedan como 0 (entero), igual que antes."""
+    valores = serie.astype(float)
+    lista = valores.tolist()
+    for i in np.flatnonzero(valores.isna().to_numpy()):
+        lista[i] = 0
+    return lista
+
+
+def _detalle_por_familia(df):
+    """Productos (una entrada por línea, en el orden del snapshot) agrupados por familia."""
+    if df.empty:
+        return {}
+    productos = [
+        {"descripcion": descripcion, "neto": neto, "cantidad": cantidad}
+        for descripcion, neto, cantidad in zip(
+            [str(v) for v in df["DESCRIPCION"].tolist()],
+            _numeros_o_cero(df["NETO"]),
+            _numeros_o_cero(df["CANTIDAD"]),
+        )
+    ]
+    familias = df["FAMILIA"].astype(object).where(df["FAMILIA"].notna(), "SIN FAMILIA").map(str)
+    return {
+        familia_item: [productos[i] for i in posiciones]
+        for familia_item, posiciones in familias.groupby(familias.to_numpy(), sort=False).indices.items()
+    }
+
+
+def _serie_densa(agrupado, filtro, columna, valores):
+    """Suma de NETO por 'columna' para las filas de 'filtro', como lista de int alineada a 'valores'."""
+    suma = agrupado[filtro].groupby(columna)["NETO"].sum().reindex(valores, fill_value=0)
+    return [int(v) for v in suma.tolist()]
+
 @dashboard_bp.route("/dashboard")
 @login_requerido
 @permiso_modulo("ventas")
@@ -36,6 +73,7 @@ def api_sucursales():
 
 @dashboard_bp.route("/api/dashboard-data")
 @login_requerido
+@cache_respuesta_json
 def api_dashboard_data():
     empresa = request.args.get("empresa", "comercial")
     sucursal = request.args.get("sucursal")
@@ -47,6 +85,7 @@ def api_dashboard_data():
 
     df = obtener_datos(empresa)
 
+    # Detalle por línea (lista de productos y ticket promedio de agrícola)
     df_filtrado = filtrar_dataframe(
         df,
         tipo="FAMILIA",
@@ -55,36 +94,30 @@ def api_dashboard_data():
         semana=semana,
         año=año,
         desde=desde,
-        hasta=hasta
+        hasta=hasta,
+        empresa=empresa
     )
 
+    # Los totales y agrupaciones salen del cubo preagregado (mismos filtros)
+    cubo = obtener_cubo(empresa)
+    cubo_filtrado = filtrar_cubo(cubo, familia, sucursal, semana, año, desde, hasta)
+
     # Para gráfico de torta
     ventas_por_familia = (
-        df_filtrado.groupby("FAMILIA")["NETO"]
+        cubo_filtrado.groupby("FAMILIA")["NETO"]
         .sum()
         .sort_values(ascending=False)
         .reset_index()
-    ) if not df_filtrado.empty else pd.DataFrame(columns=["FAMILIA", "NETO"])
-
-    detalle_por_familia = {}
-    if not df_filtrado.empty:
-        for _, row in df_filtrado.iterrows():
-            familia_item = str(row["FAMILIA"]) if pd.notna(row["FAMILIA"]) else "SIN FAMILIA"
-            producto = {
-                "descripcion": str(row["DESCRIPCION"]),
-                "neto": float(row["NETO"]) if pd.notna(row["NETO"]) else 0,
-                "cantidad": float(row["CANTIDAD"]) if pd.notna(row["CANTIDAD"]) else 0
-            }
-            if familia_item not in detalle_por_familia:
-                detalle_por_familia[familia_item] = []
-            detalle_por_familia[familia_item].append(producto)
+    ) if not cubo_filtrado.empty else pd.DataFrame(columns=["FAMILIA", "NETO"])
+
+    detalle_por_familia = _detalle_por_familia(df_filtrado)
 
     torta_data = [
-        {"nombre": str(row["FAMILIA"]) if pd.notna(row["FAMILIA"]) else "SIN FAMILIA", "valor": int(row["NETO"])}
-        for _, row in ventas_por_familia.iterrows()
+        {"nombre": str(nombre) if pd.notna(nombre) else "SIN FAMILIA", "valor": int(valor)}
+        for nombre, valor in zip(ventas_por_familia["FAMILIA"].tolist(), ventas_por_familia["NETO"].tolist())
     ]
-    total_neto = int(df_filtrado["NETO"].sum()) if not df_filtrado.empty else 0
-    cantidad_total = int(df_filtrado["CANTIDAD"].sum()) if not df_filtrado.empty else 0
+    total_neto = int(cubo_filtrado["NETO"].sum()) if not cubo_filtrado.empty else 0
+    cantidad_total = int(cubo_filtrado["CANTIDAD"].sum()) if not cubo_filtrado.empty else 0
 
     # =========================================================
     # NUEVA LÓGICA: COMPARATIVO Y TENDENCIA AÑO CONTRA AÑO
@@ -92,6 +125,7 @@ def api_dashboard_data():
     total_neto_anterior = 0
     cantidad_anterior = 0
     df_ant = pd.DataFrame()
+    cubo_ant = pd.DataFrame()
     etiqueta_anterior = "Año Anterior"
     etiqueta_actual = "Año Actual"
     año_referencia = None
@@ -105,9 +139,11 @@ def api_dashboard_data():
             desde_ant = (desde_dt - pd.Timedelta(days=364)).strftime("%Y-%m-%d")
             hasta_ant = (hasta_dt - pd.Timedelta(days=364)).strftime("%Y-%m-%d")
             
-            df_ant = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=None, año=None, desde=desde_ant, hasta=hasta_ant)
-            total_neto_anterior = int(df_ant["NETO"].sum()) if not df_ant.empty else 0
-            cantidad_anterior = int(df_ant["CANTIDAD"].sum()) if not df_ant.empty else 0
+            if empresa == "agricola":
+                df_ant = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=None, año=None, desde=desde_ant, hasta=hasta_ant, empresa=empresa)
+            cubo_ant = filtrar_cubo(cubo, familia, sucursal, None, None, desde_ant, hasta_ant)
+            total_neto_anterior = int(cubo_ant["NETO"].sum()) if not cubo_ant.empty else 0
+            cantidad_anterior = int(cubo_ant["CANTIDAD"].sum()) if not cubo_ant.empty else 0
             
             etiqueta_actual = f"{desde_dt.strftime('%d/%m/%y')} - {hasta_dt.strftime('%d/%m/%y')}"
             etiqueta_anterior = f"{pd.to_datetime(desde_ant).strftime('%d/%m/%y')} - {pd.to_datetime(hasta_ant).strftime('%d/%m/%y')}"
@@ -115,9 +151,11 @@ def api_dashboard_data():
         elif año and semana:
             año_referencia = int(año)
             año_ant_str = str(año_referencia - 1)
-            df_ant = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=semana, año=año_ant_str, desde=None, hasta=None)
-            total_neto_anterior = int(df_ant["NETO"].sum()) if not df_ant.empty else 0
-            cantidad_anterior = int(df_ant["CANTIDAD"].sum()) if not df_ant.empty else 0
+            if empresa == "agricola":
+                df_ant = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=semana, año=año_ant_str, desde=None, hasta=None, empresa=empresa)
+            cubo_ant = filtrar_cubo(cubo, familia, sucursal, semana, año_ant_str, None, None)
+            total_neto_anterior = int(cubo_ant["NETO"].sum()) if not cubo_ant.empty else 0
+            cantidad_anterior = int(cubo_ant["CANTIDAD"].sum()) if not cubo_ant.empty else 0
             
             etiqueta_actual = f"Sem {semana} ({año})"
             etiqueta_anterior = f"Sem {semana} ({año_ant_str})"
@@ -125,9 +163,11 @@ def api_dashboard_data():
         elif año:
             año_referencia = int(año)
             año_ant_str = str(año_referencia - 1)
-            df_ant = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=None, año=año_ant_str, desde=None, hasta=None)
-            total_neto_anterior = int(df_ant["NETO"].sum()) if not df_ant.empty else 0
-            cantidad_anterior = int(df_ant["CANTIDAD"].sum()) if not df_ant.empty else 0
+            if empresa == "agricola":
+                df_ant = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=None, año=año_ant_str, desde=None, hasta=None, empresa=empresa)
+            cubo_ant = filtrar_cubo(cubo, familia, sucursal, None, año_ant_str, None, None)
+            total_neto_anterior = int(cubo_ant["NETO"].sum()) if not cubo_ant.empty else 0
+            cantidad_anterior = int(cubo_ant["CANTIDAD"].sum()) if not cubo_ant.empty else 0
             
             etiqueta_actual = f"Año {año}"
             etiqueta_anterior = f"Año {año_ant_str}"
@@ -143,24 +183,19 @@ def api_dashboard_data():
     meses_abrev = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
     
     try:
-        df_hist = filtrar_dataframe(df, tipo="FAMILIA", valor=familia or "TODOS", sucursal=sucursal, semana=None, año=None, desde=None, hasta=None).copy()
-        if not df_hist.empty and "FECHA" in df_hist.columns:
-            df_hist["FECHA_DT"] = pd.to_datetime(df_hist["FECHA"], errors="coerce")
-            df_hist_valid = df_hist.dropna(subset=["FECHA_DT"]).copy()
-            df_hist_valid["MES"] = df_hist_valid["FECHA_DT"].dt.month
-            df_hist_valid["AÑO_DT"] = df_hist_valid["FECHA_DT"].dt.year
-            grouped = df_hist_valid.groupby(["AÑO_DT", "MES"])["NETO"].sum().reset_index()
-            for mes in range(1, 13):
-                tendencia_actual[mes - 1] = int(grouped[(grouped["AÑO_DT"] == año_referencia) & (grouped["MES"] == mes)]["NETO"].sum())
-                tendencia_anterior[mes - 1] = int(grouped[(grouped["AÑO_DT"] == año_ant) & (grouped["MES"] == mes)]["NETO"].sum())
+        grouped, hay_datos = ventas_por_periodo(cubo, "mensual", familia, sucursal)
+        if hay_datos:
+            meses = list(range(1, 13))
+            tendencia_actual = _serie_densa(grouped, grouped["AÑO_DT"] == año_referencia, "MES", meses)
+            tendencia_anterior = _serie_densa(grouped, grouped["AÑO_DT"] == año_ant, "MES", meses)
     except Exception as e:
         print(f"Error calculando tendencia: {e}")
 
     # =========================================================
     # NUEVOS CÁLCULOS: EMPANADAS, TICKET PROMEDIO, HISTÓRICOS
     # =========================================================
-    empanadas_actual = int(df_filtrado[df_filtrado["FAMILIA"].astype(str).str.contains("EMPANADA", case=False, na=False)]["CANTIDAD"].sum()) if not df_filtrado.empty else 0
-    empanadas_anterior = int(df_ant[df_ant["FAMILIA"].astype(str).str.contains("EMPANADA", case=False, na=False)]["CANTIDAD"].sum()) if not df_ant.empty else 0
+    empanadas_actual = int(cubo_filtrado[cubo_filtrado["FAMILIA"].astype(str).str.contains("EMPANADA", case=False, na=False)]["CANTIDAD"].sum()) if not cubo_filtrado.empty else 0
+    empanadas_anterior = int(cubo_ant[cubo_ant["FAMILIA"].astype(str).str.contains("EMPANADA", case=False, na=False)]["CANTIDAD"].sum()) if not cubo_ant.empty else 0
 
     ticket_promedio_actual = 0
     ticket_promedio_anterior = 0
@@ -180,21 +215,26 @@ def api_dashboard_data():
     historico_semanal = {"años": [], "datos": []}
 
     try:
-        if not df_hist.empty and "AÑO" in df_hist.columns and "SEMANA" in df_hist.columns:
-            ventas_por_semana = df_hist.groupby(["AÑO", "SEMANA"])["NETO"].sum().reset_index()
+        ventas_por_semana, hay_datos = ventas_por_periodo(cubo, "semanal", familia, sucursal)
+        if hay_datos:
             
-            for i, sem in enumerate(rango_semanas):
-                tendencia_semanal["actual"][i] = int(ventas_por_semana[(ventas_por_semana["AÑO"] == año_referencia) & (ventas_por_semana["SEMANA"] == sem)]["NETO"].sum())
-                tendencia_semanal["anterior"][i] = int(ventas_por_semana[(ventas_por_semana["AÑO"] == año_ant) & (ventas_por_semana["SEMANA"] == sem)]["NETO"].sum())
+            tendencia_semanal["actual"] = _serie_densa(ventas_por_semana, ventas_por_semana["AÑO"] == año_referencia, "SEMANA", rango_semanas)
+            tendencia_semanal["anterior"] = _serie_densa(ventas_por_semana, ventas_por_semana["AÑO"] == año_ant, "SEMANA", rango_semanas)
 
-            años_disponibles = sorted(df_hist["AÑO"].dropna().unique().astype(int).tolist())
+            años_disponibles = sorted(ventas_por_semana["AÑO"].dropna().unique().astype(int).tolist())
             historico_semanal["años"] = [str(a) for a in años_disponibles]
-            
-            for sem in range(1, 54):
-                fila = {"semana": sem}
-                for anio in años_disponibles:
-                    fila[str(anio)] = int(ventas_por_semana[(ventas_por_semana["SEMANA"] == sem) & (ventas_por_semana["AÑO"] == anio)]["NETO"].sum())
-                historico_semanal["datos"].append(fila)
+
+            # Tabla densa semana (1..53) × año, sin huecos
+            tabla = (
+                ventas_por_semana.groupby(["SEMANA", "AÑO"])["NETO"].sum()
+                .unstack("AÑO", fill_value=0)
+                .reindex(index=range(1, 54), columns=años_disponibles, fill_value=0)
+            )
+            columnas = [str(anio) for anio in años_disponibles]
+            historico_semanal["datos"] = [
+                {"semana": sem, **{col: int(v) for col, v in zip(columnas, valores)}}
+                for sem, valores in zip(range(1, 54), tabla.to_numpy().tolist())
+            ]
     except Exception as e:
         print(f"Error calculando tendencia/histórico semanal: {e}")
 
@@ -223,15 +263,15 @@ def api_dashboard_data():
                     rank_df = df_hist.groupby("YW").agg({"NETO": "sum", "SEMANA": "first", "AÑO": "first"}).sort_index(ascending=False).head(5)
                     rank_df = rank_df.sort_index(ascending=True)
                     ranking_sucursales = [{"sucursal": f"Sem {int(row['SEMANA'])} ({int(row['AÑO'])})", "neto": int(row["NETO"])} for _, row in rank_df.iterrows()]
-    elif not df_filtrado.empty:
+    elif not cubo_filtrado.empty:
         if not sucursal or sucursal == "TODAS":
-            rank_df = df_filtrado.groupby("SUCURSAL")["NETO"].sum().sort_values(ascending=True)
+            rank_df = cubo_filtrado.groupby("SUCURSAL")["NETO"].sum().sort_values(ascending=True)
             ranking_sucursales = [{"sucursal": str(k), "neto": int(v)} for k, v in rank_df.items()]
 
-    if not df_filtrado.empty:
-        if not df_ant.empty:
-            curr_prod = df_filtrado.groupby("DESCRIPCION").agg({"NETO": "sum", "CANTIDAD": "sum"}).reset_index().rename(columns={"NETO": "neto_actual", "CANTIDAD": "cantidad_actual"})
-            prev_prod = df_ant.groupby("DESCRIPCION").agg({"NETO": "sum", "CANTIDAD": "sum"}).reset_index().rename(columns={"NETO": "neto_anterior", "CANTIDAD": "cantidad_anterior"})
+    if not cubo_filtrado.empty:
+        if not cubo_ant.empty:
+            curr_prod = cubo_filtrado.groupby("DESCRIPCION").agg({"NETO": "sum", "CANTIDAD": "sum"}).reset_index().rename(columns={"NETO": "neto_actual", "CANTIDAD": "cantidad_actual"})
+            prev_prod = cubo_ant.groupby("DESCRIPCION").agg({"NETO": "sum", "CANTIDAD": "sum"}).reset_index().rename(columns={"NETO": "neto_anterior", "CANTIDAD": "cantidad_anterior"})
             merged = pd.merge(curr_prod, prev_prod, on="DESCRIPCION", how="outer").fillna(0)
             merged["variacion"] = merged["neto_actual"] - merged["neto_anterior"]
             
@@ -250,7 +290,7 @@ def api_dashboard_data():
             top_productos_cantidad = top_qty[["DESCRIPCION", "cantidad_actual", "cantidad_anterior"]].to_dict(orient="records")
         else:
             # Si no hay año anterior, solo mostramos los más vendidos
-            curr_prod = df_filtrado.groupby("DESCRIPCION").agg({"NETO": "sum", "CANTIDAD": "sum"}).sort_values(by="NETO", ascending=False).reset_index().rename(columns={"NETO": "neto_actual", "CANTIDAD": "cantidad_actual"})
+            curr_prod = cubo_filtrado.groupby("DESCRIPCION").agg({"NETO": "sum", "CANTIDAD": "sum"}).sort_values(by="NETO", ascending=False).reset_index().rename(columns={"NETO": "neto_actual", "CANTIDAD": "cantidad_actual"})
             top_estrellas = [{"DESCRIPCION": str(row["DESCRIPCION"]), "neto_actual": float(row["neto_actual"]), "variacion": 0} for _, row in curr_prod.head(5).iterrows()]
             
             top_qty = curr_prod.sort_values(by="cantidad_actual", ascending=False).head(10)
@@ -290,6 +330,7 @@ def api_dashboard_data():
 
 @dashboard_bp.route("/api/dashboard-productos")
 @login_requerido
+@cache_respuesta_json
 def api_dashboard_productos():
     empresa = request.args.get("empresa", "comercial")
     sucursal = request.args.get("sucursal")
@@ -299,21 +340,10 @@ def api_dashboard_productos():
     hasta = request.args.get("hasta")
     familia = request.args.get("familia")
 
-    df = obtener_datos(empresa)
-
-    df_filtrado = filtrar_dataframe(
-        df,
-        tipo="FAMILIA",
-        valor=familia or "TODOS",
-        sucursal=sucursal,
-        semana=semana,
-        año=año,
-        desde=desde,
-        hasta=hasta
-    )
+    cubo_filtrado = filtrar_cubo(obtener_cubo(empresa), familia, sucursal, semana, año, desde, hasta)
 
     productos = (
-        df_filtrado.groupby("DESCRIPCION")
+        cubo_filtrado.groupby("DESCRIPCION")
         .agg({"NETO": "sum", "CANTIDAD": "sum"})
         .sort_values(by="NETO", ascending=False)
         .reset_index()
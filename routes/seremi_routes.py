@@ -1,13 +1,15 @@
 # routes/seremi_routes.py
 from flask import Blueprint, render_template, request, session, redirect, url_for
-from utils.sheet_cache import obtener_datos, obtener_fecha_actualizacion
+from utils.sheet_cache import obtener_fecha_actualizacion
 from services.resumen_service import MESES as NOMBRES_MESES
 from datetime import datetime
 from collections import defaultdict
-import pandas as pd
 from utils.auth import login_requerido, permiso_modulo
 import calendar
 from utils.db import get_db_connection # <--- IMPORTANTE: Agregamos esto
+from services.seremi_service import (DIAS, ITEMS_PERSONAL, obtener_seremi, lecturas_equipos, temperaturas_productos,
+                                     cambios_aceite, recepciones_mes, personal_por_dia, calendario_personal,
+                                     rango_resumen, resumen_cumplimiento)
 
 seremi_bp = Blueprint("seremi", __name__, url_prefix="/seremi")
 
@@ -75,56 +77,29 @@ def temperatura_equipos():
     if sucursal_activa is None:
         return render_template("403.html"), 403 # O un mensaje de error
 
-    df = obtener_datos("temperatura_equipos")
-
-    # Cargar info de equipos
-    df_equipos = obtener_datos("equipos_info")
-    df_equipos.columns = df_equipos.columns.str.strip().str.upper()
-    mapa_nombre = dict(zip(df_equipos["ID_EQUIPO"], df_equipos["NOMBRE_EQUIPO"]))
-
-    # Normalizar datos de temperatura
-    df.columns = df.columns.str.strip().str.upper()
-    df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors="coerce")
-    df = df.dropna(subset=["FECHA"])
-    df["DIA"] = df["FECHA"].dt.day
-    df["MES"] = df["FECHA"].dt.month
-    df["AÑO"] = df["FECHA"].dt.year
+    # Info de equipos
+    mapa_nombre = obtener_seremi("equipos_info")["mapa_nombre"]
 
     # Filtros de Mes
     mes = int(request.args.get("mes", default=datetime.now().month))
 
-    # 2. APLICAR FILTRO DE SUCURSAL
-    if sucursal_activa != "TODAS":
-        # Aquí es donde "Esc. Militar" debe coincidir EXACTO
-        df = df[df["SUCURSAL"] == sucursal_activa]
-
-    df = df[df["MES"] == mes]
-
-    # Agrupación por equipo
+    # 2. LECTURAS DEL MES (grilla precalculada, ya filtrada por sucursal)
     equipos = defaultdict(list)
-    for cod_equipo, grupo in df.groupby("EQUIPO"):
+    for cod_equipo, dias in lecturas_equipos(mes, sucursal_activa).items():
         nombre_equipo = mapa_nombre.get(cod_equipo, cod_equipo)
         nombre_mostrado = f"{nombre_equipo} ({cod_equipo})"
 
-        grupo = grupo.sort_values("FECHA")
-
-        for dia in range(1, 32):
-            registros_dia = grupo[grupo["DIA"] == dia]
-
-            temps = [
-                f"{row['TEMPERATURA C°']}°C ({row['FECHA'].strftime('%H:%M')})"
-                for _, row in registros_dia.iterrows()
-            ]
-
+        for dia, lecturas in zip(DIAS, dias):
+            temps = [texto for texto, _ in lecturas]
             while len(temps) < 3:
                 temps.append("")
 
-            equipos[nombre_mostrado].append((dia, temps[:3]))
+            equipos[nombre_mostrado].append((dia, temps))
 
     # 3. PREPARAR LISTA PARA EL SELECTOR HTML
     if permisos_visuales == "TODAS":
         # Si es jefe, cargamos todas las opciones disponibles en el Excel
-        sucursales = sorted(obtener_datos("temperatura_equipos")["SUCURSAL"].dropna().unique().tolist())
+        sucursales = list(obtener_seremi("temperatura_equipos")["sucursales"])
         sucursales.insert(0, "TODAS")
     else:
         # Si es sucursal, la lista solo tiene su propia sucursal
@@ -152,49 +127,11 @@ def temperatura_productos():
     sucursal_activa, permisos_visuales = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return render_template("403.html"), 403
 
-    df = obtener_datos("temperatura_productos")
-    df.columns = df.columns.str.strip().str.upper()
-    if 'TEMPERATURA C°' in df.columns:
-        df['TEMPERATURA C°'] = df['TEMPERATURA C°'].astype(str).str.replace(',', '.', regex=False)
-        df['TEMPERATURA C°'] = pd.to_numeric(df['TEMPERATURA C°'], errors='coerce')
-        df.dropna(subset=['TEMPERATURA C°'], inplace=True)
-    
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-    df['DIA'] = df['FECHA'].dt.day
-    df['MES'] = df['FECHA'].dt.month
-    df['HORA'] = df['FECHA'].dt.hour
-    df['RESPONSABLE'] = df['RESPONSABLE'].astype(str)
-
     mes_actual = int(request.args.get("mes", default=datetime.now().month))
-
-    if sucursal_activa != "TODAS":
-        df = df[df["SUCURSAL"] == sucursal_activa]
-    
-    df = df[df["MES"] == mes_actual]
-
-    sucursales_data = {}
-    for sucursal_nombre, grupo_sucursal in df.groupby("SUCURSAL"):
-        productos_data = {}
-        for producto_nombre, grupo_producto in grupo_sucursal.groupby("PRODUCTO"):
-            registros_mensuales = []
-            for dia in range(1, 32):
-                registros_dia = grupo_producto[grupo_producto['DIA'] == dia]
-                t_13_row = registros_dia.iloc[(registros_dia['HORA'] - 13).abs().argsort()[:1]]
-                t_17_row = registros_dia.iloc[(registros_dia['HORA'] - 17).abs().argsort()[:1]]
-                t_21_row = registros_dia.iloc[(registros_dia['HORA'] - 21).abs().argsort()[:1]]
-                
-                temp_13 = f"{t_13_row['TEMPERATURA C°'].iloc[0]:.2f}°C" if not t_13_row.empty else ""
-                temp_17 = f"{t_17_row['TEMPERATURA C°'].iloc[0]:.2f}°C" if not t_17_row.empty else ""
-                temp_21 = f"{t_21_row['TEMPERATURA C°'].iloc[0]:.2f}°C" if not t_21_row.empty else ""
-                responsables = " / ".join(registros_dia['RESPONSABLE'].unique()) if not registros_dia.empty else ""
-                
-                registros_mensuales.append({"dia": f"{dia:02d}", "t_13": temp_13, "t_17": temp_17, "t_21": temp_21, "responsables": responsables})
-            productos_data[producto_nombre] = registros_mensuales
-        sucursales_data[sucursal_nombre] = productos_data
+    sucursales_data = temperaturas_productos(mes_actual, sucursal_activa, decimales=2)
 
     if permisos_visuales == "TODAS":
-        sucursales_list = sorted(obtener_datos("temperatura_productos")["SUCURSAL"].dropna().unique().tolist())
+        sucursales_list = list(obtener_seremi("temperatura_productos")["sucursales"])
         sucursales_list.insert(0, "TODAS")
     else:
         sucursales_list = permisos_visuales
@@ -215,24 +152,10 @@ def cambio_aceite():
     sucursal_activa, permisos_visuales = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return render_template("403.html"), 403
 
-    df = obtener_datos("cambio_aceite")
-    df.columns = df.columns.str.strip().str.upper()
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-
-    if sucursal_activa != "TODAS":
-        df_a_procesar = df[df["SUCURSAL"] == sucursal_activa]
-    else:
-        df_a_procesar = df
-
-    data_por_sucursal = {}
-    if not df_a_procesar.empty:
-        for sucursal, grupo in df_a_procesar.groupby("SUCURSAL"):
-            grupo_ordenado = grupo.sort_values(by="FECHA", ascending=False).head(20)
-            data_por_sucursal[sucursal] = grupo_ordenado.to_dict(orient="records")
+    data_por_sucursal = cambios_aceite(sucursal_activa)
 
     if permisos_visuales == "TODAS":
-        sucursales = sorted(obtener_datos("cambio_aceite")["SUCURSAL"].dropna().unique().tolist())
+        sucursales = list(obtener_seremi("cambio_aceite")["sucursales"])
         sucursales.insert(0, "TODAS")
     else:
         sucursales = permisos_visuales
@@ -250,31 +173,11 @@ def recepcion_mercaderia():
     sucursal_activa, permisos_visuales = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return render_template("403.html"), 403
 
-    df = obtener_datos("recepcion_mercaderia")
-    df.columns = df.columns.str.strip().str.upper()
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-    df['MES'] = df['FECHA'].dt.month
-
     mes_actual = int(request.args.get("mes", default=datetime.now().month))
-    df_filtrado_mes = df[df["MES"] == mes_actual]
-
-    if sucursal_activa != "TODAS":
-        df_a_procesar = df_filtrado_mes[df_filtrado_mes["SUCURSAL"] == sucursal_activa]
-    else:
-        df_a_procesar = df_filtrado_mes
-
-    data_final = {}
-    if not df_a_procesar.empty:
-        for sucursal, grupo_sucursal in df_a_procesar.groupby("SUCURSAL"):
-            productos_data = {}
-            for producto, grupo_producto in grupo_sucursal.groupby("PRODUCTO"):
-                grupo_ordenado = grupo_producto.sort_values(by="FECHA", ascending=False)
-                productos_data[producto] = grupo_ordenado.to_dict(orient="records")
-            data_final[sucursal] = productos_data
+    data_final = recepciones_mes(mes_actual, sucursal_activa)
 
     if permisos_visuales == "TODAS":
-        sucursales = sorted(obtener_datos("recepcion_mercaderia")["SUCURSAL"].dropna().unique().tolist())
+        sucursales = list(obtener_seremi("recepcion_mercaderia")["sucursales"])
         sucursales.insert(0, "TODAS")
     else:
         sucursales = permisos_visuales
@@ -292,51 +195,27 @@ def personal():
     sucursal_activa, permisos_visuales = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return render_template("403.html"), 403
 
-    df = obtener_datos("registro_personal")
-    df.columns = df.columns.str.strip().str.upper()
-    cols = pd.Series(df.columns)
-    for dup in cols[cols.duplicated()].unique(): 
-        cols[cols[cols == dup].index.values.tolist()] = [f'{dup}.{i}' if i != 0 else dup for i in range(sum(cols == dup))]
-    df.columns = cols
-
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-    df['MES'] = df['FECHA'].dt.month
-    df['AÑO'] = df['FECHA'].dt.year
-
     mes_actual = int(request.args.get("mes", default=datetime.now().month))
-    año_actual = df['AÑO'].max() if not df.empty else datetime.now().year
-    df_filtrado_mes = df[df["MES"] == mes_actual]
-
-    if sucursal_activa != "TODAS":
-        df_a_procesar = df_filtrado_mes[df_filtrado_mes["SUCURSAL"] == sucursal_activa]
-    else:
-        df_a_procesar = df_filtrado_mes
+    año_actual = obtener_seremi("registro_personal")["año_max"] or datetime.now().year
+    num_dias_mes = calendar.monthrange(año_actual, mes_actual)[1]
+    por_dia = personal_por_dia(mes_actual, sucursal_activa, renombrar={
+        "NOMBRE TRABAJADOR": "nombre_manipulador", "PELO LIMPIO": "pelo_limpio",
+        "AFEITADO": "afeitado", "¿UÑAS CORTAS?": "unas_cortas",
+        "AUSENCIA DE JOYAS": "joyas", "UNIFORME LIMPIO": "uniforme",
+        "COFIA BIEN PUESTA": "cofia", "MASCARILLA": "mascarilla",
+        "SALUD": "salud", "OBSERVACIONES": "acciones_correctivas"
+    })
 
     data_por_sucursal = {}
-    for sucursal, grupo_sucursal in df_a_procesar.groupby("SUCURSAL"):
-        registros_existentes = {}
-        for fecha, grupo_dia in grupo_sucursal.groupby(grupo_sucursal['FECHA'].dt.date):
-            grupo_renombrado = grupo_dia.rename(columns={
-                "NOMBRE TRABAJADOR": "nombre_manipulador", "PELO LIMPIO": "pelo_limpio",
-                "AFEITADO": "afeitado", "¿UÑAS CORTAS?": "unas_cortas",
-                "AUSENCIA DE JOYAS": "joyas", "UNIFORME LIMPIO": "uniforme",
-                "COFIA BIEN PUESTA": "cofia", "MASCARILLA": "mascarilla",
-                "SALUD": "salud", "OBSERVACIONES": "acciones_correctivas"
-            })
-            registros_existentes[fecha] = grupo_renombrado.to_dict(orient="records")
-
+    for sucursal, registros_existentes in por_dia.items():
         registros_mes_completo = {}
-        num_dias_mes = calendar.monthrange(año_actual, mes_actual)[1]
         for dia in range(1, num_dias_mes + 1):
             fecha_actual = datetime(año_actual, mes_actual, dia).date()
             registros_mes_completo[fecha_actual] = registros_existentes.get(fecha_actual, [])
-
-        if registros_mes_completo:
-            data_por_sucursal[sucursal] = registros_mes_completo
+        data_por_sucursal[sucursal] = registros_mes_completo
 
     if permisos_visuales == "TODAS":
-        sucursales = sorted(obtener_datos("registro_personal")["SUCURSAL"].dropna().unique().tolist())
+        sucursales = list(obtener_seremi("registro_personal")["sucursales"])
         sucursales.insert(0, "TODAS")
     else:
         sucursales = permisos_visuales
@@ -355,40 +234,20 @@ def imprimir_temperatura_equipos():
     sucursal_activa, _ = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return "Acceso Denegado", 403
 
-    df = obtener_datos("temperatura_equipos")
-    df_equipos = obtener_datos("equipos_info")
-    df_equipos.columns = df_equipos.columns.str.strip().str.upper()
-    mapa_nombre = dict(zip(df_equipos["ID_EQUIPO"], df_equipos["NOMBRE_EQUIPO"]))
-
-    df.columns = df.columns.str.strip().str.upper()
-    df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors="coerce")
-    df = df.dropna(subset=["FECHA"])
-    df["DIA"] = df["FECHA"].dt.day
-    df["MES"] = df["FECHA"].dt.month
-    df["AÑO"] = df["FECHA"].dt.year
+    mapa_nombre = obtener_seremi("equipos_info")["mapa_nombre"]
 
     mes = int(request.args.get("mes", default=datetime.now().month))
 
-    # 2. FILTRADO OBLIGATORIO
-    if sucursal_activa != "TODAS":
-        df = df[df["SUCURSAL"] == sucursal_activa]
-        
-    df = df[df["MES"] == mes]
-
+    # 2. FILTRADO OBLIGATORIO (la grilla ya viene filtrada por sucursal)
     equipos_data = []
-    for cod_equipo, grupo in df.groupby("EQUIPO"):
+    for cod_equipo, dias in lecturas_equipos(mes, sucursal_activa).items():
         nombre_equipo = mapa_nombre.get(cod_equipo, cod_equipo)
         nombre_mostrado = f"{nombre_equipo} ({cod_equipo})"
         registros = []
 
-        for dia in range(1, 32):
-            registros_dia = grupo[grupo["DIA"] == dia]
-            temps = []
-            responsables = []
-            for _, row in registros_dia.iterrows():
-                temps.append(f"{row['TEMPERATURA C°']}°C ({row['FECHA'].strftime('%H:%M')})")
-                responsable = str(row.get("RESPONSABLE", "")).strip()
-                responsables.append(responsable if responsable else "-")
+        for dia, lecturas in zip(DIAS, dias):
+            temps = [texto for texto, _ in lecturas]
+            responsables = [resp for _, resp in lecturas]
 
             while len(temps) < 3:
                 temps.append("")
@@ -420,52 +279,11 @@ def imprimir_temperatura_productos():
     sucursal_activa, _ = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return "Acceso Denegado", 403
 
-    df = obtener_datos("temperatura_productos")
-
-    df.columns = df.columns.str.strip().str.upper()
-    if 'TEMPERATURA C°' in df.columns:
-        df['TEMPERATURA C°'] = df['TEMPERATURA C°'].astype(str).str.replace(',', '.', regex=False)
-        df['TEMPERATURA C°'] = pd.to_numeric(df['TEMPERATURA C°'], errors='coerce')
-        df.dropna(subset=['TEMPERATURA C°'], inplace=True)
-    
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-    df['DIA'] = df['FECHA'].dt.day
-    df['MES'] = df['FECHA'].dt.month
-    df['HORA'] = df['FECHA'].dt.hour
-    df['RESPONSABLE'] = df['RESPONSABLE'].astype(str)
-
     mes_actual = int(request.args.get("mes", default=datetime.now().month))
     nombre_mes = NOMBRES_MESES[mes_actual - 1].title()
 
-    # 2. FILTRADO OBLIGATORIO
-    if sucursal_activa != "TODAS":
-        df = df[df["SUCURSAL"] == sucursal_activa]
-    
-    df = df[df["MES"] == mes_actual]
-
-    sucursales_data = {}
-    for sucursal_nombre, grupo_sucursal in df.groupby("SUCURSAL"):
-        productos_data = {}
-        for producto_nombre, grupo_producto in grupo_sucursal.groupby("PRODUCTO"):
-            registros_mensuales = []
-            for dia in range(1, 32):
-                registros_dia = grupo_producto[grupo_producto['DIA'] == dia]
-                
-                t_13_row = registros_dia.iloc[(registros_dia['HORA'] - 13).abs().argsort()[:1]]
-                t_17_row = registros_dia.iloc[(registros_dia['HORA'] - 17).abs().argsort()[:1]]
-                t_21_row = registros_dia.iloc[(registros_dia['HORA'] - 21).abs().argsort()[:1]]
-                
-                temp_13 = f"{t_13_row['TEMPERATURA C°'].iloc[0]:.1f}°C" if not t_13_row.empty else ""
-                temp_17 = f"{t_17_row['TEMPERATURA C°'].iloc[0]:.1f}°C" if not t_17_row.empty else ""
-                temp_21 = f"{t_21_row['TEMPERATURA C°'].iloc[0]:.1f}°C" if not t_21_row.empty else ""
-                responsables = " / ".join(registros_dia['RESPONSABLE'].unique()) if not registros_dia.empty else ""
-                
-                registros_mensuales.append({
-                    "dia": f"{dia:02d}", "t_13": temp_13, "t_17": temp_17, "t_21": temp_21, "responsables": responsables
-                })
-            productos_data[producto_nombre] = registros_mensuales
-        sucursales_data[sucursal_nombre] = productos_data
+    # 2. FILTRADO OBLIGATORIO (grilla precalculada del mes)
+    sucursales_data = temperaturas_productos(mes_actual, sucursal_activa, decimales=1)
     
     return render_template("seremi/print_temperatura_productos.html", sucursales_data=sucursales_data, mes=f"{nombre_mes} {datetime.now().year}")
 
@@ -481,65 +299,35 @@ def imprimir_personal():
     sucursal_activa, _ = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return "Acceso Denegado", 403
 
-    df = obtener_datos("registro_personal")
-    df.columns = df.columns.str.strip().str.upper()
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-    df['MES'] = df['FECHA'].dt.month
-    df['AÑO'] = df['FECHA'].dt.year
-
     mes_actual = int(request.args.get("mes", default=datetime.now().month))
     nombre_mes = NOMBRES_MESES[mes_actual - 1].title()
-    año_actual = df['AÑO'].max() if not df.empty else datetime.now().year
+    año_actual = obtener_seremi("registro_personal")["año_max"] or datetime.now().year
 
-    df_filtrado_mes = df[df["MES"] == mes_actual]
-    
-    # 2. FILTRADO OBLIGATORIO
-    if sucursal_activa != "TODAS":
-        df_a_procesar = df_filtrado_mes[df_filtrado_mes["SUCURSAL"] == sucursal_activa]
-    else:
-        df_a_procesar = df_filtrado_mes
-
-    acciones_map = {
-        '¿UÑAS CORTAS?': 'Corregir uñas.', 'AUSENCIA DE JOYAS': 'Retirar joyas.',
-        'UNIFORME LIMPIO': 'Corregir uniforme.', 'COFIA BIEN PUESTA': 'Ajustar cofia.',
-        'MASCARILLA': 'Corregir mascarilla.', 'AFEITADO': 'Afeitar.'
-    }
-    registros_procesados = []
-    for index, row in df_a_procesar.iterrows():
-        acciones = []
-        for columna, mensaje in acciones_map.items():
-            if 'NO CUMPLE' in str(row.get(columna, '')).upper():
-                acciones.append(mensaje)
-        observaciones = str(row.get('OBSERVACIONES', ''))
-        if observaciones and observaciones.lower() != 'nan':
-            acciones.append(observaciones)
-        row['ACCIONES_FINALES'] = ' '.join(acciones)
-        registros_procesados.append(row)
-    df_final = pd.DataFrame(registros_procesados)
-
-    data_para_imprimir = {}
-    if not df_final.empty:
-        for sucursal, grupo_sucursal in df_final.groupby("SUCURSAL"):
-            registros_existentes = {fecha: grupo.to_dict(orient="records") 
-                                    for fecha, grupo in grupo_sucursal.groupby(grupo_sucursal['FECHA'].dt.date)}
-            
-            lista_mes_completo = []
-            num_dias_mes = calendar.monthrange(año_actual, mes_actual)[1]
-
-            for dia in range(1, num_dias_mes + 1):
-                fecha_actual = datetime(año_actual, mes_actual, dia).date()
-                if fecha_actual in registros_existentes:
-                    for registro in registros_existentes[fecha_actual]:
-                        registro['FECHA_EVALUACION'] = fecha_actual
-                        lista_mes_completo.append(registro)
-                else:
-                    lista_mes_completo.append({'FECHA_EVALUACION': fecha_actual, 'is_empty': True})
-            
-            data_para_imprimir[sucursal] = lista_mes_completo
+    # 2. FILTRADO OBLIGATORIO (ACCIONES_FINALES viene calculada desde la carga; los días
+    # sin evaluaciones salen del calendario del mes)
+    data_para_imprimir = calendario_personal(mes_actual, año_actual, sucursal_activa)
 
     return render_template("seremi/print_personal.html", data_para_imprimir=data_para_imprimir, mes=f"{nombre_mes} {año_actual}")
 
+@seremi_bp.route("/personal/resumen")
+@login_requerido
+@permiso_modulo("seremi")
+def resumen_personal():
+    sucursal_activa, permisos_visuales = obtener_filtro_sucursal_seremi()
+    if sucursal_activa is None: return render_template("403.html"), 403
+
+    desde, hasta = rango_resumen(request.args.get("desde"), request.args.get("hasta"))
+    resumen = resumen_cumplimiento(desde, hasta, sucursal_activa)
+
+    if permisos_visuales == "TODAS":
+        sucursales = list(obtener_seremi("registro_personal")["sucursales"])
+        sucursales.insert(0, "TODAS")
+    else:
+        sucursales = permisos_visuales
+
+    return render_template("seremi/resumen_personal.html", resumen=resumen, items=list(ITEMS_PERSONAL.values()),
+                           sucursales=sucursales, sucursal_activa=sucursal_activa, desde=desde, hasta=hasta)
+
 @seremi_bp.route("/cambio_aceite/print")
 @login_requerido
 @permiso_modulo("seremi")
@@ -548,22 +336,8 @@ def imprimir_cambio_aceite():
     sucursal_activa, _ = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return "Acceso Denegado", 403
 
-    df = obtener_datos("cambio_aceite")
-    df.columns = df.columns.str.strip().str.upper()
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-
     # 2. FILTRADO OBLIGATORIO
-    if sucursal_activa != "TODAS":
-        df_a_procesar = df[df["SUCURSAL"] == sucursal_activa]
-    else:
-        df_a_procesar = df
-
-    data_por_sucursal = {}
-    if not df_a_procesar.empty:
-        for sucursal, grupo in df_a_procesar.groupby("SUCURSAL"):
-            grupo_ordenado = grupo.sort_values(by="FECHA", ascending=False).head(20)
-            data_por_sucursal[sucursal] = grupo_ordenado.to_dict(orient="records")
+    data_por_sucursal = cambios_aceite(sucursal_activa)
 
     return render_template("seremi/print_cambio_aceite.html", data_por_sucursal=data_por_sucursal)
 
@@ -577,32 +351,13 @@ def imprimir_recepcion_mercaderia():
     sucursal_activa, _ = obtener_filtro_sucursal_seremi()
     if sucursal_activa is None: return "Acceso Denegado", 403
 
-    df = obtener_datos("recepcion_mercaderia")
-    df.columns = df.columns.str.strip().str.upper()
-    df['FECHA'] = pd.to_datetime(df['FECHA'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
-    df = df.dropna(subset=['FECHA'])
-    df['MES'] = df['FECHA'].dt.month
-
     mes_actual = int(request.args.get("mes", default=datetime.now().month))
-    df_filtrado_mes = df[df["MES"] == mes_actual]
 
     # 2. FILTRADO OBLIGATORIO
-    if sucursal_activa != "TODAS":
-        df_a_procesar = df_filtrado_mes[df_filtrado_mes["SUCURSAL"] == sucursal_activa]
-    else:
-        df_a_procesar = df_filtrado_mes
-
-    data_final = {}
-    if not df_a_procesar.empty:
-        for sucursal, grupo_sucursal in df_a_procesar.groupby("SUCURSAL"):
-            productos_data = {}
-            for producto, grupo_producto in grupo_sucursal.groupby("PRODUCTO"):
-                grupo_ordenado = grupo_producto.sort_values(by="FECHA", ascending=False)
-                productos_data[producto] = grupo_ordenado.to_dict(orient="records")
-            data_final[sucursal] = productos_data
+    data_final = recepciones_mes(mes_actual, sucursal_activa)
 
     nombre_mes = NOMBRES_MESES[mes_actual - 1].title()
-    año = df['FECHA'].dt.year.max() if not df.empty else datetime.now().year
+    año = obtener_seremi("recepcion_mercaderia")["año_max"] or datetime.now().year
 
     return render_template("seremi/print_recepcion_mercaderia.html",
                            data_final=data_final,
@@ -1,13 +1,10 @@
 from flask import Blueprint, render_template, request
 from utils.sheet_cache import obtener_datos
 from utils.filters import filtrar_dataframe
-from services.resumen_service import obtener_resumen_mensual_tabular, MESES
+from services.resumen_service import obtener_resumen_mensual_tabular, MESES, fmt, fmt_miles
 from services.detalle_service import obtener_detalle
 import pandas as pd
-from utils.utils_excel import aplicar_formato_numerico_excel
-from openpyxl import load_workbook
-import io
-from flask import send_file
+from utils.utils_excel import respuesta_exportacion
 from utils.sheet_cache import obtener_fecha_actualizacion
 from utils.auth import login_requerido, permiso_modulo
 from services.ventas_por_dia_service import obtener_detalle_por_dia
@@ -18,6 +15,8 @@ from services.ventas_por_dia_service import obtener_detalle_por_dia
 
 
 ventas_bp = Blueprint("ventas", __name__)
+ventas_bp.add_app_template_filter(fmt, "clp")
+ventas_bp.add_app_template_filter(fmt_miles, "miles")
 
 #@ventas_bp.route("/ventas", methods=["GET"])
 @ventas_bp.route("/ventas", methods=["GET"])
@@ -86,7 +85,8 @@ def ventas():
         semana,
         año,
         filtros["desde"],
-        filtros["hasta"]
+        filtros["hasta"],
+        empresa=empresa
     )
 
     # === Lógica para la nueva pestaña "Detalle por Día" ===
@@ -169,6 +169,7 @@ def descargar_excel():
     filtro_por = request.args.get("filtro_por", "FAMILIA")
     valor = request.args.get("valor", "TODOS")
     tab = request.args.get("tab", "detalle")
+    formato = request.args.get("formato", "xlsx")  # xlsx, csv o csv.gz
 
     # Sanitizar explícitamente
     if desde == "": desde = None
@@ -187,57 +188,28 @@ def descargar_excel():
         "valor": valor
     }
 
-    output = io.BytesIO()
-
     if tab == "detalle":
-        df_filtrado = filtrar_dataframe(df, filtro_por, valor, sucursal, semana, año, desde, hasta)
+        df_filtrado = filtrar_dataframe(df, filtro_por, valor, sucursal, semana, año, desde, hasta, empresa=empresa)
         if df_filtrado.empty:
             return "No hay datos para exportar", 204
 
-        df_filtrado.to_excel(output, index=False)
-        output.seek(0)
-
-        # Formatear usando openpyxl
-        wb = load_workbook(output)
-        ws = wb.active
-        for row in ws.iter_rows(min_row=2, min_col=1):
-            for cell in row:
-                aplicar_formato_numerico_excel(cell)
-
-        output = io.BytesIO()
-        wb.save(output)
+        return respuesta_exportacion(df_filtrado, f"ventas_{tab}", formato)
 
     elif tab == "resumen":
         resumen = obtener_resumen_mensual_tabular(df, filtros)
         if not resumen or not resumen.get("tabla"):
             return "No hay resumen para exportar", 204
 
+        # Los valores ya vienen numéricos: el formato lo pone el Excel
         filas = []
         for item in resumen["tabla"]:
-            neto_f = [float(str(v).replace("$", "").replace(".", "").replace(",", ".").strip()) for v in item["neto"]]
-            unit_f = [float(str(v).replace("$", "").replace(".", "").replace(",", ".").strip()) for v in item["unit"]]
-            cant_f = [int(str(v).replace(".", "").strip()) for v in item["cant"]]
-
-            filas.append(["", item["producto"]] + neto_f + [float(item["total_neto"].replace("$", "").replace(".", "").replace(",", ".").strip())])
-            filas.append(["", ""] + cant_f + [int(item["total_cant"].replace(".", "").strip())])
-            filas.append(["", ""] + unit_f + [float(item["total_unit"].replace("$", "").replace(".", "").replace(",", ".").strip())])
+            filas.append(["", item["producto"]] + item["neto"] + [item["total_neto"]])
+            filas.append(["", ""] + item["cant"] + [item["total_cant"]])
+            filas.append(["", ""] + item["unit"] + [item["total_unit"]])
 
         encabezados = ["Tipo", "Producto"] + MESES + ["Total"]
         df_export = pd.DataFrame(filas, columns=encabezados)
-        df_export.to_excel(output, index=False)
-        output.seek(0)
-
-        wb = load_workbook(output)
-        ws = wb.active
-        for row in ws.iter_rows(min_row=2, min_col=3):  # Desde col C (primer número)
-            for cell in row:
-                aplicar_formato_numerico_excel(cell)
-
-        output = io.BytesIO()
-        wb.save(output)
-
-    output.seek(0)
-    return send_file(output,
-                     download_name=f"ventas_{tab}.xlsx",
-                     as_attachment=True,
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        # Desde col C (primer número)
+        return respuesta_exportacion(df_export, f"ventas_{tab}", formato, columnas_numericas=MESES + ["Total"])
+
+    return "Pestaña no válida", 400
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import uuid
+import threading
+import pandas as pd
+from utils.db import get_db_connection
+from utils.archivos import escribir_atomico
+
+# Importación de ventas agrícolas (export del POS -> ventas_agricola).
+# Corre en un hilo aparte para que los archivos grandes no corten el request: el
+# estado del trabajo se guarda en un JSON en la carpeta temporal, así cualquier
+# worker puede responder el polling de progreso.
+#   1. Normaliza por columna (números con formato latino, FECHA) y arma las tuplas
+#      directo desde las columnas, sin iterrows.
+#   2. Descarta las líneas que ya están en la base (re-subir un archivo que se
+#      traslapa con otra carga no duplica ventas).
+#   3. Inserta en lotes multi-fila dentro de una sola transacción.
+# Dos cargas a la vez (otro usuario u otro worker) se serializan con un lock de MySQL
+# desde la deduplicación hasta el commit, para que no inserten las mismas líneas.
+# Mientras el trabajo corre, un hilo actualiza el 'latido' del estado; si el worker
+# muere (Passenger lo recicla), el estado deja de latir y se reporta como error.
+
+# Columnas del export, en el orden de ventas_agricola (después de carga_id)
+COLUMNAS_ARCHIVO = [
+    "ID_COMANDA", "ESTADO", "ESTADO_STK", "FECHA", "APERTURA", "HORA_PEDID", "HORA_ENTRE",
+    "HORA_ACORD", "CIERRE", "COD_HORARI", "DES_HORARI", "COD_REPART", "DES_REPART", "COD_ZONA",
+    "DES_ZONA", "COD_CLIENT", "DES_CLIENT", "PROPINA", "IMPRESION", "SUBTOTAL", "TOTAL", "T_COMP",
+    "N_COMP", "COD_ARTICU", "DES_ARTICU", "TIPO", "RUBRO", "COD_BODEGA", "DES_BODEGA", "CANTIDAD",
+    "PRECIO", "PRECIO_LIS", "SUB_RENGL", "TOT_RENGL", "HORA_COCI", "ENVIO_COCI", "MODIFICADO",
+    "MOTIVO", "AUTORIZA", "USUARIO", "FECHA_ANU", "HORA_ANU",
+]
+COLUMNAS_NUMERICAS = ['PROPINA', 'SUBTOTAL', 'TOTAL', 'CANTIDAD', 'PRECIO', 'PRECIO_LIS', 'SUB_RENGL', 'TOT_RENGL']
+
+# Una línea de venta se reconoce por estas columnas; las repetidas dentro de una
+# misma comanda (ej: dos veces el mismo artículo) se distinguen por su número de aparición.
+CLAVE_LINEA = ["ID_COMANDA", "N_COMP", "COD_ARTICU", "CANTIDAD", "SUB_RENGL"]
+
+SQL_INSERT = (
+    "INSERT INTO ventas_agricola (carga_id, "
+    + ", ".join(c.lower() for c in COLUMNAS_ARCHIVO)
+    + ") VALUES (" + ",".join(["%s"] * (len(COLUMNAS_ARCHIVO) + 1)) + ")"
+)
+FILAS_POR_LOTE = 5000  # pymysql junta cada executemany en INSERTs multi-fila
+COMANDAS_POR_CONSULTA = 1000
+HORAS_ESTADO = 24  # los estados de trabajos más viejos se borran
+LOCK_MYSQL = "carga_agricola"
+ESPERA_LOCK = 600  # segundos esperando que termine otra carga
+INTERVALO_LATIDO = 10  # segundos
+LATIDO_VENCIDO = 90  # sin latido por más de esto, el trabajo se da por muerto
+ESTADOS_ACTIVOS = ("en_cola", "leyendo", "normalizando", "esperando", "deduplicando", "insertando")
+
+_lock_estado = threading.Lock()
+
+
+# --- Normalización ---
+
+def _limpiar_numero(serie):
+    if serie.dtype == 'object' or pd.api.types.is_string_dtype(serie):
+        # 1. Quitamos signos peso y espacios
+        serie = serie.astype(str).str.replace('$', '', regex=False).str.strip()
+        # 2. Formato Latino: Quitamos punto de miles y cambiamos coma por punto decimal
+        serie = serie.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    return pd.to_numeric(serie, errors='coerce')
+
+
+def _normalizar_fecha(serie):
+    """FECHA como 'YYYY-MM-DD' (None si viene vacía o no se puede leer)."""
+    if not pd.api.types.is_datetime64_any_dtype(serie):
+        # Los vacíos, 0 y "" no se interpretan como fecha
+        con_valor = serie.where(serie.notna() & serie.ne("") & serie.ne(0))
+        fechas = pd.to_datetime(con_valor, errors="coerce")
+        # Formatos mezclados: lo que no calzó con el formato inferido se lee valor a valor
+        faltan = fechas.isna() & con_valor.notna()
+        if faltan.any():
+            fechas[faltan] = pd.to_datetime(con_valor[faltan], errors="coerce", format="mixed")
+        serie = fechas
+    return serie.dt.strftime('%Y-%m-%d').astype(object).where(serie.notna(), None)
+
+
+def _valores(serie):
+    # Valores Python (no numpy) y None en vez de NaN/NaT, listos para pymysql
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+
+def normalizar_archivo(df):
+    """Encabezados en mayúsculas, números y FECHA normalizados por columna."""
+    df = df.copy()
+    df.columns = df.columns.astype(str).str.strip().str.upper()
+    df = df.loc[:, ~df.columns.duplicated()]
+    # Limpiar columnas numéricas para evitar errores de MySQL (Ej: valores como "23,657.00" o "$ 100")
+    for col in COLUMNAS_NUMERICAS:
+        if col in df.columns:
+            df[col] = _limpiar_numero(df[col])
+    if "FECHA" in df.columns:
+        df["FECHA"] = _normalizar_fecha(df["FECHA"])
+    return df
+
+
+def armar_filas(df, carga_id):
+    """Tuplas para SQL_INSERT (carga_id + COLUMNAS_ARCHIVO); las columnas ausentes van en None."""
+    n = len(df)
+    columnas = [[carga_id] * n]
+    for col in COLUMNAS_ARCHIVO:
+        columnas.append(_valores(df[col]) if col in df.columns else [None] * n)
+    return list(zip(*columnas))
+
+
+# --- Deduplicación contra la base ---
+
+def _texto_clave(v):
+    # 123, 123.0 y "123" tienen que dar la misma clave (archivo vs base)
+    if v is None or (isinstance(v, float) and v != v):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v).strip()
+
+
+def _claves_lineas(df):
+    """Clave de cada línea + número de aparición de esa clave (para líneas repetidas)."""
+    partes = []
+    for col in CLAVE_LINEA:
+        serie = df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if col in ("CANTIDAD", "SUB_RENGL"):
+            serie = pd.to_numeric(serie, errors="coerce").round(2).map(lambda v: "" if pd.isna(v) else f"{v:.2f}")
+        else:
+            serie = serie.astype(object).map(_texto_clave)
+        partes.append(serie.reset_index(drop=True))
+    claves = pd.concat(partes, axis=1, keys=CLAVE_LINEA)
+    claves["APARICION"] = claves.groupby(CLAVE_LINEA, sort=False).cumcount()
+    return claves
+
+
+def _lineas_existentes(cursor, comandas):
+    filas = []
+    for i in range(0, len(comandas), COMANDAS_POR_CONSULTA):
+        lote = comandas[i:i + COMANDAS_POR_CONSULTA]
+        cursor.execute(
+            "SELECT id_comanda, n_comp, cod_articu, cantidad, sub_rengl FROM ventas_agricola "
+            "WHERE id_comanda IN (" + ",".join(["%s"] * len(lote)) + ")",
+            lote,
+        )
+        filas.extend(cursor.fetchall())
+    if not filas:
+        return None
+    if isinstance(filas[0], dict):
+        existentes = pd.DataFrame(filas)
+        existentes.columns = existentes.columns.str.upper()
+    else:
+        existentes = pd.DataFrame(filas, columns=CLAVE_LINEA)
+    return existentes
+
+
+def filtrar_lineas_nuevas(cursor, df):
+    """Quita del archivo las líneas que ya existen en ventas_agricola (de otra carga)."""
+    if "ID_COMANDA" not in df.columns or df.empty:
+        return df
+    nuevas = _claves_lineas(df)
+    comandas = [c for c in nuevas["ID_COMANDA"].unique().tolist() if c != ""]
+    existentes = _lineas_existentes(cursor, comandas) if comandas else None
+    if existentes is None:
+        return df
+
+    viejas = _claves_lineas(existentes)
+    # Las líneas sin comanda no se pueden comparar: siempre se insertan
+    ya_cargada = nuevas.merge(viejas.drop_duplicates(), on=CLAVE_LINEA + ["APARICION"], how="left", indicator=True)["_merge"].eq("both")
+    ya_cargada &= nuevas["ID_COMANDA"].ne("").to_numpy()
+    return df[~ya_cargada.to_numpy()]
+
+
+# --- Trabajo en segundo plano ---
+
+def _ruta_estado(carpeta, trabajo_id):
+    return os.path.join(carpeta, f"carga_agricola_{trabajo_id}.json")
+
+
+def _guardar_estado(carpeta, estado, cambios=None):
+    """Aplica 'cambios' al estado, renueva su latido y lo escribe (el hilo de latido también escribe)."""
+    def escribir(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False)
+    with _lock_estado:
+        estado.update(cambios or {}, latido=time.time())
+        escribir_atomico(_ruta_estado(carpeta, estado["trabajo_id"]), escribir)
+
+
+def obtener_estado_carga(carpeta, trabajo_id):
+    """Estado de un trabajo de importación (None si no existe)."""
+    ruta = _ruta_estado(carpeta, os.path.basename(trabajo_id))
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            estado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    latido = estado.get("latido") or estado.get("inicio") or 0
+    if estado.get("estado") in ESTADOS_ACTIVOS and time.time() - latido > LATIDO_VENCIDO:
+        # El worker que la corría murió a mitad de camino: la transacción no alcanzó a
+        # confirmarse, así que no quedó nada insertado
+        estado.update(estado="error", fin=latido, insertadas=0,
+                      error="La importación se interrumpió (se reinició el servidor). No se insertó nada: vuelve a subir el archivo.")
+    return estado
+
+
+def _tomar_lock(cursor):
+    cursor.execute("SELECT GET_LOCK(%s, %s) AS ok", (LOCK_MYSQL, ESPERA_LOCK))
+    fila = cursor.fetchone()
+    ok = fila["ok"] if isinstance(fila, dict) else fila[0]
+    if ok != 1:
+        raise Exception("Hay otra carga agrícola en curso; intenta nuevamente en unos minutos.")
+
+
+def _soltar_lock(cursor):
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_MYSQL,))
+    cursor.fetchone()
+
+
+def _limpiar_estados_viejos(carpeta):
+    limite = time.time() - HORAS_ESTADO * 3600
+    for nombre in os.listdir(carpeta):
+        if nombre.startswith("carga_agricola_") and nombre.endswith(".json"):
+            ruta = os.path.join(carpeta, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+
+def _importar(carpeta, estado, file_path, filename, usuario):
+    def avanzar(**cambios):
+        _guardar_estado(carpeta, estado, cambios)
+
+    terminado = threading.Event()
+
+    def latir():
+        while not terminado.wait(INTERVALO_LATIDO):
+            avanzar()
+
+    threading.Thread(target=latir, name=f"latido-{estado['trabajo_id'][:8]}", daemon=True).start()
+
+    conn = None
+    con_lock = False
+    try:
+        avanzar(estado="leyendo")
+        if filename.endswith('.csv'):
+            df = pd.read_csv(file_path, encoding='utf-8', low_memory=False)
+        else:
+            df = pd.read_excel(file_path)
+
+        avanzar(estado="normalizando", total=len(df))
+        df = normalizar_archivo(df)
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # Desde aquí hasta el commit, una sola carga a la vez entre todos los workers
+        avanzar(estado="esperando")
+        _tomar_lock(cursor)
+        con_lock = True
+        avanzar(estado="deduplicando")
+        nuevas = filtrar_lineas_nuevas(cursor, df)
+        avanzar(omitidas=len(df) - len(nuevas))
+
+        if nuevas.empty:
+            avanzar(estado="listo", fin=time.time(),
+                    mensaje=f"Las {len(df)} líneas del archivo ya estaban cargadas: no se insertó nada.")
+            return
+
+        cursor.execute(
+            "INSERT INTO cargas_agricola (nombre_archivo, registros_insertados, usuario) VALUES (%s, %s, %s)",
+            (filename, len(nuevas), usuario)
+        )
+        carga_id = cursor.lastrowid
+        filas = armar_filas(nuevas, carga_id)
+
+        avanzar(estado="insertando", carga_id=carga_id)
+        for i in range(0, len(filas), FILAS_POR_LOTE):
+            cursor.executemany(SQL_INSERT, filas[i:i + FILAS_POR_LOTE])
+            avanzar(insertadas=min(i + FILAS_POR_LOTE, len(filas)))
+
+        conn.commit()
+        mensaje = f"Se procesaron {len(nuevas)} registros exitosamente."
+        if estado["omitidas"]:
+            mensaje += f" Se omitieron {estado['omitidas']} líneas que ya estaban cargadas."
+        avanzar(estado="listo", fin=time.time(), mensaje=mensaje)
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+        print(f"⚠️ Error importando ventas agrícolas ({filename}): {e}")
+        avanzar(estado="error", fin=time.time(), error=str(e), insertadas=0)
+    finally:
+        terminado.set()
+        if conn is not None:
+            if con_lock:
+                try:
+                    _soltar_lock(conn.cursor())
+                except Exception as e:
+                    print(f"⚠️ No se pudo liberar el lock de la carga agrícola (se libera al cerrar): {e}")
+            conn.close()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def iniciar_carga_agricola(carpeta, file_path, filename, usuario):
+    """Lanza la importación en un hilo y retorna el id del trabajo para consultar su avance."""
+    _limpiar_estados_viejos(carpeta)
+    estado = {
+        "trabajo_id": uuid.uuid4().hex,
+        "archivo": filename,
+        "estado": "en_cola",
+        "inicio": time.time(),
+        "fin": None,
+        "total": None,
+        "omitidas": 0,
+        "insertadas": 0,
+        "carga_id": None,
+        "mensaje": None,
+        "error": None,
+        "latido": time.time(),
+    }
+    _guardar_estado(carpeta, estado)
+    threading.Thread(target=_importar, args=(carpeta, estado, file_path, filename, usuario),
+                     name=f"carga-agricola-{estado['trabajo_id'][:8]}", daemon=True).start()
+    return estado["trabajo_id"]
@@ -0,0 +1,564 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from utils.db import get_db_connection
+from utils.sheet_cache import obtener_datos, obtener_derivado
+from utils.costeo_manager import cargar_reglas, obtener_costos_as_of, obtener_prorrateo_adm
+from utils.mayor_periodos import obtener_mayor_normalizado, obtener_periodo_mayor
+from services.prorrateo_service import calcular_matriz_gestion_cacheada
+
+# Motor de costeo por sucursal.
+# El trabajo se separa en dos etapas para poder costear muchas (período, sucursal,
+# escenario) de una vez:
+#   - preparar_periodo_costeo: lo que es igual para todas las sucursales del mes
+#     (ventas agregadas, prorrateos del mayor, costo de la empanada, filas de SS.GG/ADM).
+#   - costear_sucursal: reparte gastos y GAV de una sucursal; no toca archivos ni
+#     Flask, así que se puede correr en otro proceso.
+# Por defecto se costea en serie. COSTEO_PROCESOS=N (N > 1) activa un pool de N procesos,
+# uno solo por worker y reutilizado entre requests. Los procesos salen de "forkserver"
+# (o "spawn" donde no existe), no de un fork del worker: el worker tiene hilos de
+# refresco y locks tomados que un fork copiaría.
+PROCESOS_COSTEO = max(1, int(os.environ.get("COSTEO_PROCESOS", "1") or 1))
+MIN_TAREAS_PARALELO = 8  # Con menos tareas, repartirlas cuesta más de lo que ahorra
+
+# Centros que se reparten por SS.GG / ADM / Fábrica: no se reportan como "sin sucursal"
+CENTROS_CORPORATIVOS = ("SERVICIOS GENERALES", "ADMINISTRACION", "FCA", "FABRICA")
+TTL_SUCURSALES_BD = 600  # segundos
+
+_sucursales_bd = {"nombres": [], "ts": 0.0}
+_lock_alias = threading.Lock()
+_pool = {"executor": None, "procesos": 0}
+_lock_pool = threading.Lock()
+
+
+def obtener_alias_sucursal(sucursal):
+    s = str(sucursal).upper().strip().replace("Ñ", "N")
+    alias = [s]
+    if "FOOD" in s or "ESC" in s or "MILITAR" in s:
+        alias.extend(["ESC. MILITAR", "ESCUELA MILITAR", "FOOD TRUCK", "FOODTRUCK"])
+    if "WEB" in s:
+        alias.extend(["WEB", "PAGINA WEB", "PAGINAWEB"])
+    if "COSTANERA" in s:
+        alias.extend(["COSTANERA", "COSTANERA CENTER"])
+    if "EGANA" in s or "EGAÑA" in s:
+        alias.extend(["PLAZA EGANA", "PLAZA EGAÑA"])
+    return list(set(alias))
+
+
+# --- Índice de alias: centro de costo -> sucursales ---
+# Se arma una vez por snapshot del mayor (vía obtener_derivado) para un conjunto de
+# sucursales. Cada CENTRO COSTO normalizado distinto recibe un código y una fila de
+# la matriz "coincide" (código × sucursal), con la misma regla de substrings de
+# siempre; la máscara de una sucursal es coincide[codigos, j]. Los centros nuevos que
+# aparecen después (p.ej. destinos de reglas de prorrateo) se agregan al vuelo.
+def normalizar_centro(serie):
+    return serie.astype(str).str.upper().str.strip().str.replace("Ñ", "N", regex=False)
+
+
+def _coincide(centro, aliases):
+    return any((a in centro or centro in a) for a in aliases) if str(centro).strip() else False
+
+
+def _agregar_centros(indice, centros):
+    nuevos = [cc for cc in dict.fromkeys(centros) if cc not in indice["codigos"]]
+    if not nuevos:
+        return
+    filas = np.array([[_coincide(cc, a) for a in indice["alias"]] for cc in nuevos], dtype=bool)
+    filas = filas.reshape(len(nuevos), len(indice["sucursales"]))
+    base = len(indice["codigos"])
+    for i, cc in enumerate(nuevos):
+        indice["codigos"][cc] = base + i
+        sucursales = [indice["sucursales"][j] for j in np.flatnonzero(filas[i])]
+        indice["canonica"][cc] = sucursales[0] if sucursales else None
+    indice["coincide"] = np.vstack([indice["coincide"], filas])
+
+
+def construir_indice_alias(centros, sucursales):
+    sucursales = list(sucursales)
+    indice = {
+        "sucursales": sucursales,
+        "posicion": {s: j for j, s in enumerate(sucursales)},
+        "alias": [obtener_alias_sucursal(s) for s in sucursales],
+        "codigos": {},
+        "canonica": {},  # centro normalizado -> primera sucursal que coincide (o None)
+        "coincide": np.zeros((0, len(sucursales)), dtype=bool),
+    }
+    _agregar_centros(indice, centros)
+    return indice
+
+
+def codificar_centros(indice, centros_norm):
+    """Código de cada centro normalizado (agrega al índice los que falten)."""
+    with _lock_alias:
+        _agregar_centros(indice, centros_norm.unique())
+    return centros_norm.map(indice["codigos"]).to_numpy(dtype=np.int64)
+
+
+def _nombres_sucursales_bd():
+    """Nombres de la tabla Sucursales (se consultan cada TTL_SUCURSALES_BD)."""
+    if time.time() - _sucursales_bd["ts"] < TTL_SUCURSALES_BD:
+        return _sucursales_bd["nombres"]
+    nombres = _sucursales_bd["nombres"]
+    try:
+        conn = get_db_connection(connect_timeout=3)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT nombre_sucursal FROM Sucursales ORDER BY nombre_sucursal")
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        nombres = [r["nombre_sucursal"] if isinstance(r, dict) else r[0] for r in rows]
+        nombres = [n for n in nombres if n]
+    except Exception as e:
+        print(f"⚠️ No se pudo leer la tabla Sucursales para los alias: {e}")
+    _sucursales_bd.update(nombres=nombres, ts=time.time())
+    return nombres
+
+
+def obtener_indice_alias(sucursales):
+    """Índice de alias del snapshot actual del mayor para esas sucursales."""
+    clave = tuple(sucursales)
+    indices = obtener_derivado("mayor", "indice_alias", lambda df: {})
+    with _lock_alias:
+        indice = indices.get(clave)
+        if indice is None:
+            completo = obtener_mayor_normalizado()["completo"]
+            centros = normalizar_centro(pd.Series(completo["CENTRO COSTO"].unique())) if not completo.empty else pd.Series(dtype=str)
+            indice = indices[clave] = construir_indice_alias(centros.unique(), clave)
+    return indice
+
+
+def universo_sucursales(sucursales_ventas, extra=()):
+    """Sucursales de las ventas + tabla Sucursales + las pedidas, sin repetir."""
+    return tuple(sorted(set(sucursales_ventas) | set(_nombres_sucursales_bd()) | set(extra)))
+
+
+def centros_sin_sucursal(indice):
+    """
+    Centros de costo del mayor que no coinciden con ninguna sucursal (sin contar los
+    corporativos), con su cantidad de movimientos y gastos (cuentas 3). Se calcula una
+    vez por índice.
+    """
+    if "sin_sucursal" in indice:
+        return indice["sin_sucursal"]
+    completo = obtener_mayor_normalizado()["completo"]
+    if completo.empty:
+        return []
+    gastos = completo["SALDO_REAL"].where(completo["CLASE"] == "3", 0)
+    resumen = pd.DataFrame({"movimientos": 1, "gastos": gastos}).groupby(completo["CENTRO COSTO"].to_numpy()).sum()
+    normalizados = normalizar_centro(pd.Series(resumen.index, index=resumen.index))
+    codigos = codificar_centros(indice, normalizados)
+    sin_match = ~indice["coincide"][codigos].any(axis=1)
+    corporativo = normalizados.str.contains("|".join(CENTROS_CORPORATIVOS), regex=True).to_numpy()
+    filas = resumen[sin_match & ~corporativo]
+    indice["sin_sucursal"] = [
+        {"centro": str(cc), "movimientos": int(r["movimientos"]), "gastos": float(r["gastos"])}
+        for cc, r in filas.sort_values("gastos").iterrows()
+    ]
+    return indice["sin_sucursal"]
+
+
+def _clave_periodo(periodo):
+    """'YYYY-MM' -> YYYYMM, o None si el texto no es un período válido."""
+    try:
+        año, mes = (int(x) for x in str(periodo).split("-"))
+    except ValueError:
+        return None
+    return año * 100 + mes if f"{año:04d}-{mes:02d}" == periodo else None
+
+
+def _periodos_ventas(df_ventas_raw):
+    """YYYYMM de cada venta (None si la fuente no tiene fechas)."""
+    if df_ventas_raw.empty or "FECHA" not in df_ventas_raw.columns:
+        return None
+    fechas = pd.to_datetime(df_ventas_raw["FECHA"], errors="coerce")
+    return fechas.dt.year * 100 + fechas.dt.month
+
+
+def preparar_periodo_costeo(periodo, df_ventas_raw, claves_ventas, mayor_disponible, data_config, indice_alias):
+    """Datos del mes compartidos por todas las sucursales."""
+    datos = {
+        "periodo": periodo,
+        "ventas": {},
+        "gastos": None,
+        "filas_sg": [],
+        "filas_adm": [],
+        "hay_procesado": False,
+        "costo_uni_emp": 0.0,
+    }
+
+    # 1. Ventas del mes agregadas por sucursal y producto
+    df_periodo = pd.DataFrame()
+    if claves_ventas is not None:
+        clave = _clave_periodo(periodo)
+        df_periodo = df_ventas_raw[claves_ventas == clave] if clave else df_ventas_raw.iloc[0:0]
+        if not df_periodo.empty:
+            if "FAMILIA" not in df_periodo.columns:
+                df_periodo = df_periodo.assign(FAMILIA="SIN FAMILIA")
+            agrupado = df_periodo.groupby(["SUCURSAL", "DESCRIPCION", "FAMILIA"]).agg({"NETO": "sum", "CANTIDAD": "sum"}).reset_index()
+            for suc, grupo in agrupado.groupby("SUCURSAL", sort=False):
+                datos["ventas"][suc] = list(zip(grupo["DESCRIPCION"], grupo["FAMILIA"], grupo["NETO"], grupo["CANTIDAD"]))
+
+    # 2. Mayor del mes con prorrateos (Juguera Gerencial: SG apagado, Fábrica encendida)
+    df_procesado = pd.DataFrame()
+    if mayor_disponible:
+        df_mes = obtener_periodo_mayor(periodo)
+        if not df_mes.empty:
+            df_mes["CENTRO COSTO"] = df_mes["CENTRO COSTO"].str.upper()
+            df_procesado = calcular_matriz_gestion_cacheada(df_mes, periodo, switch_sg=False, switch_fab=True, data_config=data_config, variante="costeo")
+
+    if not df_procesado.empty and "CUENTA" in df_procesado.columns and "CENTRO COSTO" in df_procesado.columns:
+        datos["hay_procesado"] = True
+        es_gasto = df_procesado["CUENTA"].str.startswith("3")
+        gastos = df_procesado.loc[es_gasto, ["CUENTA", "NOMBRE", "SALDO_REAL"]].copy()
+        gastos["CC_COD"] = codificar_centros(indice_alias, normalizar_centro(df_procesado.loc[es_gasto, "CENTRO COSTO"]))
+        datos["gastos"] = gastos
+
+        for nombre, texto in (("filas_sg", "SERVICIOS GENERALES"), ("filas_adm", "ADMINISTRACION")):
+            filas = df_procesado[es_gasto & df_procesado["CENTRO COSTO"].str.contains(texto, na=False)]
+            datos[nombre] = list(zip(filas["CUENTA"], filas["NOMBRE"], filas["SALDO_REAL"]))
+
+    # 3. EMPANADA DE QUESO FRITA: Costo Estándar Global (igual para todas las sucursales)
+    if not df_procesado.empty and "CUENTA" in df_procesado.columns:
+        costo_fabrica_global = abs(df_procesado[df_procesado["CUENTA"].astype(str).str.strip() == "3101002"]["SALDO_REAL"].sum())
+        empanadas_elaboradas = float(data_config.get("fabrica_empanadas", {}).get("costeo_periodos", {}).get(periodo, {}).get("empanadas_elaboradas", 0))
+
+        if empanadas_elaboradas > 0:
+            datos["costo_uni_emp"] = costo_fabrica_global / empanadas_elaboradas
+        else:
+            # Fallback: total de empanadas fritas vendidas globalmente si no hay dato de producción
+            if not df_periodo.empty:
+                unidades_global_emp = df_periodo[df_periodo["DESCRIPCION"].astype(str).str.upper().str.contains("EMPANADA DE QUESO FRITA", na=False)]["CANTIDAD"].sum()
+                if unidades_global_emp > 0:
+                    datos["costo_uni_emp"] = costo_fabrica_global / unidades_global_emp
+
+    # 4. Regla de SG vigente (con herencia histórica)
+    pool_sg = {}
+    for p_key, d in data_config.get("reglas_mensuales", {}).items():
+        if "serv_generales" in d: pool_sg[p_key] = d["serv_generales"]
+    ants = [p_key for p_key in pool_sg.keys() if p_key <= periodo]
+    datos["regla_efectiva_sg"] = pool_sg[max(ants)] if ants else {}
+    return datos
+
+
+def costear_sucursal(datos, sucursal, centros_sucursal, reglas_gastos, costos_directos, prorrateo_adm):
+    """
+    Rentabilidad de una sucursal en el mes de 'datos'. 'centros_sucursal' es la
+    columna del índice de alias de la sucursal (código de centro -> coincide). Retorna (resultados,
+    total_ingreso, total_gasto, gasto_asignado, gastos_cuenta, gastos_no_asignados,
+    total_costo_directo, total_margen_op).
+    """
+    ventas_prod = {}
+    for descripcion, familia, neto, cantidad in datos["ventas"].get(sucursal, []):
+        if cantidad > 0:
+            ventas_prod[descripcion] = {
+                "familia": str(familia).strip().upper(),
+                "ingreso": float(neto),
+                "unidades": float(cantidad),
+                "gasto_asignado": 0.0,
+                    "desglose_gastos": {},
+                    "gav_asignado": 0.0,
+                    "desglose_gav": {}
+            }
+
+    # Gastos (3) propios de la sucursal (Búsqueda Flexible)
+    gastos_cuenta = {}
+    costo_total_piz = 0.0
+    aliases_suc = obtener_alias_sucursal(sucursal)
+    df_gastos = pd.DataFrame()
+    if datos["gastos"] is not None:
+        gastos = datos["gastos"]
+        df_gastos = gastos[centros_sucursal[gastos["CC_COD"].to_numpy()]].copy()
+
+    if not df_gastos.empty:
+        df_gastos["DISPLAY"] = df_gastos["CUENTA"] + " - " + df_gastos["NOMBRE"]
+
+        for _, row in df_gastos.groupby(["CUENTA", "DISPLAY"])["SALDO_REAL"].sum().reset_index().iterrows():
+            # Los gastos en SALDO_REAL son negativos. Pasamos a absoluto.
+            saldo_positivo = abs(float(row["SALDO_REAL"]))
+            if saldo_positivo > 0:
+                cuenta_str = str(row["CUENTA"]).strip()
+                if cuenta_str == "3101002":
+                    pass # Excluido de fijos locales: el costo de la empanada frita ahora es un Costo Estándar Global
+                elif cuenta_str == "3101003":
+                    costo_total_piz += saldo_positivo
+                else:
+                    gastos_cuenta[row["DISPLAY"]] = saldo_positivo
+
+    costo_uni_emp = datos["costo_uni_emp"]
+
+    # 2. PIZZA: Costo Directo Local (Mantiene la regla anterior)
+    unidades_piz = sum(d["unidades"] for d in ventas_prod.values() if "PIZZA" in d["familia"])
+    costo_uni_piz = costo_total_piz / unidades_piz if unidades_piz > 0 else 0
+
+    # 4. Aplicar reglas
+    gastos_no_asignados = {}
+
+    for cta_display, monto_gasto in gastos_cuenta.items():
+        regla = reglas_gastos.get(cta_display)
+        
+        # Fallback inteligente: Si el motor renombró la cuenta, buscar por código numérico
+        if not regla:
+            codigo_cuenta = str(cta_display).split(" - ")[0].strip()
+            for key_json, rule_json in reglas_gastos.items():
+                if str(key_json).startswith(codigo_cuenta + " -"):
+                    regla = rule_json
+                    break
+                    
+        if not regla:
+            gastos_no_asignados[cta_display] = {"monto": monto_gasto, "motivo": "Sin regla configurada en el Paso 3"}
+            continue
+        
+        alcance = regla.get("alcance", "global")
+        metodo = regla.get("metodo", "venta_dinero")
+
+        if metodo == "porcentaje_manual":
+            porcentajes = regla.get("porcentajes", {})
+            sum_pct = 0.0
+            
+            # 1. Asignar a los manuales específicos
+            for p, pct_val in porcentajes.items():
+                if p in ventas_prod and ventas_prod[p]["unidades"] > 0:
+                    try:
+                        pct_decimal = min(float(pct_val) / 100.0, 1.0)
+                    except ValueError:
+                        pct_decimal = 0.0
+                    
+                    if pct_decimal > 0:
+                        sum_pct += pct_decimal
+                        asignado = monto_gasto * pct_decimal
+                        ventas_prod[p]["gasto_asignado"] += asignado
+                        ventas_prod[p]["desglose_gastos"][cta_display] = asignado
+            
+            # 2. El resto (Híbrido) se reparte por ingresos ($) a los demás
+            resto_pct = max(0.0, 1.0 - sum_pct)
+            monto_resto = monto_gasto * resto_pct
+            
+            if monto_resto > 0:
+                prods_resto = [p for p in ventas_prod.keys() if p not in porcentajes and ventas_prod[p]["unidades"] > 0]
+                base_total = sum(ventas_prod[p]["ingreso"] for p in prods_resto)
+                
+                if base_total > 0:
+                    for p in prods_resto:
+                        proporcion = ventas_prod[p]["ingreso"] / base_total
+                        asignado = monto_resto * proporcion
+                        ventas_prod[p]["gasto_asignado"] += asignado
+                        ventas_prod[p]["desglose_gastos"][f"{cta_display} (Resto Híbrido)"] = asignado
+                else:
+                    gastos_no_asignados[f"{cta_display} (Resto Híbrido)"] = {"monto": monto_resto, "motivo": "Resto del híbrido sin ingresos en otros productos"}
+            continue
+
+        afectados = regla.get("productos_afectados", []) if alcance == "especifico" else list(ventas_prod.keys())
+        
+        prods_validos = [p for p in afectados if p in ventas_prod and ventas_prod[p]["unidades"] > 0]
+        if not prods_validos:
+            gastos_no_asignados[cta_display] = {"monto": monto_gasto, "motivo": "Productos afectados no tienen ventas este mes"}
+            continue
+            
+        if metodo == "venta_dinero":
+            base_total = sum(ventas_prod[p]["ingreso"] for p in prods_validos)
+        else:
+            base_total = sum(ventas_prod[p]["unidades"] for p in prods_validos)
+            
+        if base_total == 0:
+            gastos_no_asignados[cta_display] = {"monto": monto_gasto, "motivo": "Base de reparto (ventas/volumen) es 0"}
+            continue
+            
+        for p in prods_validos:
+            base_prod = ventas_prod[p]["ingreso"] if metodo == "venta_dinero" else ventas_prod[p]["unidades"]
+            proporcion = base_prod / base_total
+            asignado = monto_gasto * proporcion
+            ventas_prod[p]["gasto_asignado"] += asignado
+            ventas_prod[p]["desglose_gastos"][cta_display] = asignado
+
+    # ========================================================
+    # 5. NUEVO CÁLCULO GAV (SG + ADMINISTRACIÓN)
+    # ========================================================
+    total_gav_sucursal = 0.0
+    desglose_gav_total = {}
+
+    # A. SG (Histórico desde el motor gerencial)
+    regla_efectiva_sg = datos["regla_efectiva_sg"]
+
+    if datos["hay_procesado"]:
+        # % de la sucursal en cada cuenta de la regla: primera clave que coincide con sus alias
+        pct_por_cuenta = {}
+        for cta_nombre, distribucion in regla_efectiva_sg.items():
+            for branch_key, val in distribucion.items():
+                b_search = branch_key.upper().strip().replace("Ñ", "N")
+                if any(a in b_search or b_search in a for a in aliases_suc):
+                    pct_por_cuenta[cta_nombre] = float(val)
+                    break
+
+        for cuenta, nombre, saldo in datos["filas_sg"]:
+            monto = abs(float(saldo))
+            pct = pct_por_cuenta.get(str(nombre), 0.0)
+            if pct > 0:
+                asignado = monto * pct
+                total_gav_sucursal += asignado
+                desglose_gav_total[f"{cuenta} - {nombre} (SS.GG)"] = asignado
+
+        # B. Administración (Desde la nueva pestaña)
+        pct_adm = float(prorrateo_adm.get(sucursal, 0)) / 100.0
+        for cuenta, nombre, saldo in datos["filas_adm"]:
+            monto = abs(float(saldo))
+            if pct_adm > 0 and monto > 0:
+                asignado = monto * pct_adm
+                total_gav_sucursal += asignado
+                desglose_gav_total[f"{cuenta} - {nombre} (ADM)"] = asignado
+
+    # C. Distribuir el GAV total en base al Ingreso ($)
+    total_ingreso_sucursal = sum(p["ingreso"] for p in ventas_prod.values())
+    
+    for p, data in ventas_prod.items():
+        proporcion_ingreso = data["ingreso"] / total_ingreso_sucursal if total_ingreso_sucursal > 0 else 0
+        data["gav_asignado"] = total_gav_sucursal * proporcion_ingreso
+        data["desglose_gav"] = {k: v * proporcion_ingreso for k, v in desglose_gav_total.items()}
+
+    # 5. Formatear vista
+    resultados = []
+    total_gasto_sucursal = sum(gastos_cuenta.values())
+
+    gasto_asignado_total = sum(p["gasto_asignado"] for p in ventas_prod.values())
+    total_costo_directo = 0.0
+    total_margen_op = 0.0
+
+    for prod, data in ventas_prod.items():
+        uni = data["unidades"]
+        ing = data["ingreso"]
+        precio_prom = ing / uni
+        familia = data.get("familia", "") # e.g., "PIZZA"
+
+        # Nueva lógica de Costo Directo con prioridades
+        # 1. El costo manual (Paso 2) tiene la máxima prioridad (si es mayor a 0).
+        costo_manual = costos_directos.get(prod)
+
+        if costo_manual is not None and float(costo_manual) > 0:
+            c_dir_uni = float(costo_manual)
+        else:
+            # 2. Si no hay costo manual, se aplica la lógica automática.
+            if "EMPANADA DE QUESO FRITA" in prod.upper():
+                c_dir_uni = costo_uni_emp
+            elif "PIZZA" in familia:
+                c_dir_uni = costo_uni_piz
+            else:
+                # 3. Si no hay costo manual ni regla automática, el costo es 0.
+                c_dir_uni = 0.0
+
+        c_dir_tot = c_dir_uni * uni
+        total_costo_directo += c_dir_tot
+        
+        margen_op_uni = precio_prom - c_dir_uni
+        margen_op_pct = (margen_op_uni / precio_prom * 100) if precio_prom > 0 else 0
+        total_margen_op += (margen_op_uni * uni)
+        
+        g_asig_tot = data["gasto_asignado"]
+        g_asig_uni = g_asig_tot / uni
+        gav_tot = data["gav_asignado"]
+        gav_uni = gav_tot / uni
+        c_tot_uni = c_dir_uni + g_asig_uni + gav_uni
+        margen_uni = precio_prom - c_tot_uni
+        margen_pct = (margen_uni / precio_prom * 100) if precio_prom > 0 else 0
+        
+        resultados.append({
+            "producto": prod,
+            "unidades": int(uni),
+            "ingreso": ing,
+            "precio_prom": precio_prom,
+            "costo_directo_uni": c_dir_uni,
+            "margen_op_uni": margen_op_uni,
+            "margen_op_pct": margen_op_pct,
+            "gasto_fijo_uni": g_asig_uni,
+            "gasto_fijo_tot": g_asig_tot,
+            "gav_uni": gav_uni,
+            "gav_tot": gav_tot,
+            "costo_total_uni": c_tot_uni,
+            "margen_uni": margen_uni,
+            "margen_pct": margen_pct,
+            "desglose": data["desglose_gastos"],
+            "desglose_gav": data["desglose_gav"]
+        })
+
+    resultados.sort(key=lambda x: x["ingreso"], reverse=True)
+
+    return resultados, total_ingreso_sucursal, total_gasto_sucursal, gasto_asignado_total, gastos_cuenta, gastos_no_asignados, total_costo_directo, total_margen_op
+
+
+def _costear_tarea(tarea):
+    return costear_sucursal(*tarea)
+
+
+def _obtener_pool(procesos):
+    """Pool de procesos del worker (se crea la primera vez y se reutiliza)."""
+    with _lock_pool:
+        if _pool["executor"] is None:
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool["executor"] = ProcessPoolExecutor(max_workers=procesos,
+                                                    mp_context=multiprocessing.get_context(metodo))
+            _pool["procesos"] = procesos
+        return _pool["executor"], _pool["procesos"]
+
+
+def _descartar_pool(executor):
+    with _lock_pool:
+        if _pool["executor"] is executor:
+            _pool["executor"] = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _ejecutar(tareas, procesos):
+    """Corre las tareas en el pool de procesos si está activado y vale la pena; si no (o si falla), en serie."""
+    if procesos > 1 and len(tareas) >= MIN_TAREAS_PARALELO:
+        executor = None
+        try:
+            executor, n = _obtener_pool(procesos)
+            return list(executor.map(_costear_tarea, tareas, chunksize=max(1, len(tareas) // (n * 4))))
+        except Exception as e:
+            print(f"⚠️ Costeo en paralelo no disponible, se calcula en serie: {e}")
+            if executor is not None:
+                _descartar_pool(executor)
+    return [_costear_tarea(t) for t in tareas]
+
+
+def correr_motor_costeo_lote(combinaciones, data_config, procesos=None):
+    """
+    Costea muchas combinaciones (periodo, sucursal, escenario) de una vez: las
+    fuentes, los prorrateos y las reglas se leen una sola vez y cada mes se prepara
+    una sola vez. Una sucursal vacía se reemplaza por la primera disponible.
+    Retorna (sucursales, [((periodo, sucursal, escenario), resultado), ...], centros de
+    costo sin sucursal).
+    """
+    df_ventas_raw = obtener_datos("comercial")
+    sucursales = []
+    if not df_ventas_raw.empty and "SUCURSAL" in df_ventas_raw.columns:
+        sucursales = sorted(df_ventas_raw["SUCURSAL"].dropna().unique().tolist())
+    combinaciones = [(p, s or (sucursales[0] if sucursales else s), e) for p, s, e in combinaciones]
+
+    claves_ventas = _periodos_ventas(df_ventas_raw)
+    df_mayor_raw = obtener_datos("mayor")
+    mayor_disponible = not df_mayor_raw.empty and "FECHA" in df_mayor_raw.columns
+    indice_alias = obtener_indice_alias(universo_sucursales(sucursales, (s for _, s, _ in combinaciones)))
+
+    reglas_gastos_todas = cargar_reglas().get("reglas_gastos", {})
+    prorrateo_adm = obtener_prorrateo_adm()
+    costos_por_periodo = obtener_costos_as_of(p for p, _, _ in combinaciones)
+    por_periodo = {}
+    for periodo, (costos_directos, _) in costos_por_periodo.items():
+        datos = preparar_periodo_costeo(periodo, df_ventas_raw, claves_ventas, mayor_disponible, data_config, indice_alias)
+        por_periodo[periodo] = (datos, costos_directos)
+
+    tareas = []
+    for periodo, sucursal, escenario in combinaciones:
+        datos, costos_directos = por_periodo[periodo]
+        # Cada tarea lleva solo las ventas de su sucursal
+        datos_sucursal = dict(datos, ventas={sucursal: datos["ventas"].get(sucursal, [])})
+        reglas_gastos = reglas_gastos_todas.get(sucursal, {}).get(escenario, {})
+        centros_sucursal = indice_alias["coincide"][:, indice_alias["posicion"][sucursal]]
+        tareas.append((datos_sucursal, sucursal, centros_sucursal, reglas_gastos, costos_directos, prorrateo_adm))
+
+    resultados = _ejecutar(tareas, PROCESOS_COSTEO if procesos is None else procesos)
+    return sucursales, list(zip(combinaciones, resultados)), centros_sin_sucursal(indice_alias)
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from utils.sheet_cache import obtener_derivado, registrar_derivado
+from utils.filters import construir_indice_filtros, filtrar_con_indice
+
+# Cubo de ventas preagregado para el dashboard.
+#   - diario: NETO/CANTIDAD sumados por día × sucursal × familia × producto. Acepta los
+#     mismos filtros que el detalle (índice de utils.filters) y es mucho más chico.
+#   - semanal / mensual: rollups por (AÑO, SEMANA) y (año, mes) × sucursal × familia,
+#     para las tendencias y el histórico, que solo filtran por familia y sucursal.
+# Se construye al publicar cada snapshot (registrar_derivado). Al recargar, solo se
+# vuelven a agregar los días cuyo contenido cambió: cada día tiene una huella (suma
+# de hashes de sus filas) y los días con la misma huella se copian del cubo anterior.
+CLAVES_DIARIAS = ["FECHA", "SUCURSAL", "FAMILIA", "DESCRIPCION", "AÑO", "SEMANA"]
+COLUMNAS_HUELLA = ["FECHA", "SUCURSAL", "FAMILIA", "DESCRIPCION", "NETO", "CANTIDAD"]
+MEDIDAS = ["NETO", "CANTIDAD"]
+AGRUPACIONES = {"semanal": ["AÑO", "SEMANA"], "mensual": ["AÑO_DT", "MES"]}
+
+_ultimo_cubo = {}  # empresa -> cubo anterior, base de la reconstrucción incremental
+
+
+def _hash_columna(serie):
+    # Hashear solo los valores únicos y repartirlos por código es mucho más barato
+    # que hashear cada string; los nulos (código -1) caen en el último elemento.
+    codigos, unicos = pd.factorize(serie)
+    hashes = pd.util.hash_array(np.asarray(unicos, dtype=object)) if len(unicos) else np.array([], dtype=np.uint64)
+    return np.append(hashes, np.uint64(0))[codigos]
+
+
+def _huellas_por_dia(df):
+    fila = np.zeros(len(df), dtype=np.uint64)
+    for col in COLUMNAS_HUELLA:
+        serie = df[col]
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_datetime64_any_dtype(serie):
+            hashes = pd.util.hash_array(serie.to_numpy())
+        else:
+            hashes = _hash_columna(serie)
+        fila = fila * np.uint64(1000003) ^ hashes
+    return pd.Series(fila).groupby(df["FECHA"].to_numpy()).agg(["sum", "size"])
+
+
+def _agregar_diario(df):
+    return (
+        df.groupby(CLAVES_DIARIAS, dropna=False, sort=False, observed=True)[MEDIDAS]
+        .sum()
+        .reset_index()
+    )
+
+
+def _ordenar(diario):
+    return diario.sort_values("FECHA", kind="stable", na_position="last").reset_index(drop=True)
+
+
+def construir_cubo(empresa, df):
+    """Construye (o actualiza a partir del anterior) el cubo de ventas de una fuente."""
+    huellas = _huellas_por_dia(df)
+    previo = _ultimo_cubo.get(empresa)
+
+    # Ordenado por fecha (sin fecha al final), los rangos de fechas del índice son slices
+    if previo is None:
+        diario = _ordenar(_agregar_diario(df))
+        dias_recalculados = len(huellas)
+    else:
+        comunes = huellas.index.intersection(previo["huellas"].index)
+        iguales = (previo["huellas"].loc[comunes] == huellas.loc[comunes]).all(axis=1)
+        dias_iguales = comunes[iguales.to_numpy()]
+        # Las filas sin fecha no tienen huella: se agregan siempre de nuevo
+        cambian = ~df["FECHA"].isin(dias_iguales)
+        conservado = previo["diario"][previo["diario"]["FECHA"].isin(dias_iguales)]
+        nuevos = _ordenar(_agregar_diario(df[cambian]))
+        diario = pd.concat([conservado, nuevos], ignore_index=True)
+        # Lo normal es que solo cambien los últimos días: entonces ya queda ordenado
+        if len(conservado) and len(nuevos) and not nuevos["FECHA"].min() > conservado["FECHA"].max():
+            diario = _ordenar(diario)
+        dias_recalculados = len(huellas) - len(dias_iguales)
+
+    semanal = (
+        diario.groupby(["AÑO", "SEMANA", "SUCURSAL", "FAMILIA"], dropna=False, observed=True)[MEDIDAS]
+        .sum()
+        .reset_index()
+    )
+    mensual = (
+        diario.groupby([diario["FECHA"].dt.year.rename("AÑO_DT"), diario["FECHA"].dt.month.rename("MES"),
+                        diario["SUCURSAL"], diario["FAMILIA"]], dropna=False, observed=True)[MEDIDAS]
+        .sum()
+        .reset_index()
+    )
+
+    cubo = {
+        "diario": diario,
+        "indice": construir_indice_filtros(diario),
+        "semanal": semanal,
+        "mensual": mensual,
+        "huellas": huellas,
+        "dias_recalculados": dias_recalculados,
+        "consultas": {},  # (rollup, familia, sucursal) -> ventas por período ya agrupadas
+    }
+    _ultimo_cubo[empresa] = cubo
+    return cubo
+
+
+def obtener_cubo(empresa):
+    return obtener_derivado(empresa, "cubo_ventas", lambda df: construir_cubo(empresa, df))
+
+
+for _empresa in ("comercial", "agricola"):
+    registrar_derivado(_empresa, "cubo_ventas", lambda df, empresa=_empresa: construir_cubo(empresa, df))
+
+
+def filtrar_cubo(cubo, familia, sucursal, semana, año, desde, hasta):
+    """Ventas diarias agregadas con los mismos filtros que filtrar_dataframe (tipo FAMILIA)."""
+    return filtrar_con_indice(cubo["diario"], cubo["indice"], "FAMILIA", familia or "TODOS",
+                              sucursal, semana, año, desde, hasta)
+
+
+def filtrar_rollup(rollup, familia, sucursal):
+    """Filtra un rollup (semanal o mensual) por familia y sucursal."""
+    if familia and familia != "TODOS":
+        rollup = rollup[rollup["FAMILIA"] == familia]
+    if sucursal and sucursal != "TODAS":
+        rollup = rollup[rollup["SUCURSAL"] == sucursal]
+    return rollup
+
+
+def ventas_por_periodo(cubo, nombre, familia, sucursal):
+    """
+    NETO por semana ('semanal') o por mes ('mensual') para una familia/sucursal.
+    Retorna (agrupado, hay_datos); se calcula una vez por combinación y cubo.
+    """
+    clave = (nombre, familia or "TODOS", sucursal or "TODAS")
+    consultas = cubo["consultas"]
+    if clave not in consultas:
+        rollup = filtrar_rollup(cubo[nombre], familia, sucursal)
+        agrupado = rollup.groupby(AGRUPACIONES[nombre])["NETO"].sum().reset_index()
+        consultas[clave] = (agrupado, not rollup.empty)
+    return consultas[clave]
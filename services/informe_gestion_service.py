@@ -0,0 +1,239 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from services.prorrateo_service import calcular_matriz_gestion, huella_config
+from utils.mayor_periodos import obtener_mayor_normalizado
+from utils.sheet_cache import obtener_version
+
+# Motor del estado de resultados de gestión (informe_gerencial y comparativo_gestion).
+# Parte del mayor ya prorrateado (calcular_matriz_gestion) y de clasificaciones.json:
+#   1. construir_tensor_pyg: un solo groupby cuenta × período × centro de costo.
+#   2. matriz_pyg: cuenta × columnas (centros de costo o períodos), sumando la otra dimensión.
+#   3. armar_reporte_pyg: grupos, macro categorías y líneas calculadas como operaciones
+#      sobre vectores por columna; agregar un mes o un CC agrega una columna, no un loop.
+# Los prorrateos son independientes por mes, así que cada mes se prorratea una sola vez
+# y se guarda solo su tensor (tensor_periodos); cualquier rango (mes, trimestre, YTD,
+# últimos 12 meses, desde/hasta) se arma juntando los tensores de sus meses.
+ESTRUCTURA_PYG = [
+    {"id": "ingresos_op", "titulo": "INGRESOS DE EXPLOTACIÓN", "tipo": "macro", "fuente": ["Ingresos Operacionales", "Ingresos Venta"]},
+    {"id": "costo_directo", "titulo": "COSTO DIRECTO (COSTO DE VENTA)", "tipo": "macro", "fuente": ["Costo Venta"]},
+    {"id": "margen_op", "titulo": "MARGEN OPERACIONAL (BRUTO)", "tipo": "calculo", "color": "primary", "operacion": ["ingresos_op", "costo_directo"]},
+    {"id": "costos_fijos", "titulo": "GASTOS FIJOS LOCALES", "tipo": "macro", "fuente": ["Costos de Explotación"]},
+    {"id": "margen", "titulo": "MARGEN DE EXPLOTACIÓN", "tipo": "calculo", "color": "warning", "operacion": ["margen_op", "costos_fijos"]},
+    {"id": "gastos_adm", "titulo": "GASTOS DE ADMINISTRACIÓN Y VENTAS", "tipo": "macro", "fuente": ["Gastos de Administración y Ventas"]},
+    {"id": "res_op", "titulo": "RESULTADO OPERACIONAL", "tipo": "calculo", "color": "info", "operacion": ["margen", "gastos_adm"]},
+    {"id": "no_op", "titulo": "INGRESOS Y EGRESOS NO OPERACIONALES", "tipo": "macro", "fuente": ["Ingresos No Operacionales"]},
+    {"id": "res_final", "titulo": "RESULTADO ANTES DE IMPTO", "tipo": "calculo", "color": "success", "operacion": ["res_op", "no_op"]},
+    {"id": "otros", "titulo": "SIN CLASIFICAR / OTROS", "tipo": "macro", "fuente": ["Sin Clasificar", "Otros"]}
+]
+DIMENSIONES = ["CUENTA", "PERIODO_STR", "CENTRO COSTO"]
+UMBRAL_PENDIENTE = 1  # cuentas sin clasificar con menos movimiento que esto no se muestran
+COLUMNAS_TENSOR = ["SALDO_REAL", "ABS", "NOMBRE", "ORIGEN", "POS"]
+RANGOS = ["mes", "trimestre", "ytd", "ltm", "personalizado"]
+
+# (contenido del mes, mes, switch_sg, switch_fab, huella de la config) -> tensor del mes.
+# La clave usa el contenido y no la versión del mayor: al recargar el snapshot solo se
+# vuelven a prorratear los meses que cambiaron.
+MAX_MESES = 240
+_meses = OrderedDict()
+_contenidos = {}  # (versión del mayor, mes) -> huella del contenido del mes
+_lock_meses = threading.Lock()
+
+
+def construir_tensor_pyg(df_final):
+    """
+    SALDO_REAL sumado por cuenta × período × centro de costo (ABS: suma de los valores
+    absolutos). Guarda también el NOMBRE y la posición de la primera fila de cada celda
+    (ORIGEN en el mayor, POS en df_final), para listar las cuentas en orden de aparición.
+    """
+    if df_final.empty:
+        return pd.DataFrame(columns=COLUMNAS_TENSOR)
+    pos = np.arange(len(df_final))
+    base = df_final[DIMENSIONES + ["NOMBRE", "SALDO_REAL"]].assign(
+        ABS=df_final["SALDO_REAL"].abs(),
+        ORIGEN=df_final["ORIGEN"] if "ORIGEN" in df_final.columns else pos,
+        POS=pos,
+    )
+    return (
+        base.groupby(DIMENSIONES, sort=False, dropna=False)
+        .agg(SALDO_REAL=("SALDO_REAL", "sum"), ABS=("ABS", "sum"), NOMBRE=("NOMBRE", "first"),
+             ORIGEN=("ORIGEN", "min"), POS=("POS", "min"))
+    )
+
+
+def _mes_para_prorrateo(store, mes):
+    # Solo gastos e ingresos; ORIGEN es la posición de cada fila en el mayor completo
+    df = store["periodos"][mes]
+    clase = df["CLASE"].isin(["3", "4"]).to_numpy()
+    return df[clase].assign(ORIGEN=store["posiciones"][mes][clase])
+
+
+def _huella_contenido(store, version, mes):
+    clave = (version, mes)
+    huella = _contenidos.get(clave)
+    if huella is None:
+        df = _mes_para_prorrateo(store, mes)
+        filas = pd.util.hash_pandas_object(df[DIMENSIONES + ["NOMBRE", "SALDO_REAL", "ORIGEN"]], index=False)
+        huella = hashlib.md5(filas.to_numpy().tobytes()).hexdigest()
+        with _lock_meses:
+            for vieja in [c for c in _contenidos if c[0] != version]:
+                del _contenidos[vieja]
+            _contenidos[clave] = huella
+    return huella
+
+
+def _tensor_mes(store, version, mes, switch_sg, switch_fab, data_config):
+    clave = (_huella_contenido(store, version, mes), mes, bool(switch_sg), bool(switch_fab),
+             huella_config((mes,), switch_sg, switch_fab, data_config))
+    with _lock_meses:
+        tensor = _meses.get(clave)
+        if tensor is not None:
+            _meses.move_to_end(clave)
+            return tensor
+    df_final = calcular_matriz_gestion(_mes_para_prorrateo(store, mes), mes, switch_sg, switch_fab, data_config)
+    tensor = construir_tensor_pyg(df_final)
+    with _lock_meses:
+        _meses[clave] = tensor
+        while len(_meses) > MAX_MESES:
+            _meses.popitem(last=False)
+    return tensor
+
+
+def tensor_periodos(periodos, switch_sg, switch_fab, data_config):
+    """
+    Tensor cuenta × período × CC de los meses pedidos (los que no tienen movimientos se
+    omiten), armado con el tensor ya prorrateado de cada mes.
+    """
+    store = obtener_mayor_normalizado()
+    version = obtener_version("mayor")
+    tensores = [_tensor_mes(store, version, mes, switch_sg, switch_fab, data_config)
+                for mes in sorted(set(periodos)) if mes in store["periodos"]]
+    tensores = [t for t in tensores if not t.empty]
+    if not tensores:
+        return pd.DataFrame(columns=COLUMNAS_TENSOR)
+    return pd.concat(tensores) if len(tensores) > 1 else tensores[0]
+
+
+def resolver_rango(rango, hasta, desde=None):
+    """
+    (desde, hasta) en YYYY-MM para un rango que termina en 'hasta': "mes", "trimestre"
+    (el trimestre calendario de 'hasta'), "ytd", "ltm" (12 meses) o "personalizado".
+    """
+    try:
+        fin = pd.Period(hasta, freq="M")
+    except (ValueError, TypeError):
+        return hasta, hasta
+    if rango == "trimestre":
+        inicio = fin - (fin.month - 1) % 3
+    elif rango == "ytd":
+        inicio = fin - (fin.month - 1)
+    elif rango == "ltm":
+        inicio = fin - 11
+    elif rango == "personalizado" and desde:
+        try:
+            inicio = pd.Period(desde, freq="M")
+        except (ValueError, TypeError):
+            inicio = fin
+        if inicio > fin:
+            inicio, fin = fin, inicio
+    else:
+        inicio = fin
+    return str(inicio), str(fin)
+
+
+def meses_del_rango(desde, hasta):
+    """Meses YYYY-MM entre desde y hasta (inclusive)."""
+    try:
+        return [str(p) for p in pd.period_range(desde, hasta, freq="M")]
+    except (ValueError, TypeError):
+        return [hasta]  # Periodo mal escrito: informe vacío, como un mes sin movimientos
+
+
+def matriz_pyg(tensor, columna, centro_costo=None):
+    """
+    Cuenta × 'columna' ("CENTRO COSTO" o "PERIODO_STR"), opcionalmente de un solo centro
+    de costo. Retorna (matriz, nombres), con las cuentas en orden de aparición.
+    """
+    if centro_costo is not None:
+        tensor = tensor[tensor.index.get_level_values("CENTRO COSTO") == centro_costo]
+    if tensor.empty:
+        return pd.DataFrame(dtype=float), pd.Series(dtype=object)
+
+    celdas = tensor.reset_index()
+    primeras = celdas.sort_values(["ORIGEN", "POS"], kind="stable").drop_duplicates("CUENTA")
+    orden = primeras["CUENTA"].tolist()
+    nombres = pd.Series(primeras["NOMBRE"].to_numpy(), index=orden)
+
+    matriz = celdas.pivot_table(index="CUENTA", columns=columna, values="SALDO_REAL", aggfunc="sum", fill_value=0.0, sort=False)
+    return matriz.reindex(orden), nombres
+
+
+def _vector_a_dict(columnas, vector):
+    return dict(zip(columnas, vector.tolist()))
+
+
+def armar_reporte_pyg(matriz, nombres, grupos_config, columnas):
+    """
+    Secciones del informe (ESTRUCTURA_PYG) con totales por columna. Cada sección trae
+    sus grupos y cada grupo el detalle de sus cuentas ("montos" por columna).
+    """
+    columnas = list(columnas)
+    cuentas = [str(c) for c in matriz.index]
+    posicion = {c: i for i, c in enumerate(cuentas)}
+    # Totales solo sobre las columnas pedidas; el detalle conserva todas las de la cuenta
+    valores = matriz.reindex(columns=columnas, fill_value=0.0).to_numpy(dtype=float) if len(cuentas) else np.zeros((0, len(columnas)))
+    detalle = {c: {k: float(v) for k, v in fila.items()} for c, fila in zip(cuentas, matriz.to_dict("records"))}
+
+    def fila_cuenta(cid):
+        return {"codigo": cid, "nombre": nombres.iloc[posicion[cid]], "montos": detalle[cid]}
+
+    # Pertenencia grupo × cuenta (una cuenta repetida en un grupo suma dos veces, como antes)
+    grupos = []
+    pertenencia = np.zeros((len(grupos_config), len(cuentas)))
+    for g, grp in enumerate(grupos_config):
+        ids = [str(c) for c in grp["cuentas"] if str(c) in posicion]
+        np.add.at(pertenencia[g], [posicion[c] for c in ids], 1)
+        grupos.append({"nombre": grp["nombre"], "tipo": grp["tipo"], "detalle_cuentas": [fila_cuenta(c) for c in ids]})
+    totales_grupos = pertenencia @ valores
+
+    macros = {}
+    for g, grp in enumerate(grupos_config):
+        grupos[g]["totales"] = _vector_a_dict(columnas, totales_grupos[g])
+        m = macros.setdefault(grp.get("macro_categoria", "Otros"), {"grupos": [], "totales": np.zeros(len(columnas))})
+        m["grupos"].append(grupos[g])
+        m["totales"] = m["totales"] + totales_grupos[g]
+
+    # Cuentas con movimiento que no están en ninguna clasificación
+    procesadas = {str(c) for grp in grupos_config for c in grp["cuentas"]}
+    movimiento = np.abs(matriz.to_numpy(dtype=float)).sum(axis=1) if len(cuentas) else np.zeros(0)
+    pendientes = [i for i, c in enumerate(cuentas) if c not in procesadas and movimiento[i] > UMBRAL_PENDIENTE]
+    if pendientes:
+        tot = valores[pendientes].sum(axis=0)
+        sin_clasif = {"nombre": "Pendientes", "totales": _vector_a_dict(columnas, tot),
+                      "detalle_cuentas": [fila_cuenta(cuentas[i]) for i in pendientes]}
+        m = macros.setdefault("Sin Clasificar", {"grupos": [], "totales": np.zeros(len(columnas))})
+        m["grupos"].append(sin_clasif)
+        m["totales"] = m["totales"] + tot
+
+    reporte = []
+    lineas = {}
+    for l in ESTRUCTURA_PYG:
+        total = np.zeros(len(columnas))
+        seccion = {"titulo": l["titulo"], "tipo": l["tipo"], "color": l.get("color", "secondary"), "grupos": []}
+        if l["tipo"] == "macro":
+            fuentes = [macros[src] for src in l["fuente"] if src in macros]
+            for d in fuentes:
+                seccion["grupos"].extend(d["grupos"])
+                total = total + d["totales"]
+            mostrar = bool(fuentes) or l["id"] == "otros"
+        else:
+            for op in l["operacion"]:
+                total = total + lineas.get(op, 0)
+            mostrar = True
+        lineas[l["id"]] = total
+        seccion["totales"] = _vector_a_dict(columnas, total)
+        if mostrar:
+            reporte.append(seccion)
+    return reporte
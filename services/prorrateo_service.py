@@ -0,0 +1,290 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from utils.sheet_cache import obtener_version
+
+# Motor de prorrateos de gestión (columnar).
+# Cada tipo de regla se expresa como un join de las filas del mayor contra una tabla
+# de ratios (período/cuenta -> centro destino, ratio), en vez de recorrer fila a fila:
+#   - VENTAS_SUCURSAL: ratio de ventas de la sucursal sobre la venta total del mes.
+#   - MANUAL_SUCURSAL: % manual por sucursal (reglas_mensuales[per].cuentas_globales).
+#   - Servicios Generales: distribución de reglas_mensuales[per].serv_generales.
+#   - Fábrica: Costanera traslada a la fábrica el % de la cuenta y la fábrica se vacía
+#     hacia las sucursales según sus ventas de empanadas (4101004).
+# Cada fila generada lleva (_orden, _sub): posición de la fila original y posición dentro
+# de lo que genera; al final se ordena por ahí, así el resultado tiene las mismas filas
+# y en el mismo orden que el cálculo fila a fila original.
+CUENTA_VENTA_EMPANADAS = "4101004"
+CUENTA_COSTO_EMPANADAS = "3101002"
+_SUB_ORIGINAL = 1_000_000  # La fila original va después de las que genera
+
+# Resultados ya calculados: (versión del mayor, variante, períodos, periodo, switch_sg,
+# switch_fab, huella de la config que afecta a esos períodos) -> DataFrame procesado.
+MAX_RESULTADOS = 64
+_resultados = OrderedDict()
+_lock_resultados = threading.Lock()
+
+
+def _regla_vigente(pool, per):
+    """Regla del período, o la del último período anterior que tenga una."""
+    if per in pool:
+        return pool[per]
+    ants = [p for p in pool.keys() if p < per]
+    return pool[max(ants)] if ants else {}
+
+
+def _pools(data_config):
+    """Reglas de Servicios Generales y % de Costanera por período."""
+    reglas_mensuales = data_config.get("reglas_mensuales", {})
+    costanera_prorrateos = data_config.get("fabrica_empanadas", {}).get("costanera_prorrateos", {})
+    pool_sg = {p: d["serv_generales"] for p, d in reglas_mensuales.items() if "serv_generales" in d}
+    return pool_sg, dict(costanera_prorrateos)
+
+
+def _tabla_distribucion(filas, columnas_clave):
+    """DataFrame de reglas (claves..., _cc, _ratio, _sub) a partir de tuplas (claves, dict destino->ratio)."""
+    registros = []
+    for claves, dist in filas:
+        for sub, (dst, ratio) in enumerate(dist.items()):
+            registros.append((*claves, dst, ratio, sub))
+    return pd.DataFrame(registros, columns=[*columnas_clave, "_cc", "_ratio", "_sub"])
+
+
+def _ratios_empanadas(df):
+    """Participación de cada centro en la venta de empanadas del mes: {per: {cc: ratio}}."""
+    dist_empanadas = {}
+    df_emp = df[df["CUENTA"] == CUENTA_VENTA_EMPANADAS]
+    if not df_emp.empty:
+        grupos = df_emp.groupby(["PERIODO_STR", "CENTRO COSTO"])["SALDO_REAL"].sum()
+        for per in grupos.index.get_level_values(0).unique():
+            v_mes = grupos[per]
+            tot = v_mes.sum()
+            if tot > 0:
+                dist_empanadas[per] = (v_mes / tot).to_dict()
+    return dist_empanadas
+
+
+def _en_pares(a, b, pares):
+    """Máscara: (a[i], b[i]) está en el conjunto de pares."""
+    if not pares:
+        return np.zeros(len(a), dtype=bool)
+    return pd.MultiIndex.from_arrays([a, b]).isin(list(pares))
+
+
+def _distribuir(filas, tabla, claves, calcular_saldo, omitir_ceros=False, sub_base=0, **asignar):
+    """Join de filas contra una tabla de reglas; cada match es una fila nueva hacia _cc."""
+    if filas.empty or tabla.empty:
+        return None
+    unidas = filas.merge(tabla, on=claves, how="inner")
+    unidas["CENTRO COSTO"] = unidas["_cc"]
+    unidas["SALDO_REAL"] = calcular_saldo(unidas)
+    if omitir_ceros:
+        unidas = unidas[unidas["SALDO_REAL"] != 0]
+    unidas["_sub"] = unidas["_sub"] + sub_base
+    for col, valor in asignar.items():
+        unidas[col] = valor(unidas) if callable(valor) else valor
+    return unidas.drop(columns=["_cc", "_ratio"])
+
+
+def calcular_matriz_gestion(df, periodo, switch_sg, switch_fab, data_config):
+    """
+    Función CENTRALIZADA que aplica toda la matemática de prorrateos.
+    Devuelve un DataFrame 'df_procesado' listo para ser agrupado.
+    """
+    config_cuentas = data_config.get("config_cuentas", {})
+    reglas_mensuales = data_config.get("reglas_mensuales", {})
+    pool_sg, pool_fab = _pools(data_config)
+
+    if df.empty:
+        return pd.DataFrame()
+
+    columnas = list(df.columns)
+    base = df.reset_index(drop=True)
+    base["_orden"] = np.arange(len(base))
+    base["_sub"] = _SUB_ORIGINAL
+    per = base["PERIODO_STR"]
+    nom = base["NOMBRE"]
+    cc_min = base["CENTRO COSTO"].str.lower()
+    periodos = [p for p in per.unique() if isinstance(p, str)]
+    piezas = []
+
+    # Pre-cálculos Ventas (solo ventas positivas)
+    df_ventas = df[df["CUENTA"].str.startswith("41")]
+    df_ventas = df_ventas[df_ventas["SALDO_REAL"] > 0]
+    vtas_tot_mes = df_ventas.groupby("PERIODO_STR")["SALDO_REAL"].sum()
+    vtas_suc_mes = df_ventas.groupby(["PERIODO_STR", "CENTRO COSTO"])["SALDO_REAL"].sum()
+    dist_empanadas = _ratios_empanadas(df)
+    mov_fab = df[(df["CUENTA"] == CUENTA_COSTO_EMPANADAS) & (abs(df["SALDO_REAL"]) > 1)]
+    meses_activos_fab = set(mov_fab["PERIODO_STR"].unique())
+
+    # --- 1. CUENTAS GLOBALES ---
+    tipos = {n: cfg["tipo"] for n, cfg in config_cuentas.items() if cfg and cfg.get("activo")}
+    tipo = nom.map(tipos)
+
+    # Caso Ventas (Automático): se reparte según la venta de cada sucursal en el mes
+    es_ventas = (tipo == "VENTAS_SUCURSAL").to_numpy()
+    meses_con_venta = set(vtas_tot_mes[vtas_tot_mes > 0].index)
+    ventas_repartidas = es_ventas & per.isin(meses_con_venta).to_numpy()
+    tabla_ventas = vtas_suc_mes.rename("_venta").reset_index().rename(columns={"CENTRO COSTO": "_cc"})
+    tabla_ventas["_tot"] = tabla_ventas["PERIODO_STR"].map(vtas_tot_mes)
+    tabla_ventas["_ratio"] = 0.0
+    tabla_ventas["_sub"] = tabla_ventas.groupby("PERIODO_STR").cumcount()
+    piezas.append(_distribuir(
+        base[ventas_repartidas].drop(columns=["_sub"]), tabla_ventas, ["PERIODO_STR"],
+        lambda u: u["SALDO_REAL"] * (u["_venta"] / u["_tot"]), omitir_ceros=True,
+    ))
+    if piezas[-1] is not None:
+        piezas[-1] = piezas[-1].drop(columns=["_venta", "_tot"])
+
+    # Caso Manual: % por sucursal definido para el mes; sin regla, la fila sigue normal
+    es_manual = (tipo == "MANUAL_SUCURSAL").to_numpy()
+    reglas_manual = [
+        ((p, n), dist)
+        for p, d in reglas_mensuales.items()
+        for n, dist in d.get("cuentas_globales", {}).items()
+    ]
+    manual_con_regla = es_manual & _en_pares(per, nom, {claves for claves, _ in reglas_manual})
+    piezas.append(_distribuir(
+        base[manual_con_regla].drop(columns=["_sub"]),
+        _tabla_distribucion(reglas_manual, ["PERIODO_STR", "NOMBRE"]), ["PERIODO_STR", "NOMBRE"],
+        lambda u: u["SALDO_REAL"] * u["_ratio"], omitir_ceros=True,
+    ))
+
+    # Cualquier otra cuenta global activa se consume (no pasa a los switches)
+    global_procesada = tipo.notna().to_numpy() & ~(es_manual & ~manual_con_regla)
+    conservar = ~global_procesada | (es_ventas & ~ventas_repartidas)
+
+    # --- 2. SWITCHES ---
+    resto = ~global_procesada
+    es_sg = resto & bool(switch_sg) & cc_min.str.contains("servicios generales", regex=False).to_numpy()
+
+    # A. SG: la regla vigente del mes (o la última anterior) reparte la cuenta
+    if es_sg.any():
+        reglas_sg = [
+            ((p, n), dist)
+            for p in periodos
+            for n, dist in _regla_vigente(pool_sg, p).items()
+            if dist
+        ]
+        sg_con_regla = es_sg & _en_pares(per, nom, {claves for claves, _ in reglas_sg})
+        conservar &= ~sg_con_regla
+        piezas.append(_distribuir(
+            base[sg_con_regla].drop(columns=["_sub"]),
+            _tabla_distribucion(reglas_sg, ["PERIODO_STR", "NOMBRE"]), ["PERIODO_STR", "NOMBRE"],
+            lambda u: u["SALDO_REAL"] * u["_ratio"],
+        ))
+
+    # B. Fábrica
+    if switch_fab:
+        en_mes_activo = resto & ~es_sg & per.isin(meses_activos_fab).to_numpy()
+        es_costanera = cc_min.str.contains("costanera", regex=False).to_numpy()
+        es_fabrica = (cc_min.str.contains("fca", regex=False) | cc_min.str.contains("fabrica", regex=False)).to_numpy()
+        tabla_emp = _tabla_distribucion([((p,), d) for p, d in dist_empanadas.items()], ["PERIODO_STR"])
+        absorbido = lambda u: u["NOMBRE"] + " (Absorbido Fca)"
+
+        # Caso B1: Costanera -> Sucursales (la fila original se mantiene)
+        costanera = en_mes_activo & es_costanera
+        if costanera.any():
+            # % a trasladar vigente por (mes, cuenta); solo los positivos generan traslado
+            tabla_pct = pd.DataFrame(
+                [(p, c, v) for p in periodos for c, v in _regla_vigente(pool_fab, p).items() if v and v > 0],
+                columns=["PERIODO_STR", "CUENTA", "_pct"],
+            )
+            filas = base[costanera].drop(columns=["_sub"]).merge(tabla_pct, on=["PERIODO_STR", "CUENTA"], how="inner")
+            filas["_traslado"] = filas["SALDO_REAL"] * filas["_pct"].astype(float)
+            filas = filas.drop(columns=["_pct"])
+
+            salida = filas.assign(SALDO_REAL=-filas["_traslado"], _sub=0)
+            piezas.append(salida.drop(columns=["_traslado"]))
+
+            con_mapa = filas["PERIODO_STR"].isin(dist_empanadas.keys())
+            pieza = _distribuir(
+                filas[con_mapa], tabla_emp, ["PERIODO_STR"],
+                lambda u: u["_traslado"] * u["_ratio"], sub_base=1,
+                CUENTA=CUENTA_COSTO_EMPANADAS, NOMBRE=absorbido,
+            )
+            if pieza is not None:
+                piezas.append(pieza.drop(columns=["_traslado"]))
+            sin_mapa = filas[~con_mapa]
+            piezas.append(sin_mapa.assign(
+                **{"CENTRO COSTO": "Fca de Empanadas"}, CUENTA=CUENTA_COSTO_EMPANADAS,
+                SALDO_REAL=sin_mapa["_traslado"], _sub=1,
+            ).drop(columns=["_traslado"]))
+
+        # Caso B2: Vaciar Fábrica -> Sucursales
+        fabrica = en_mes_activo & ~es_costanera & es_fabrica & per.isin(dist_empanadas.keys()).to_numpy()
+        conservar &= ~fabrica
+        piezas.append(_distribuir(
+            base[fabrica].drop(columns=["_sub"]), tabla_emp, ["PERIODO_STR"],
+            lambda u: u["SALDO_REAL"] * u["_ratio"],
+            CUENTA=CUENTA_COSTO_EMPANADAS, NOMBRE=absorbido,
+        ))
+
+    piezas.append(base[conservar])
+    piezas = [p for p in piezas if p is not None and not p.empty]
+    if not piezas:
+        return pd.DataFrame()
+    resultado = pd.concat(piezas, ignore_index=True).sort_values(["_orden", "_sub"], kind="stable")
+    return resultado[columnas].reset_index(drop=True)
+
+
+def huella_config(periodos, switch_sg, switch_fab, data_config):
+    """Hash de la parte de la configuración que usa el cálculo de esos períodos."""
+    reglas_mensuales = data_config.get("reglas_mensuales", {})
+    pool_sg, pool_fab = _pools(data_config)
+    relevante = {
+        "tipos": {n: cfg["tipo"] for n, cfg in data_config.get("config_cuentas", {}).items() if cfg and cfg.get("activo")},
+        "manual": {p: reglas_mensuales.get(p, {}).get("cuentas_globales", {}) for p in periodos},
+        "sg": {p: _regla_vigente(pool_sg, p) for p in periodos} if switch_sg else None,
+        "fab": {p: _regla_vigente(pool_fab, p) for p in periodos} if switch_fab else None,
+    }
+    texto = json.dumps(relevante, sort_keys=True, default=str)
+    return hashlib.md5(texto.encode("utf-8")).hexdigest()
+
+
+def calcular_matriz_gestion_cacheada(df, periodo, switch_sg, switch_fab, data_config, variante="gestion"):
+    """
+    Igual que calcular_matriz_gestion, pero reutiliza el resultado mientras no cambien
+    el snapshot del mayor ni las reglas de los períodos involucrados.
+    'variante' identifica cómo preparó el llamador el DataFrame (mismo snapshot y mismos
+    períodos deben dar las mismas filas).
+    """
+    periodos = tuple(sorted(p for p in df["PERIODO_STR"].unique() if isinstance(p, str))) if not df.empty else ()
+    version = obtener_version("mayor")
+    clave = (version, variante, periodos, periodo, bool(switch_sg), bool(switch_fab),
+             huella_config(periodos, switch_sg, switch_fab, data_config))
+
+    with _lock_resultados:
+        resultado = _resultados.get(clave)
+        if resultado is not None:
+            _resultados.move_to_end(clave)
+    if resultado is None:
+        resultado = calcular_matriz_gestion(df, periodo, switch_sg, switch_fab, data_config)
+        with _lock_resultados:
+            # Los resultados de snapshots anteriores ya no se van a pedir
+            for vieja in [c for c in _resultados if c[0] != version]:
+                del _resultados[vieja]
+            _resultados[clave] = resultado
+            while len(_resultados) > MAX_RESULTADOS:
+                _resultados.popitem(last=False)
+    return resultado.copy()
+
+
+def invalidar_prorrateos(periodos=None, hacia_adelante=False):
+    """
+    Descarta los resultados que incluyen alguno de los períodos (None = todos).
+    Con hacia_adelante también los posteriores, que heredan la última regla vigente.
+    """
+    with _lock_resultados:
+        if periodos is None:
+            _resultados.clear()
+            return
+        periodos = set(periodos)
+        minimo = min(periodos) if periodos else None
+        for clave in list(_resultados):
+            afectados = clave[2]
+            if any(p in periodos for p in afectados) or (hacia_adelante and minimo and any(p >= minimo for p in afectados)):
+                del _resultados[clave]
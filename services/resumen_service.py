@@ -1,12 +1,22 @@
+import numpy as np
 import pandas as pd
 
 MESES = ["ENE", "FEB", "MAR", "ABR", "MAY", "JUN",
          "JUL", "AGO", "SEP", "OCT", "NOV", "DIC"]
 
+# Los montos del resumen son numéricos; el formato se aplica al mostrarlos
+# (filtros de plantilla 'clp' y 'miles') y el Excel los recibe tal cual.
 def fmt(n):
     return f"${int(n):,}".replace(",", ".") if n != 0 else "$0"
 
+def fmt_miles(n):
+    return f"{int(n):,}".replace(",", ".")
+
 def obtener_resumen_mensual_tabular(df, filtros):
+    """
+    Neto, cantidad y precio unitario por etiqueta (familia o producto) × mes, más
+    totales por fila y por mes. Todos los valores son números (float).
+    """
     if filtros.get("sucursal") and filtros["sucursal"] != "TODAS":
         df = df[df["SUCURSAL"] == filtros["sucursal"]]
 
@@ -38,55 +48,40 @@ def obtener_resumen_mensual_tabular(df, filtros):
         campo = "FAMILIA"
 
 
-    df["MES"] = df["FECHA"].dt.month
     etiquetas = sorted(df[campo].dropna().unique())
 
-    tabla = []
-    totales_mes = {mes: {"neto": 0, "cant": 0} for mes in range(1, 13)}
-    total_neto_general = 0
-
-    for et in etiquetas:
-        fila_neto = []
-        fila_cant = []
-        fila_unit = []
-        neto_total = 0
-        cant_total = 0
-
-        for mes in range(1, 13):
-            df_mes = df[(df[campo] == et) & (df["MES"] == mes)]
-            neto = df_mes["NETO"].sum()
-            cant = df_mes["CANTIDAD"].sum()
-            unit = neto / cant if cant else 0
-
-            fila_neto.append(fmt(neto))
-            fila_cant.append(f"{int(cant):,}".replace(",", "."))
-            fila_unit.append(fmt(unit))
-
-            totales_mes[mes]["neto"] += neto
-            totales_mes[mes]["cant"] += cant
-
-            neto_total += neto
-            cant_total += cant
+    # Una sola agrupación etiqueta × mes; las combinaciones sin ventas quedan en 0
+    meses = df["FECHA"].dt.month.rename("MES")
+    agrupado = df.groupby([df[campo], meses])[["NETO", "CANTIDAD"]].sum()
+    if agrupado.empty:
+        neto = np.zeros((len(etiquetas), 12))
+        cant = np.zeros((len(etiquetas), 12))
+    else:
+        columnas = list(range(1, 13))
+        neto = agrupado["NETO"].unstack("MES").reindex(index=etiquetas, columns=columnas).fillna(0).to_numpy(dtype=float)
+        cant = agrupado["CANTIDAD"].unstack("MES").reindex(index=etiquetas, columns=columnas).fillna(0).to_numpy(dtype=float)
 
-        total_unit = neto_total / cant_total if cant_total else 0
-        total_neto_general += neto_total
+    unit = np.divide(neto, cant, out=np.zeros_like(neto), where=cant != 0)
+    neto_total = neto.sum(axis=1)
+    cant_total = cant.sum(axis=1)
+    unit_total = np.divide(neto_total, cant_total, out=np.zeros_like(neto_total), where=cant_total != 0)
 
+    tabla = []
+    for i, et in enumerate(etiquetas):
         tabla.append({
             "producto": et,
-            "neto": fila_neto,
-            "cant": fila_cant,
-            "unit": fila_unit,
-            "total_neto": fmt(neto_total),
-            "total_cant": f"{int(cant_total):,}".replace(",", "."),
-            "total_unit": fmt(total_unit)
+            "neto": neto[i].tolist(),
+            "cant": cant[i].tolist(),
+            "unit": unit[i].tolist(),
+            "total_neto": float(neto_total[i]),
+            "total_cant": float(cant_total[i]),
+            "total_unit": float(unit_total[i])
         })
 
-    fila_total_neto = [fmt(totales_mes[mes]["neto"]) for mes in range(1, 13)]
-
     return {
         "tabla": tabla,
         "total": {
-            "neto": fila_total_neto,
-            "total_neto": fmt(total_neto_general)
+            "neto": neto.sum(axis=0).tolist(),
+            "total_neto": float(neto_total.sum())
         }
     }
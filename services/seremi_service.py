@@ -0,0 +1,439 @@
+import pandas as pd
+from utils.sheet_cache import obtener_derivado, registrar_derivado
+
+# Fuentes SEREMI (planillas de Google Sheets de los locales).
+# Cada fuente tiene un cargador que la normaliza una sola vez por snapshot (registrado
+# como derivado en sheet_cache, se arma apenas se recarga la planilla): FECHA como
+# datetime, DIA/MES/AÑO/HORA enteros, temperaturas numéricas, SUCURSAL/EQUIPO/PRODUCTO
+# categóricas y la lista de sucursales para el selector. Las rutas solo filtran y arman
+# la vista; no vuelven a parsear nada.
+# Grilla de temperaturas (planillas mensuales de equipos y productos), separada por mes:
+#   - Productos: por sucursal × producto × día, la lectura más cercana a cada horario
+#     de control (13, 17 y 21 h), con groupby-idxmin sobre la distancia a la hora.
+#   - Equipos: por equipo × día, las 3 primeras lecturas del día (ingreso, intermedio,
+#     salida). El orden se calcula para todas las sucursales juntas y por sucursal.
+# Igual que las planillas, el día se agrupa por mes calendario (MES, DIA).
+HORARIOS_PRODUCTOS = [13, 17, 21]
+LECTURAS_EQUIPO = 3
+DIAS = range(1, 32)
+COLUMNA_TEMPERATURA = "TEMPERATURA C°"
+FORMATO_FECHA = "%d-%m-%Y %H:%M:%S"
+FORMATO_FECHA_RECEPCION = "%d/%m/%Y %H:%M:%S"
+ULTIMOS_CAMBIOS_ACEITE = 20
+
+# Registro de personal: ítems que se evalúan (columna -> nombre corto para el resumen)
+# y acción correctiva de los que la tienen cuando el ítem dice "NO CUMPLE"
+ITEMS_PERSONAL = {
+    'PELO LIMPIO': 'Pelo limpio', 'AFEITADO': 'Afeitado', '¿UÑAS CORTAS?': 'Uñas cortas',
+    'AUSENCIA DE JOYAS': 'Sin joyas', 'UNIFORME LIMPIO': 'Uniforme', 'COFIA BIEN PUESTA': 'Cofia',
+    'MASCARILLA': 'Mascarilla', 'SALUD': 'Salud'
+}
+ACCIONES_PERSONAL = {
+    '¿UÑAS CORTAS?': 'Corregir uñas.', 'AUSENCIA DE JOYAS': 'Retirar joyas.',
+    'UNIFORME LIMPIO': 'Corregir uniforme.', 'COFIA BIEN PUESTA': 'Ajustar cofia.',
+    'MASCARILLA': 'Corregir mascarilla.', 'AFEITADO': 'Afeitar.'
+}
+MESES_RESUMEN = 6  # rango por defecto del resumen de cumplimiento
+MAX_MESES_RESUMEN = 36
+
+
+def _sucursales(df):
+    if "SUCURSAL" not in df.columns:
+        return []
+    return sorted(df["SUCURSAL"].dropna().unique().tolist())
+
+
+def _por_mes(df):
+    return {int(mes): parte for mes, parte in df.groupby("MES", sort=True)}
+
+
+def _columnas_unicas(columnas):
+    # Encabezados repetidos quedan como COLUMNA, COLUMNA.1, COLUMNA.2...
+    vistos = {}
+    unicas = []
+    for col in columnas:
+        n = vistos.get(col, 0)
+        vistos[col] = n + 1
+        unicas.append(col if n == 0 else f"{col}.{n}")
+    return unicas
+
+
+def _normalizar(df, formato_fecha=None, dayfirst=False, categoricas=("SUCURSAL",)):
+    """
+    Copia con encabezados en mayúsculas (sin repetidos), FECHA parseada (se descartan
+    las filas sin fecha válida), DIA/MES/AÑO/HORA y las columnas 'categoricas' como category.
+    Retorna None si la planilla no trae FECHA.
+    """
+    base = df.copy()
+    base.columns = _columnas_unicas(base.columns.astype(str).str.strip().str.upper())
+    if "FECHA" not in base.columns:
+        return None
+    if formato_fecha:
+        base["FECHA"] = pd.to_datetime(base["FECHA"], format=formato_fecha, errors="coerce")
+    else:
+        base["FECHA"] = pd.to_datetime(base["FECHA"], dayfirst=dayfirst, errors="coerce")
+    base = base.dropna(subset=["FECHA"]).reset_index(drop=True)
+    base["DIA"] = base["FECHA"].dt.day.astype("int8")
+    base["MES"] = base["FECHA"].dt.month.astype("int8")
+    base["AÑO"] = base["FECHA"].dt.year.astype("int16")
+    base["HORA"] = base["FECHA"].dt.hour.astype("int8")
+    for col in categoricas:
+        if col in base.columns:
+            base[col] = base[col].astype("category")
+    return base
+
+
+def _texto(serie):
+    # Como str(valor) fila a fila: los vacíos quedan como "nan"
+    return serie.astype(object).map(str)
+
+
+def obtener_seremi(fuente):
+    """Store normalizado de una fuente SEREMI (ver CARGADORES)."""
+    return obtener_derivado(fuente, "seremi", CARGADORES[fuente])
+
+
+# --- Temperatura de productos ---
+
+def cargar_temperatura_productos(df):
+    store = {"sucursales": _sucursales(df), "meses": {}}
+    base = _normalizar(df, FORMATO_FECHA, categoricas=("SUCURSAL", "PRODUCTO"))
+    if base is None or not {"SUCURSAL", "PRODUCTO", COLUMNA_TEMPERATURA}.issubset(base.columns):
+        return store
+
+    base[COLUMNA_TEMPERATURA] = pd.to_numeric(
+        base[COLUMNA_TEMPERATURA].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    base = base.dropna(subset=[COLUMNA_TEMPERATURA, 'SUCURSAL', 'PRODUCTO']).reset_index(drop=True)
+    if base.empty:
+        return store
+    base['RESPONSABLE'] = _texto(base['RESPONSABLE']) if 'RESPONSABLE' in base.columns else ""
+
+    claves = ["MES", "SUCURSAL", "PRODUCTO", "DIA"]
+    por_celda = [base[c] for c in claves]
+    grilla = base.groupby(claves, sort=True, observed=True).size().to_frame("LECTURAS")
+    temperaturas = base[COLUMNA_TEMPERATURA].to_numpy()
+    for h in HORARIOS_PRODUCTOS:
+        # idxmin devuelve la primera fila con la distancia mínima (empates: la que llegó antes)
+        mas_cercana = (base["HORA"].astype(int) - h).abs().groupby(por_celda, sort=True, observed=True).idxmin()
+        grilla[f"T_{h}"] = temperaturas[mas_cercana.to_numpy()]
+    grilla["RESPONSABLES"] = (
+        base.drop_duplicates(claves + ["RESPONSABLE"])
+        .groupby(claves, sort=True, observed=True)["RESPONSABLE"].agg(" / ".join)
+    )
+    store["meses"] = _por_mes(grilla.reset_index())
+    return store
+
+
+def temperaturas_productos(mes, sucursal="TODAS", decimales=2):
+    """
+    {sucursal: {producto: [31 registros {dia, t_13, t_17, t_21, responsables}]}} del mes,
+    con las temperaturas formateadas con 'decimales'.
+    """
+    grilla = obtener_seremi("temperatura_productos")["meses"].get(mes)
+    if grilla is None:
+        return {}
+    if sucursal != "TODAS":
+        grilla = grilla[grilla["SUCURSAL"] == sucursal]
+
+    textos = [grilla[f"T_{h}"].map(lambda v: f"{v:.{decimales}f}°C").tolist() for h in HORARIOS_PRODUCTOS]
+    datos = {}
+    for suc, prod, dia, t_13, t_17, t_21, resp in zip(grilla["SUCURSAL"], grilla["PRODUCTO"], grilla["DIA"],
+                                                      *textos, grilla["RESPONSABLES"]):
+        registros = datos.setdefault(suc, {}).get(prod)
+        if registros is None:
+            registros = [{"dia": f"{d:02d}", "t_13": "", "t_17": "", "t_21": "", "responsables": ""} for d in DIAS]
+            datos[suc][prod] = registros
+        registros[dia - 1] = {"dia": f"{dia:02d}", "t_13": t_13, "t_17": t_17, "t_21": t_21, "responsables": resp}
+    return datos
+
+
+# --- Temperatura de equipos ---
+
+def cargar_temperatura_equipos(df):
+    store = {"sucursales": _sucursales(df), "meses": {}}
+    base = _normalizar(df, dayfirst=True, categoricas=("SUCURSAL", "EQUIPO"))
+    if base is None or not {"EQUIPO", COLUMNA_TEMPERATURA}.issubset(base.columns):
+        return store
+    base = base.dropna(subset=["EQUIPO"])
+    if base.empty:
+        return store
+    if "SUCURSAL" not in base.columns:
+        base["SUCURSAL"] = None
+
+    base = base.sort_values(["EQUIPO", "FECHA"], kind="stable")
+    base["RANGO"] = base.groupby(["MES", "EQUIPO", "DIA"], sort=False, observed=True).cumcount()
+    base["RANGO_SUCURSAL"] = base.groupby(["MES", "SUCURSAL", "EQUIPO", "DIA"], sort=False, observed=True, dropna=False).cumcount()
+    base = base[(base["RANGO"] < LECTURAS_EQUIPO) | (base["RANGO_SUCURSAL"] < LECTURAS_EQUIPO)]
+
+    lecturas = base[["MES", "SUCURSAL", "EQUIPO", "DIA", "RANGO", "RANGO_SUCURSAL"]].assign(
+        TEXTO=_texto(base[COLUMNA_TEMPERATURA]) + "°C (" + base["FECHA"].dt.strftime('%H:%M') + ")")
+    if "RESPONSABLE" in base.columns:
+        responsable = _texto(base["RESPONSABLE"]).str.strip()
+        lecturas["RESPONSABLE"] = responsable.where(responsable != "", "-")
+    else:
+        lecturas["RESPONSABLE"] = "-"
+    store["meses"] = _por_mes(lecturas)
+    return store
+
+
+def lecturas_equipos(mes, sucursal="TODAS"):
+    """
+    {equipo: [31 días, cada uno con hasta 3 lecturas (texto, responsable)]} del mes,
+    con los equipos en orden.
+    """
+    lecturas = obtener_seremi("temperatura_equipos")["meses"].get(mes)
+    if lecturas is None:
+        return {}
+    if sucursal != "TODAS":
+        lecturas = lecturas[(lecturas["SUCURSAL"] == sucursal) & (lecturas["RANGO_SUCURSAL"] < LECTURAS_EQUIPO)]
+    else:
+        lecturas = lecturas[lecturas["RANGO"] < LECTURAS_EQUIPO]
+
+    datos = {}
+    for equipo, dia, texto, resp in zip(lecturas["EQUIPO"], lecturas["DIA"], lecturas["TEXTO"], lecturas["RESPONSABLE"]):
+        dias = datos.get(equipo)
+        if dias is None:
+            dias = datos[equipo] = [[] for _ in DIAS]
+        dias[dia - 1].append((texto, resp))
+    return datos
+
+
+# --- Info de equipos, personal, cambio de aceite y recepción de mercadería ---
+
+def cargar_equipos_info(df):
+    base = df.copy()
+    base.columns = base.columns.astype(str).str.strip().str.upper()
+    if not {"ID_EQUIPO", "NOMBRE_EQUIPO"}.issubset(base.columns):
+        return {"mapa_nombre": {}}
+    return {"mapa_nombre": dict(zip(base["ID_EQUIPO"], base["NOMBRE_EQUIPO"]))}
+
+
+def evaluar_cumplimiento(df):
+    """
+    (evaluado, no_cumple): máscaras booleanas registro × ítem de ITEMS_PERSONAL (solo los
+    que trae la planilla). Un ítem está evaluado si tiene respuesta, y no cumple si dice "NO CUMPLE".
+    """
+    items = [c for c in ITEMS_PERSONAL if c in df.columns]
+    textos = pd.DataFrame({c: _texto(df[c]).str.strip().str.upper() for c in items}, index=df.index, columns=items)
+    evaluado = textos.ne("") & textos.ne("NAN") & textos.ne("NONE")
+    no_cumple = pd.DataFrame({c: textos[c].str.contains('NO CUMPLE', regex=False) for c in items},
+                             index=df.index, columns=items)
+    return evaluado, no_cumple
+
+
+def _unir_textos(acumulado, parte):
+    # ' '.join de las partes no vacías, columna por columna
+    return parte.where(acumulado.eq(""), acumulado.where(parte.eq(""), acumulado + " " + parte))
+
+
+def acciones_correctivas(df, no_cumple):
+    """Texto de acciones de cada registro: mensajes de ACCIONES_PERSONAL de los ítems que no cumplen + observaciones."""
+    acciones = pd.Series("", index=df.index, dtype=object)
+    for columna, mensaje in ACCIONES_PERSONAL.items():
+        if columna in no_cumple.columns:
+            acciones = _unir_textos(acciones, no_cumple[columna].map({True: mensaje, False: ""}).astype(object))
+    if 'OBSERVACIONES' in df.columns:
+        observaciones = _texto(df['OBSERVACIONES'])
+        acciones = _unir_textos(acciones, observaciones.where(observaciones.str.lower() != 'nan', ""))
+    return acciones
+
+
+def _resumen_mensual(base, evaluado, no_cumple):
+    """Conteos por (PERIODO, SUCURSAL): registros, ítems evaluados y que no cumplen."""
+    claves = [base["FECHA"].dt.strftime("%Y-%m").rename("PERIODO"), base["SUCURSAL"].astype(object)]
+    return {
+        "registros": base.groupby(claves, sort=True).size(),
+        "evaluados": evaluado.groupby(claves, sort=True).sum(),
+        "no_cumple": no_cumple.groupby(claves, sort=True).sum(),
+    }
+
+
+def cargar_registro_personal(df):
+    store = {"sucursales": _sucursales(df), "meses": {}, "año_max": None, "cumplimiento": None}
+    base = _normalizar(df, FORMATO_FECHA)
+    if base is None or base.empty or "SUCURSAL" not in base.columns:
+        return store
+    base["FECHA_DIA"] = base["FECHA"].dt.date
+    evaluado, no_cumple = evaluar_cumplimiento(base)
+    base["ACCIONES_FINALES"] = acciones_correctivas(base, no_cumple)
+    store["meses"] = _por_mes(base)
+    store["año_max"] = int(base["AÑO"].max())
+    store["cumplimiento"] = _resumen_mensual(base, evaluado, no_cumple)
+    return store
+
+
+def cargar_cambio_aceite(df):
+    """Los últimos ULTIMOS_CAMBIOS_ACEITE registros de cada sucursal, del más reciente al más antiguo."""
+    store = {"sucursales": _sucursales(df), "ultimos": {}}
+    base = _normalizar(df, FORMATO_FECHA)
+    if base is None or base.empty or "SUCURSAL" not in base.columns:
+        return store
+    recientes = base.sort_values("FECHA", ascending=False, kind="stable")
+    store["ultimos"] = {suc: grupo.head(ULTIMOS_CAMBIOS_ACEITE)
+                        for suc, grupo in recientes.groupby("SUCURSAL", sort=True, observed=True)}
+    return store
+
+
+def cargar_recepcion_mercaderia(df):
+    store = {"sucursales": _sucursales(df), "meses": {}, "año_max": None}
+    base = _normalizar(df, FORMATO_FECHA_RECEPCION, categoricas=("SUCURSAL", "PRODUCTO"))
+    if base is None or base.empty or not {"SUCURSAL", "PRODUCTO"}.issubset(base.columns):
+        return store
+    store["meses"] = _por_mes(base.sort_values("FECHA", ascending=False, kind="stable"))
+    store["año_max"] = int(base["AÑO"].max())
+    return store
+
+
+
+def _de_sucursal(df, sucursal):
+    return df if sucursal == "TODAS" else df[df["SUCURSAL"] == sucursal]
+
+
+def cambios_aceite(sucursal="TODAS"):
+    """{sucursal: últimos registros (dicts)}, del más reciente al más antiguo."""
+    ultimos = obtener_seremi("cambio_aceite")["ultimos"]
+    if sucursal != "TODAS":
+        ultimos = {sucursal: ultimos[sucursal]} if sucursal in ultimos else {}
+    return {suc: grupo.to_dict(orient="records") for suc, grupo in ultimos.items()}
+
+
+def _agrupar_registros(df, claves, renombrar=None):
+    """
+    {clave1: {clave2: registros (dicts)}} en orden de las claves, respetando el orden de
+    las filas dentro de cada grupo. Un solo to_dict para todo el corte (no uno por grupo).
+    """
+    df = df.dropna(subset=claves).sort_values(claves, kind="stable")
+    externas, internas = df[claves[0]].tolist(), df[claves[1]].tolist()
+    if renombrar:
+        df = df.rename(columns=renombrar)
+    datos = {}
+    for k1, k2, registro in zip(externas, internas, df.to_dict(orient="records")):
+        datos.setdefault(k1, {}).setdefault(k2, []).append(registro)
+    return datos
+
+
+def recepciones_mes(mes, sucursal="TODAS"):
+    """{sucursal: {producto: registros del mes (dicts)}}, cada producto del más reciente al más antiguo."""
+    registros = obtener_seremi("recepcion_mercaderia")["meses"].get(mes)
+    if registros is None:
+        return {}
+    return _agrupar_registros(_de_sucursal(registros, sucursal), ["SUCURSAL", "PRODUCTO"])
+
+
+def personal_por_dia(mes, sucursal="TODAS", renombrar=None):
+    """{sucursal: {fecha: registros (dicts)}} del mes, solo los días con evaluaciones."""
+    registros = obtener_seremi("registro_personal")["meses"].get(mes)
+    if registros is None:
+        return {}
+    return _agrupar_registros(_de_sucursal(registros, sucursal), ["SUCURSAL", "FECHA_DIA"], renombrar)
+
+
+
+def calendario_personal(mes, año, sucursal="TODAS"):
+    """
+    {sucursal: registros del mes en orden de fecha}, con cada día del mes presente: los
+    días sin evaluaciones quedan como {'FECHA_EVALUACION': fecha, 'is_empty': True}.
+    """
+    registros = obtener_seremi("registro_personal")["meses"].get(mes)
+    if registros is None:
+        return {}
+    registros = _de_sucursal(registros, sucursal).dropna(subset=["SUCURSAL"])
+    if registros.empty:
+        return {}
+
+    # Calendario sucursal × día y, por cada día, las filas que caen en él (left merge)
+    dias = pd.date_range(pd.Timestamp(año, mes, 1), periods=pd.Timestamp(año, mes, 1).days_in_month).date
+    sucursales = sorted(registros["SUCURSAL"].unique().tolist())
+    calendario = pd.MultiIndex.from_product([sucursales, dias], names=["SUCURSAL", "FECHA_DIA"]).to_frame(index=False)
+    filas = pd.DataFrame({"SUCURSAL": registros["SUCURSAL"].astype(object).to_numpy(),
+                          "FECHA_DIA": registros["FECHA_DIA"].to_numpy(), "FILA": range(len(registros))})
+    completo = calendario.merge(filas, on=["SUCURSAL", "FECHA_DIA"], how="left")
+
+    lista = registros.to_dict(orient="records")
+    datos = {}
+    for suc, fecha, fila in zip(completo["SUCURSAL"], completo["FECHA_DIA"], completo["FILA"]):
+        if pd.isna(fila):
+            registro = {'FECHA_EVALUACION': fecha, 'is_empty': True}
+        else:
+            registro = lista[int(fila)]
+            registro['FECHA_EVALUACION'] = fecha
+        datos.setdefault(suc, []).append(registro)
+    return datos
+
+
+def rango_resumen(desde=None, hasta=None):
+    """
+    (desde, hasta) en YYYY-MM para el resumen de cumplimiento. Por defecto los últimos
+    MESES_RESUMEN meses con registros; el rango se limita a MAX_MESES_RESUMEN meses.
+    """
+    cumplimiento = obtener_seremi("registro_personal")["cumplimiento"]
+    if cumplimiento is not None and len(cumplimiento["registros"]):
+        ultimo = pd.Period(cumplimiento["registros"].index.get_level_values("PERIODO").max(), freq="M")
+    else:
+        ultimo = pd.Period(pd.Timestamp.now(), freq="M")
+    try:
+        fin = pd.Period(hasta, freq="M") if hasta else ultimo
+    except (ValueError, TypeError):
+        fin = ultimo
+    try:
+        inicio = pd.Period(desde, freq="M") if desde else fin - (MESES_RESUMEN - 1)
+    except (ValueError, TypeError):
+        inicio = fin - (MESES_RESUMEN - 1)
+    if inicio > fin:
+        inicio, fin = fin, inicio
+    inicio = max(inicio, fin - (MAX_MESES_RESUMEN - 1))
+    return str(inicio), str(fin)
+
+
+def _porcentajes(evaluados, no_cumple):
+    # % de cumplimiento por ítem (None si el ítem no se evaluó)
+    pct = (evaluados - no_cumple) / evaluados.where(evaluados > 0) * 100
+    return pct.astype(object).where(pct.notna(), None)
+
+
+def resumen_cumplimiento(desde, hasta, sucursal="TODAS"):
+    """
+    % de cumplimiento por ítem × sucursal × mes entre desde y hasta (YYYY-MM, inclusive):
+    {sucursal: {"meses": [{periodo, registros, items: {ítem: %}}], "total": {registros, items}}}.
+    Los meses sin registros aparecen con registros = 0 e ítems en None.
+    """
+    cumplimiento = obtener_seremi("registro_personal")["cumplimiento"]
+    if cumplimiento is None:
+        return {}
+    periodos = [str(p) for p in pd.period_range(desde, hasta, freq="M")]
+    registros = cumplimiento["registros"]
+    en_rango = registros.index.get_level_values("PERIODO").isin(periodos)
+    if sucursal != "TODAS":
+        en_rango &= registros.index.get_level_values("SUCURSAL") == sucursal
+    if not en_rango.any():
+        return {}
+    registros = registros[en_rango]
+    evaluados = cumplimiento["evaluados"][en_rango].rename(columns=ITEMS_PERSONAL)
+    no_cumple = cumplimiento["no_cumple"][en_rango].rename(columns=ITEMS_PERSONAL)
+
+    datos = {}
+    for suc in sorted(registros.index.get_level_values("SUCURSAL").unique()):
+        # Reindex al calendario del rango: los meses sin registros quedan vacíos
+        evaluados_suc = evaluados.xs(suc, level="SUCURSAL").reindex(periodos, fill_value=0)
+        no_cumple_suc = no_cumple.xs(suc, level="SUCURSAL").reindex(periodos, fill_value=0)
+        registros_suc = registros.xs(suc, level="SUCURSAL").reindex(periodos, fill_value=0)
+        pct = _porcentajes(evaluados_suc, no_cumple_suc)
+        total = _porcentajes(evaluados_suc.sum(), no_cumple_suc.sum())
+        datos[suc] = {
+            "meses": [{"periodo": periodo, "registros": int(n), "items": fila}
+                      for periodo, n, fila in zip(periodos, registros_suc, pct.to_dict(orient="records"))],
+            "total": {"registros": int(registros_suc.sum()), "items": total.to_dict()},
+        }
+    return datos
+
+
+CARGADORES = {
+    "temperatura_equipos": cargar_temperatura_equipos,
+    "temperatura_productos": cargar_temperatura_productos,
+    "equipos_info": cargar_equipos_info,
+    "registro_personal": cargar_registro_personal,
+    "cambio_aceite": cargar_cambio_aceite,
+    "recepcion_mercaderia": cargar_recepcion_mercaderia,
+}
+for _fuente, _cargador in CARGADORES.items():
+    registrar_derivado(_fuente, "seremi", _cargador)
@@ -0,0 +1,44 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# fcntl solo existe en Linux/Mac; en Windows (desarrollo local) no hay varios workers.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Escritura de archivos compartidos entre workers (snapshots, manifest, reglas de
+# costeo, estado de las cargas): se escribe completo a un temporal y se renombra, y
+# quien lee-modifica-escribe toma un flock sobre <ruta>.lock.
+
+
+def escribir_atomico(ruta, escribir):
+    """
+    Llama a escribir(tmp) con un archivo temporal y lo renombra a 'ruta': nadie lee
+    un archivo a medio escribir.
+    """
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        escribir(tmp)
+        os.replace(tmp, ruta)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextmanager
+def bloqueo_archivo(ruta):
+    """Lock exclusivo entre procesos (flock) sobre <ruta>.lock."""
+    if fcntl is None:
+        yield
+        return
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with open(f"{ruta}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,70 @@
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app
+from utils.sheet_cache import obtener_derivado, obtener_version
+
+# Caché de respuestas JSON ya serializadas para los endpoints del dashboard, que
+# reciben casi siempre las mismas combinaciones de filtros. Cada snapshot de la
+# fuente tiene su propio LRU (vía obtener_derivado), así que al recargarse la fuente
+# las respuestas viejas se descartan solas. Además cada entrada vence a los TTL.
+MAX_RESPUESTAS = 256  # por fuente
+TTL_RESPUESTAS = 600  # segundos
+
+_lock = threading.Lock()
+_contadores = {"hits": 0, "misses": 0, "expiradas": 0, "descartadas": 0}
+
+
+def _respuestas_de(empresa):
+    return obtener_derivado(empresa, "respuestas_json", lambda df: OrderedDict())
+
+
+def _contar(nombre):
+    with _lock:
+        _contadores[nombre] += 1
+
+
+def cache_respuesta_json(f):
+    """
+    Sirve la respuesta desde el caché si ya se calculó para los mismos parámetros
+    (empresa, sucursal, semana, año, desde, hasta, familia...) y el mismo snapshot.
+    Solo se guardan respuestas 200. Va después de login_requerido.
+    """
+    @wraps(f)
+    def decorado(*args, **kwargs):
+        empresa = request.args.get("empresa", "comercial")
+        respuestas = _respuestas_de(empresa)
+        clave = (request.path, obtener_version(empresa), tuple(sorted(request.args.items(multi=True))))
+
+        with _lock:
+            guardada = respuestas.get(clave)
+            if guardada is not None and time.time() - guardada[0] > TTL_RESPUESTAS:
+                respuestas.pop(clave, None)
+                _contadores["expiradas"] += 1
+                guardada = None
+            if guardada is not None:
+                respuestas.move_to_end(clave)
+                _contadores["hits"] += 1
+        if guardada is not None:
+            return current_app.response_class(guardada[1], mimetype=guardada[2])
+
+        _contar("misses")
+        respuesta = current_app.make_response(f(*args, **kwargs))
+        if respuesta.status_code == 200 and not respuesta.direct_passthrough:
+            with _lock:
+                respuestas[clave] = (time.time(), respuesta.get_data(), respuesta.mimetype)
+                while len(respuestas) > MAX_RESPUESTAS:
+                    respuestas.popitem(last=False)
+                    _contadores["descartadas"] += 1
+        return respuesta
+    return decorado
+
+
+def obtener_estadisticas():
+    """Hits, misses, expiradas y descartadas (LRU) desde que partió el proceso."""
+    with _lock:
+        estadisticas = dict(_contadores)
+    total = estadisticas["hits"] + estadisticas["misses"]
+    estadisticas["tasa_hits"] = round(estadisticas["hits"] / total, 3) if total else None
+    return estadisticas
@@ -1,61 +1,116 @@
 import os
 import json
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+import numpy as np
 from flask import current_app
 import copy
+from utils.archivos import escribir_atomico, bloqueo_archivo
 
 COSTEO_FILENAME = "costeo_reglas.json"
 
+# Las reglas se mantienen en memoria y se validan contra el mtime/tamaño del archivo:
+# leer no vuelve a parsear el JSON mientras nadie lo haya cambiado. Cada modificación
+# toma el lock del archivo (entre workers), parte de la versión más reciente en disco,
+# la escribe de forma atómica (temporal + rename) y deja el resultado en memoria.
+_lock = threading.RLock()
+_reglas_cache = {"ruta": None, "firma": None, "data": None, "indice_costos": None}
+
 def _ruta_archivo():
     # Guardamos el JSON en la misma carpeta segura que los prorrateos contables
     ruta = current_app.config.get("UPLOAD_FOLDER_CONTAB", "tmp")
     os.makedirs(ruta, exist_ok=True)
     return os.path.join(ruta, COSTEO_FILENAME)
 
-def cargar_reglas():
-    ruta = _ruta_archivo()
+def _reglas_vacias():
+    return {
+        "mapeo_cuentas": {},
+        "costos_directos_base": {},
+        "reglas_gastos": {}
+    }
+
+def _firma(ruta):
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _leer_disco(ruta):
     if not os.path.exists(ruta):
-        return {
-            "mapeo_cuentas": {},
-            "costos_directos_base": {},
-            "reglas_gastos": {}
-        }
+        return _reglas_vacias()
     try:
         with open(ruta, "r", encoding="utf-8") as f:
             return json.load(f)
-    except:
-        return {
-            "mapeo_cuentas": {},
-            "costos_directos_base": {},
-            "reglas_gastos": {}
-        }
+    except Exception as e:
+        print(f"⚠️ No se pudo leer {COSTEO_FILENAME}, se usan reglas vacías: {e}")
+        return _reglas_vacias()
 
-def guardar_reglas(data):
+def _reglas():
+    """Reglas vigentes (compartidas, no modificar). Solo relee el JSON si cambió en disco."""
     ruta = _ruta_archivo()
-    with open(ruta, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    firma = _firma(ruta)
+    with _lock:
+        if _reglas_cache["ruta"] != ruta or _reglas_cache["firma"] != firma or _reglas_cache["data"] is None:
+            _reglas_cache.update(ruta=ruta, firma=firma, data=_leer_disco(ruta), indice_costos=None)
+        return _reglas_cache["data"]
 
-def guardar_mapeo(producto, cuenta):
-    data = cargar_reglas()
+@contextmanager
+def _modificar_reglas():
+    """
+    Entrega una copia de las reglas para modificarla; al salir del bloque se escribe
+    una sola vez (atómico) y queda como la versión en memoria.
+    """
+    ruta = _ruta_archivo()
+    with _lock, bloqueo_archivo(ruta):
+        # Bajo el lock se relee si otro worker guardó entre medio
+        data = copy.deepcopy(_reglas())
+        yield data
+
+        def escribir(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        escribir_atomico(ruta, escribir)
+        _reglas_cache.update(ruta=ruta, firma=_firma(ruta), data=data, indice_costos=None)
+
+def cargar_reglas():
+    return copy.deepcopy(_reglas())
+
+def guardar_reglas(data):
+    with _modificar_reglas() as actual:
+        actual.clear()
+        actual.update(copy.deepcopy(data))
+
+def _aplicar_mapeo(data, producto, cuenta):
     if cuenta:
         data["mapeo_cuentas"][producto] = cuenta
     else:
         data["mapeo_cuentas"].pop(producto, None) # Desmapear si viene vacío
-    guardar_reglas(data)
 
-def guardar_costo_directo(producto, costo, periodo):
-    data = cargar_reglas()
-    
+def guardar_mapeo(producto, cuenta):
+    guardar_mapeos({producto: cuenta})
+
+def guardar_mapeos(mapeos):
+    """Guarda varios {producto: cuenta} de una vez (cuenta vacía = desmapear)."""
+    with _modificar_reglas() as data:
+        data.setdefault("mapeo_cuentas", {})
+        for producto, cuenta in mapeos.items():
+            _aplicar_mapeo(data, producto, cuenta)
+
+def _migrar_costos_legacy(data):
     if "costos_directos_base" not in data:
         data["costos_directos_base"] = {}
-        
+
     # Migración legacy a formato diccionario de periodos
     for p, v in list(data["costos_directos_base"].items()):
         if not isinstance(v, dict):
             data["costos_directos_base"][p] = {"2000-01": float(v)}
-            
+
+def _aplicar_costo(data, producto, costo, periodo):
     if producto not in data["costos_directos_base"]:
         data["costos_directos_base"][producto] = {}
-        
+
     if costo == "" or costo is None:
         data["costos_directos_base"][producto].pop(periodo, None)
     else:
@@ -63,50 +118,103 @@ def guardar_costo_directo(producto, costo, periodo):
             data["costos_directos_base"][producto][periodo] = float(costo)
         except ValueError:
             data["costos_directos_base"][producto].pop(periodo, None)
-    guardar_reglas(data)
 
-def obtener_costos_efectivos(periodo):
-    data = cargar_reglas()
-    costos_efectivos = {}
-    costos_propios = {}
-    
+def guardar_costo_directo(producto, costo, periodo):
+    guardar_costos_directos({producto: costo}, periodo)
+
+def guardar_costos_directos(costos, periodo):
+    """Guarda varios {producto: costo} de un periodo en una sola escritura."""
+    with _modificar_reglas() as data:
+        _migrar_costos_legacy(data)
+        for producto, costo in costos.items():
+            _aplicar_costo(data, producto, costo, periodo)
+
+def _indice_costos():
+    """
+    Tabla "as-of" de costos directos, una vez por versión de las reglas:
+    producto -> (periodos ordenados, costos en ese orden). Los costos legacy (un
+    número sin periodo) quedan con periodos None y valen para cualquier mes.
+    """
+    data = _reglas()
+    with _lock:
+        if _reglas_cache["data"] is data and _reglas_cache["indice_costos"] is not None:
+            return _reglas_cache["indice_costos"]
+    indice = {}
     for prod, historico in data.get("costos_directos_base", {}).items():
         if isinstance(historico, dict):
-            validos = [p for p in historico.keys() if p <= periodo]
-            if validos:
-                max_p = max(validos)
-                costos_efectivos[prod] = historico[max_p]
-                costos_propios[prod] = (max_p == periodo)
+            periodos = sorted(historico)
+            indice[prod] = (periodos, [historico[p] for p in periodos])
         else:
-            costos_efectivos[prod] = float(historico)
+            indice[prod] = (None, float(historico))
+    with _lock:
+        if _reglas_cache["data"] is data:
+            _reglas_cache["indice_costos"] = indice
+    return indice
+
+def obtener_costos_efectivos(periodo):
+    costos_efectivos = {}
+    costos_propios = {}
+
+    for prod, (periodos, costos) in _indice_costos().items():
+        if periodos is None:
+            costos_efectivos[prod] = costos
             costos_propios[prod] = False
-            
+            continue
+        # Último periodo <= periodo
+        i = bisect_right(periodos, periodo)
+        if i:
+            costos_efectivos[prod] = costos[i - 1]
+            costos_propios[prod] = (periodos[i - 1] == periodo)
+
     return costos_efectivos, costos_propios
 
+def obtener_costos_as_of(periodos_consulta):
+    """
+    obtener_costos_efectivos para varios periodos de una vez (p. ej. 24 meses de
+    tendencia): {periodo: (costos_efectivos, costos_propios)}.
+    """
+    consulta = list(dict.fromkeys(periodos_consulta))
+    resultado = {p: ({}, {}) for p in consulta}
+    if not consulta:
+        return resultado
+    arr_consulta = np.array(consulta)
+
+    for prod, (periodos, costos) in _indice_costos().items():
+        if periodos is None:
+            for efectivos, propios in resultado.values():
+                efectivos[prod] = costos
+                propios[prod] = False
+            continue
+        posiciones = np.searchsorted(np.array(periodos), arr_consulta, side="right")
+        for p, i in zip(consulta, posiciones.tolist()):
+            if i:
+                efectivos, propios = resultado[p]
+                efectivos[prod] = costos[i - 1]
+                propios[prod] = (periodos[i - 1] == p)
+
+    return resultado
+
 def guardar_regla_gasto(sucursal, escenario, cuenta, regla_data):
-    data = cargar_reglas()
-    if "reglas_gastos" not in data: data["reglas_gastos"] = {}
-    if sucursal not in data["reglas_gastos"]: data["reglas_gastos"][sucursal] = {}
-    if escenario not in data["reglas_gastos"][sucursal]: data["reglas_gastos"][sucursal][escenario] = {}
-    
-    data["reglas_gastos"][sucursal][escenario][cuenta] = regla_data
-    guardar_reglas(data)
+    with _modificar_reglas() as data:
+        if "reglas_gastos" not in data: data["reglas_gastos"] = {}
+        if sucursal not in data["reglas_gastos"]: data["reglas_gastos"][sucursal] = {}
+        if escenario not in data["reglas_gastos"][sucursal]: data["reglas_gastos"][sucursal][escenario] = {}
+
+        data["reglas_gastos"][sucursal][escenario][cuenta] = regla_data
 
 def copiar_reglas_gastos(sucursal_origen, esc_origen, sucursal_destino, esc_destino):
-    data = cargar_reglas()
-    reglas_origen = data.get("reglas_gastos", {}).get(sucursal_origen, {}).get(esc_origen, {})
-    
-    if "reglas_gastos" not in data: data["reglas_gastos"] = {}
-    if sucursal_destino not in data["reglas_gastos"]: data["reglas_gastos"][sucursal_destino] = {}
-    
-    data["reglas_gastos"][sucursal_destino][esc_destino] = copy.deepcopy(reglas_origen)
-    guardar_reglas(data)
+    with _modificar_reglas() as data:
+        reglas_origen = data.get("reglas_gastos", {}).get(sucursal_origen, {}).get(esc_origen, {})
+
+        if "reglas_gastos" not in data: data["reglas_gastos"] = {}
+        if sucursal_destino not in data["reglas_gastos"]: data["reglas_gastos"][sucursal_destino] = {}
+
+        data["reglas_gastos"][sucursal_destino][esc_destino] = copy.deepcopy(reglas_origen)
 
 def guardar_prorrateo_adm(distribucion):
-    data = cargar_reglas()
-    data["prorrateo_adm"] = distribucion
-    guardar_reglas(data)
+    with _modificar_reglas() as data:
+        data["prorrateo_adm"] = distribucion
 
 def obtener_prorrateo_adm():
-    data = cargar_reglas()
-    return data.get("prorrateo_adm", {})
\ No newline at end of file
+    data = _reglas()
+    return copy.deepcopy(data.get("prorrateo_adm", {}))
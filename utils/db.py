@@ -1,7 +1,8 @@
 import os
 import pymysql
 
-def get_db_connection():
+def get_db_connection(**opciones):
+    # 'opciones' se pasa tal cual a pymysql.connect (ej: connect_timeout, read_timeout)
     # Si existen variables de entorno, las usamos (producción)
     host = os.environ.get("DB_HOST")
     user = os.environ.get("DB_USER")
@@ -16,6 +17,7 @@ def get_db_connection():
             password=password,
             database=name,
             cursorclass=pymysql.cursors.DictCursor,
+            **opciones,
         )
 
     # Si no hay variables → asumimos entorno local (lo que ya tienes)
@@ -25,4 +27,5 @@ def get_db_connection():
         password="26235834",
         database="huente_app",
         cursorclass=pymysql.cursors.DictCursor,
+        **opciones,
     )
@@ -1,7 +1,127 @@
+import numpy as np
 import pandas as pd
+from utils.sheet_cache import obtener_derivado, registrar_derivado
 
-def filtrar_dataframe(df, tipo, valor, sucursal, semana, año, desde, hasta):
-    df = df.copy()
+# --- Índice de filtros por snapshot ---
+# Se construye una vez por versión de la fuente (vía obtener_derivado) y responde los
+# filtros sin recorrer todo el DataFrame:
+#   - FAMILIA / DESCRIPCION / SUCURSAL / (AÑO, SEMANA): índices invertidos
+#     valor -> posiciones de fila (ordenadas), armados con un solo groupby.
+#   - FECHA: permutación ordenada por fecha + búsqueda binaria del rango.
+# El resultado son posiciones en el orden original del snapshot, así que
+# df.iloc[posiciones] entrega exactamente las mismas filas (y etiquetas) que los
+# filtros con máscara booleana.
+COLUMNAS_INDEXADAS = ["FAMILIA", "DESCRIPCION", "SUCURSAL"]
+
+
+def construir_indice_filtros(df):
+    indice = {"index": df.index, "filas": len(df), "valores": {}}
+    for col in COLUMNAS_INDEXADAS:
+        if col in df.columns:
+            indice["valores"][col] = df.groupby(col, sort=False, observed=True).indices
+
+    if "AÑO" in df.columns and "SEMANA" in df.columns:
+        indice["semanas"] = df.groupby(["AÑO", "SEMANA"], sort=False, observed=True).indices
+
+    if "FECHA" in df.columns and pd.api.types.is_datetime64_any_dtype(df["FECHA"]):
+        fechas = df["FECHA"].to_numpy()
+        validas = np.flatnonzero(~np.isnat(fechas))
+        orden = validas[np.argsort(fechas[validas], kind="stable")]
+        indice["fechas"] = fechas[orden]
+        indice["orden_fecha"] = orden
+        # Si el snapshot ya viene ordenado por fecha (fechas vacías al final), un rango
+        # es un slice contiguo y df.iloc lo entrega como vista, sin copiar filas
+        indice["fechas_ordenadas"] = bool(np.array_equal(orden, np.arange(len(orden))))
+    return indice
+
+
+def obtener_indice_filtros(empresa):
+    return obtener_derivado(empresa, "indice_filtros", construir_indice_filtros)
+
+
+for _empresa in ("comercial", "agricola"):
+    registrar_derivado(_empresa, "indice_filtros", construir_indice_filtros)
+
+
+def _intersectar(actual, posiciones, filas):
+    # Ambas listas vienen ordenadas; marcar una y filtrar la otra es lineal (sin sort)
+    if actual is None:
+        return posiciones
+    marca = np.zeros(filas, dtype=bool)
+    marca[actual] = True
+    return posiciones[marca[posiciones]]
+
+
+def _posiciones_filtradas(indice, tipo, valor, sucursal, semana, año, desde, hasta):
+    """
+    Posiciones (o un slice) de las filas que cumplen los filtros; None = todas.
+    Mismas reglas que el filtrado por máscaras de filtrar_dataframe.
+    """
+    vacio = np.array([], dtype=np.intp)
+    posiciones = None
+
+    if tipo in ("FAMILIA", "DESCRIPCION") and valor != "TODOS":
+        posiciones = indice["valores"][tipo].get(valor, vacio)
+
+    if sucursal and sucursal != "TODAS":
+        posiciones = _intersectar(posiciones, indice["valores"]["SUCURSAL"].get(sucursal, vacio), indice["filas"])
+
+    if desde and hasta:
+        desde_dt = pd.to_datetime(desde, errors="coerce")
+        hasta_dt = pd.to_datetime(hasta, errors="coerce")
+        if pd.isna(desde_dt) or pd.isna(hasta_dt):
+            return vacio
+        fechas = indice["fechas"]
+        ini = np.searchsorted(fechas, desde_dt.to_datetime64(), side="left")
+        fin = np.searchsorted(fechas, hasta_dt.to_datetime64(), side="right")
+        if posiciones is None and indice["fechas_ordenadas"]:
+            return slice(ini, fin)
+        rango = indice["orden_fecha"][ini:fin]
+        if not indice["fechas_ordenadas"]:
+            rango = np.sort(rango)
+        posiciones = _intersectar(posiciones, rango, indice["filas"])
+
+    # Solo aplicar semana y año si NO hay filtro por fechas
+    elif semana and año:
+        semana_año = indice["semanas"].get((int(año), int(semana)), vacio)
+        posiciones = _intersectar(posiciones, semana_año, indice["filas"])
+
+    return posiciones
+
+
+def _indice_aplicable(indice, df):
+    return (indice["filas"] == len(df) and "fechas" in indice and "semanas" in indice
+            and all(col in indice["valores"] for col in COLUMNAS_INDEXADAS)
+            and df.index.equals(indice["index"]))
+
+
+def filtrar_con_indice(df, indice, tipo, valor, sucursal, semana, año, desde, hasta):
+    """Aplica los filtros de filtrar_dataframe a df usando un índice construido sobre él."""
+    try:
+        posiciones = _posiciones_filtradas(indice, tipo, valor, sucursal, semana, año, desde, hasta)
+    except Exception:
+        return pd.DataFrame()
+    if posiciones is None:
+        return df.copy(deep=False)
+    return df.iloc[posiciones]
+
+
+def filtrar_dataframe(df, tipo, valor, sucursal, semana, año, desde, hasta, empresa=None):
+    """
+    Filtra el detalle de ventas. Si se indica la empresa y df es su snapshot de
+    obtener_datos, responde con el índice precalculado; si no, recorre df.
+    """
+    if empresa is not None:
+        indice = obtener_indice_filtros(empresa)
+        if _indice_aplicable(indice, df):
+            return filtrar_con_indice(df, indice, tipo, valor, sucursal, semana, año, desde, hasta)
+    return _filtrar_por_mascaras(df, tipo, valor, sucursal, semana, año, desde, hasta)
+
+
+def _filtrar_por_mascaras(df, tipo, valor, sucursal, semana, año, desde, hasta):
+    # Copia superficial: los filtros de abajo crean frames nuevos y, con Copy-on-Write,
+    # no hace falta duplicar todo el snapshot del caché en cada llamada.
+    df = df.copy(deep=False)
 
     #print("=== FILTROS APLICADOS ===")
     #print({
@@ -15,7 +135,7 @@ def filtrar_dataframe(df, tipo, valor, sucursal, semana, año, desde, hasta):
     #})
 
     # Asegurar que FECHA sea datetime
-    if "FECHA" in df.columns:
+    if "FECHA" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["FECHA"]):
         df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
 
     # Filtro por tipo
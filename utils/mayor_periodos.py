@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from utils.sheet_cache import obtener_derivado, registrar_derivado, _vista_solo_lectura
+
+# --- Mayor normalizado y particionado por mes ---
+# Las rutas de contabilidad y costeo repetían en cada request la misma preparación del
+# libro mayor (fechas, SALDO, strings sin espacios) y después filtraban un mes. Esto se
+# hace una vez por snapshot (vía obtener_derivado) y queda:
+#   - "completo": el mayor normalizado, en el orden original y con sus etiquetas.
+#   - "periodos": YYYY-MM -> DataFrame de ese mes (mismas filas y orden que el filtro).
+#   - "posiciones": YYYY-MM -> posiciones en "completo", para armar rangos de meses.
+# Columnas agregadas: PERIODO_STR, SALDO (DEBE - HABER), SALDO_REAL (-SALDO) y CLASE
+# (primer dígito de la cuenta: 1 Activo, 2 Pasivo, 3 Gastos, 4 Ingresos).
+COLUMNAS_TEXTO = ["CENTRO COSTO", "CUENTA", "NOMBRE"]
+
+
+def _periodos_de(fechas):
+    # strftime fila a fila es caro: se formatea una vez por (año, mes) distinto
+    claves = fechas.dt.year * 100 + fechas.dt.month
+    unicas = claves.dropna().unique()
+    return claves.map({c: f"{int(c) // 100}-{int(c) % 100:02d}" for c in unicas})
+
+
+def construir_mayor_normalizado(df):
+    base = df.copy()
+    if base.empty or "FECHA" not in base.columns:
+        return {"completo": base, "periodos": {}, "posiciones": {}, "fecha_max": None}
+
+    base["FECHA"] = pd.to_datetime(base["FECHA"], errors="coerce")
+    for col in ["DEBE", "HABER"]:
+        base[col] = pd.to_numeric(base[col], errors="coerce").fillna(0)
+    for col in COLUMNAS_TEXTO:
+        base[col] = base[col].astype(str).str.strip()
+    base["PERIODO_STR"] = _periodos_de(base["FECHA"])
+    base["SALDO"] = base["DEBE"] - base["HABER"]
+    base["SALDO_REAL"] = base["SALDO"] * -1
+    base["CLASE"] = base["CUENTA"].str[0]
+
+    posiciones = base.groupby("PERIODO_STR", sort=True).indices
+    return {
+        "completo": base,
+        "periodos": {p: base.iloc[pos] for p, pos in posiciones.items()},
+        "posiciones": posiciones,
+        "fecha_max": base["FECHA"].max(),
+    }
+
+
+def obtener_mayor_normalizado():
+    return obtener_derivado("mayor", "mayor_periodos", construir_mayor_normalizado)
+
+
+registrar_derivado("mayor", "mayor_periodos", construir_mayor_normalizado)
+
+
+def obtener_mayor_completo():
+    """Todo el mayor normalizado (con PERIODO_STR, SALDO, SALDO_REAL y CLASE)."""
+    return _vista_solo_lectura(obtener_mayor_normalizado()["completo"])
+
+
+def obtener_periodo_mayor(periodo):
+    """Movimientos normalizados de un mes (YYYY-MM); vacío si no hay."""
+    store = obtener_mayor_normalizado()
+    df = store["periodos"].get(periodo)
+    if df is None:
+        return store["completo"].iloc[0:0].copy()
+    return _vista_solo_lectura(df)
+
+
+def obtener_periodos_mayor(periodos=None, desde=None, hasta=None):
+    """
+    Movimientos de varios meses: los de la lista 'periodos' o los del rango
+    [desde, hasta] (YYYY-MM, extremos opcionales). Mantiene el orden original del mayor.
+    """
+    store = obtener_mayor_normalizado()
+    if periodos is None:
+        periodos = [p for p in store["posiciones"]
+                    if (desde is None or p >= desde) and (hasta is None or p <= hasta)]
+    pos = [store["posiciones"][p] for p in set(periodos) if p in store["posiciones"]]
+    if not pos:
+        return store["completo"].iloc[0:0].copy()
+    return store["completo"].iloc[np.sort(np.concatenate(pos))]
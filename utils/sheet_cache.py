@@ -3,16 +3,41 @@ import pandas as pd
 from datetime import datetime
 import pytz
 import io
+import hashlib
+import time
+import threading
 import os # Necesario para construir la ruta al archivo de credenciales
+import requests
+import httplib2
+from concurrent.futures import ThreadPoolExecutor, wait
 from utils.db import get_db_connection
+from utils.snapshot_store import guardar_snapshot, leer_snapshot, meta_publicada, bloqueo_carga
 
 # Imports para la API de Google
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from google_auth_httplib2 import AuthorizedHttp
 
 _ultima_actualizacion = {}
 _cache = {}
+
+# Copy-on-Write: las vistas que entrega obtener_datos comparten memoria con el caché
+# y pandas solo duplica una columna cuando alguien la modifica. En pandas >= 3 siempre
+# está activo; en 1.5/2.x no se toca la opción global (cambiaría el comportamiento de
+# todo el proceso) y las vistas son copias completas, salvo que la app ya lo haya activado.
+_PANDAS_3 = int(pd.__version__.split(".")[0]) >= 3
+
+
+def _copy_on_write_activo():
+    if _PANDAS_3:
+        return True
+    try:
+        return pd.get_option("mode.copy_on_write") is True
+    except Exception:
+        return False
+
+
 # ... (Aquí va tu diccionario de URLS, sin cambios)
 URLS = {
     "comercial": "https://docs.google.com/spreadsheets/d/e/2PACX-1vSwgsbEzQxQAkBXjP5LfyqOalCDCEJRq_YxMrGII-VkijQSbjm_zxMZpXMVE6LtKhIYWYyhFYC6-UwY/pub?output=csv",
@@ -38,191 +63,575 @@ URLS = {
 #}
 
 
-# --- REEMPLAZA TU FUNCIÓN obtener_datos CON ESTA ---
+COLUMNAS_BASE = ["FECHA", "DESCRIPCION", "NETO", "CANTIDAD", "SUCURSAL", "FAMILIA", "AÑO", "SEMANA"]
+
+# --- Estado de refresco (stale-while-revalidate) ---
+# Cada fuente tiene su propio lock: solo un cargador por 'empresa' a la vez. Mientras
+# se descarga la versión nueva, los requests siguen leyendo el snapshot anterior y
+# el reemplazo en _cache es una sola asignación (atómica para los demás hilos).
+_locks = {}
+_locks_guard = threading.Lock()
+_estado_refresco = {}
+_version = {}
+_version_fuente = {}  # Versión del origen (hash del contenido) del snapshot publicado
+_derivados = {}  # (empresa, clave) -> (snapshot, estructura construida a partir de él)
+_precalculos = {}  # empresa -> {clave: constructor} que se construyen apenas se recarga
+
+# Un worker que arranca desde el snapshot en disco lo sirve de inmediato; si el snapshot
+# tiene más de esta antigüedad, además lanza una revalidación en segundo plano.
+REVALIDAR_SNAPSHOT_TRAS = 3600  # segundos
+
+# --- Caché compartido entre workers (gunicorn/Passenger) ---
+# El snapshot en disco es la fuente de verdad entre procesos: quien recarga una fuente
+# la guarda y sube su 'generacion' en el manifest; los demás workers lo notan (como
+# máximo cada INTERVALO_REVISION_COMPARTIDA segundos) y adoptan el archivo mapeado en
+# memoria, sin volver a descargar. La descarga misma se serializa con un flock.
+_generacion = {}  # Generación del manifest que tiene publicada este worker
+_ultima_revision = {}
+INTERVALO_REVISION_COMPARTIDA = 2  # segundos
+
+# --- Carga paralela ---
+# Las fuentes son descargas independientes (I/O), así que se cargan en paralelo con
+# concurrencia acotada. Cada descarga tiene timeout propio y reintentos con backoff
+# exponencial para que una planilla lenta no frene el refresco completo.
+MAX_CARGAS_PARALELAS = 4
+TIMEOUT_DESCARGA = 60          # segundos por intento de descarga (HTTP, Drive, MySQL)
+TIMEOUT_REFRESCO_TOTAL = 300   # tope de espera de refrescar_todo_el_cache
+REINTENTOS_DESCARGA = 3
+BACKOFF_BASE = 2               # segundos: 2, 4, 8...
+
+# Carga en frío dentro de un request (la fuente no está en caché ni en disco): un solo
+# intento; los reintentos quedan para el refresco en segundo plano. Si falla, durante
+# ESPERA_TRAS_FALLO segundos los requests responden vacío sin volver a intentar.
+ESPERA_TRAS_FALLO = 60  # segundos
+_fallo_en_frio = {}  # empresa -> time.time() del último intento fallido en frío
+
+
+def _lock_de(empresa):
+    with _locks_guard:
+        if empresa not in _locks:
+            _locks[empresa] = threading.Lock()
+        return _locks[empresa]
+
+
+def _fuentes():
+    fuentes = list(URLS.keys())
+    if "agricola" not in fuentes:
+        fuentes.append("agricola")
+    return fuentes
+
+
+def _con_reintentos(funcion, descripcion, reintentos=REINTENTOS_DESCARGA):
+    """Ejecuta una descarga reintentando con backoff exponencial si falla."""
+    for intento in range(1, reintentos + 1):
+        try:
+            return funcion()
+        except Exception as e:
+            if intento == reintentos:
+                raise
+            espera = BACKOFF_BASE * 2 ** (intento - 1)
+            print(f"⚠️ {descripcion}: intento {intento} falló ({e}). Reintentando en {espera}s")
+            time.sleep(espera)
+
+
+def _descargar_csv(url, previa):
+    """
+    Descarga condicional: reenvía el ETag/Last-Modified de la versión anterior.
+    Retorna (contenido, version); contenido es None si el servidor responde 304.
+    """
+    # Añadimos un User-Agent para simular una petición de navegador
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    if previa.get("etag"):
+        headers["If-None-Match"] = previa["etag"]
+    if previa.get("last_modified"):
+        headers["If-Modified-Since"] = previa["last_modified"]
+
+    resp = requests.get(url, headers=headers, timeout=TIMEOUT_DESCARGA)
+    if resp.status_code == 304:
+        return None, previa
+    resp.raise_for_status()
+    version = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "sha1": hashlib.sha1(resp.content).hexdigest(),
+    }
+    return resp.content, version
+
+
+def _descargar_mayor(folder_id, previa):
+    """
+    Consulta modifiedTime/md5Checksum del archivo en Drive y solo lo descarga si cambió.
+    Retorna (contenido, version); contenido es None si el archivo es el mismo.
+    """
+    SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    ROOT_DIR = os.path.dirname(BASE_DIR)
+    SERVICE_ACCOUNT_FILE = os.path.join(ROOT_DIR, 'credenciales_google.json')
+
+    creds = service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=TIMEOUT_DESCARGA))
+    drive_service = build('drive', 'v3', http=http, cache_discovery=False)
+    file_name = 'mayor.xlsx'
+
+    query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
+    results = drive_service.files().list(q=query, fields="files(id, name, modifiedTime, md5Checksum)").execute()
+    items = results.get('files', [])
+
+    if not items:
+        raise Exception(f"No se encontró el archivo '{file_name}' en la carpeta de Drive.")
+
+    file_id = items[0]['id']
+    version = {"file_id": file_id, "modified_time": items[0].get("modifiedTime"), "md5": items[0].get("md5Checksum")}
+    if previa.get("file_id") == file_id:
+        if version["md5"] and version["md5"] == previa.get("md5"):
+            return None, version
+        if not version["md5"] and version["modified_time"] and version["modified_time"] == previa.get("modified_time"):
+            return None, version
+
+    request = drive_service.files().get_media(fileId=file_id)
+    file_content = io.BytesIO()
+    downloader = MediaIoBaseDownload(file_content, request)
+
+    done = False
+    while done is False:
+        status, done = downloader.next_chunk()
+
+    file_content.seek(0)
+    return file_content, version
+
+
+def _version_agricola():
+    """La tabla solo cambia al subir o revertir una carga: basta con mirar cargas_agricola."""
+    conn = get_db_connection(connect_timeout=TIMEOUT_DESCARGA, read_timeout=TIMEOUT_DESCARGA)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(carga_id) AS max_carga_id, COUNT(*) AS cargas FROM cargas_agricola")
+        row = cursor.fetchone() or {}
+        return {"max_carga_id": row.get("max_carga_id"), "cargas": row.get("cargas")}
+    finally:
+        conn.close()
+
+
+def _consultar_agricola():
+    conn = get_db_connection(connect_timeout=TIMEOUT_DESCARGA, read_timeout=TIMEOUT_DESCARGA)
+    try:
+        cursor = conn.cursor()
+
+        # Optimizamos la consulta para traer SOLO las columnas necesarias
+        # y filtrar directo en MySQL, reduciendo drásticamente el uso de RAM y tiempo.
+        query = """
+            SELECT fecha, des_articu, rubro, n_comp, sub_rengl, des_client, cantidad
+            FROM ventas_agricola
+            WHERE UPPER(TRIM(estado)) IN ('COBRADO', 'COBRADA', 'DESPACH./COBRADA')
+              AND fecha IS NOT NULL
+        """
+        cursor.execute(query)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def _cargar_fuente(empresa, version_actual=None, reintentos=REINTENTOS_DESCARGA):
+    """
+    Descarga y normaliza una fuente completa. No toca el caché: devuelve
+    (df, version) o lanza la excepción para que el llamador decida.
+    Si el origen no cambió respecto de 'version_actual' (ETag/Last-Modified del CSV,
+    md5 de Drive o última carga agrícola), no se descarga ni se parsea: retorna (None, version).
+    """
+    url_o_id = URLS.get(empresa)
+    previa = version_actual if isinstance(version_actual, dict) else {}
+
+    # "agricola" no usa url_o_id porque lee directo de la Base de Datos
+    if not url_o_id and empresa != "agricola":
+        raise Exception(f"No se ha definido la URL o ID para '{empresa}'")
+
+    if empresa == "mayor":
+        file_content, version = _con_reintentos(lambda: _descargar_mayor(url_o_id, previa), "Descarga de 'mayor.xlsx'", reintentos)
+        if file_content is None:
+            return None, version
+        df = pd.read_excel(file_content, engine="openpyxl")
+        df.columns = df.columns.str.strip().str.upper()
+        df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
+        df = df.dropna(subset=["FECHA", "NOMBRE", "DEBE", "HABER"])
+        df["AÑO"] = df["FECHA"].dt.year
+        df["MES"] = df["FECHA"].dt.month
+        return df, version
+
+    if empresa == "agricola":
+        # --- LEER DESDE LA BASE DE DATOS LOCAL ---
+        version = _con_reintentos(_version_agricola, "Consulta de 'cargas_agricola'", reintentos)
+        if previa and version == previa:
+            return None, version
+        rows = _con_reintentos(_consultar_agricola, "Consulta de 'ventas_agricola'", reintentos)
+
+        if not rows:
+            return pd.DataFrame(columns=COLUMNAS_BASE), version
+
+        df = pd.DataFrame(rows)
+        df.columns = df.columns.str.strip().str.upper()
+
+        # 1. Renombrar para el Dashboard estándar (El filtro de estado ya se hizo en SQL)
+        df.rename(columns={
+            "DES_ARTICU": "DESCRIPCION",
+            "RUBRO": "FAMILIA",
+            "N_COMP": "N_BOLETA"
+        }, inplace=True)
+
+        # Usamos 'SUB_RENGL' de la base de datos y lo dividimos por 1.19 para obtener el Neto real por línea.
+        df["NETO"] = pd.to_numeric(df["SUB_RENGL"], errors='coerce').fillna(0) / 1.19
+
+        # 3. Clasificar Sucursal usando DES_CLIENT
+        def clasificar_cliente(cliente):
+            if pd.isna(cliente):
+                return "FACTURA"
+            cliente_str = str(cliente).upper()
+            if "OCASIONAL" in cliente_str:
+                return "BOLETAS"
+            elif "TRABAJADOR" in cliente_str:
+                return "TRABAJADOR"
+            else:
+                return "FACTURA"
+
+        if "DES_CLIENT" in df.columns:
+            df["SUCURSAL"] = df["DES_CLIENT"].apply(clasificar_cliente)
+        else:
+            df["SUCURSAL"] = "FACTURA"
+
+        columnas_requeridas = ["FECHA", "DESCRIPCION", "NETO", "CANTIDAD"]
+        df = df.dropna(subset=columnas_requeridas)
+        df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
+        df["CANTIDAD"] = pd.to_numeric(df["CANTIDAD"], errors="coerce").fillna(0)
+        df["SEMANA"] = df["FECHA"].dt.isocalendar().week
+        df["AÑO"] = df["FECHA"].dt.year
+        return df, version
+
+    contenido, version = _con_reintentos(lambda: _descargar_csv(url_o_id, previa), f"Descarga de '{empresa}'", reintentos)
+    # Sin 304, el contenido igual puede ser idéntico (Google no siempre envía ETag)
+    if contenido is None or version["sha1"] == previa.get("sha1"):
+        return None, version
+    df = pd.read_csv(io.BytesIO(contenido), encoding="utf-8", low_memory=False)
+
+    df.columns = df.columns.str.strip().str.upper()
+
+    if empresa == "comercial":
+        df.rename(columns={"AÃ‘O": "AÑO"}, inplace=True)
+        columnas_requeridas = ["FECHA", "DESCRIPCION", "NETO", "CANTIDAD"]
+        faltantes = [col for col in columnas_requeridas if col not in df.columns]
+        if faltantes:
+            raise KeyError(f"❌ Columnas faltantes en '{empresa}': {faltantes}")
+
+        # FIX: Asegurarse de que la columna FAMILIA siempre exista para evitar que el dashboard se caiga.
+        if "FAMILIA" not in df.columns:
+            df["FAMILIA"] = "SIN FAMILIA"
+
+        df = df.dropna(subset=columnas_requeridas)
+        df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors="coerce")
+        df["CANTIDAD"] = pd.to_numeric(df["CANTIDAD"], errors="coerce").fillna(0)
+        df["NETO"] = pd.to_numeric(df["NETO"], errors="coerce").fillna(0)
+        df["SEMANA"] = df["FECHA"].dt.isocalendar().week
+        df["AÑO"] = df["FECHA"].dt.year
+
+    return df, version
+
+
+def _publicar(empresa, df, version_fuente=None, fecha=None):
+    """
+    Reemplaza el snapshot de una fuente y sube su número de versión. El índice queda
+    como 0..n-1, igual que en el snapshot en disco: el worker que publica y los que lo
+    adoptan tienen el mismo DataFrame. Retorna el DataFrame publicado.
+    """
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        df = df.reset_index(drop=True)
+    _cache[empresa] = df
+    _version[empresa] = _version.get(empresa, 0) + 1
+    # Las estructuras derivadas del snapshot anterior ya no sirven (y lo mantendrían en memoria)
+    for clave in [c for c in _derivados if c[0] == empresa]:
+        _derivados.pop(clave, None)
+    _version_fuente[empresa] = version_fuente
+    chile = pytz.timezone("America/Santiago")
+    _ultima_actualizacion[empresa] = fecha.astimezone(chile) if fecha else datetime.now(chile)
+    return df
+
+
+def _adoptar_snapshot(empresa):
+    """Publica en este worker el snapshot en disco. Retorna su meta, o None si no hay."""
+    df, meta = leer_snapshot(empresa)
+    if df is None:
+        return None
+    _publicar(empresa, df, meta.get("version"), fecha=datetime.fromisoformat(meta["guardado"]))
+    _generacion[empresa] = meta.get("generacion", 0)
+    return meta
+
+
+def _recargar(empresa, reintentos=REINTENTOS_DESCARGA):
+    """Carga la fuente y la publica. Debe llamarse con el lock de la fuente tomado."""
+    estado = _estado_refresco.setdefault(empresa, {})
+    estado.update({"estado": "cargando", "inicio": time.time()})
+    with bloqueo_carga(empresa):
+        # Si otro worker la recargó mientras esperábamos el flock, se adopta su snapshot
+        meta = meta_publicada(empresa)
+        if (meta.get("generacion", 0) > _generacion.get(empresa, 0)
+                and meta.get("guardado_ts", 0) >= estado["inicio"]
+                and _adoptar_snapshot(empresa) is not None):
+            estado.update({"estado": "compartido", "fin": time.time(), "ultimo_error": None})
+            estado["duracion"] = round(estado["fin"] - estado["inicio"], 3)
+        else:
+            _recargar_desde_origen(empresa, estado, reintentos)
+    if estado["estado"] != "sin_cambios":
+        _precalcular(empresa)
+
+
+def _recargar_desde_origen(empresa, estado, reintentos=REINTENTOS_DESCARGA):
+    try:
+        version_actual = _version_fuente.get(empresa) if empresa in _cache else None
+        df, version = _cargar_fuente(empresa, version_actual, reintentos)
+    except Exception as e:
+        estado.update({"estado": "error", "fin": time.time(), "ultimo_error": str(e)})
+        estado["duracion"] = round(estado["fin"] - estado["inicio"], 3)
+        raise
+
+    if df is None:
+        # El origen no cambió: se conserva el snapshot publicado (mismo número de versión),
+        # solo se guardan los validadores nuevos (ej: un ETag distinto con igual contenido)
+        _version_fuente[empresa] = version
+        _ultima_actualizacion[empresa] = datetime.now(pytz.timezone("America/Santiago"))
+        estado.update({"estado": "sin_cambios", "fin": time.time(), "ultimo_error": None})
+    else:
+        df = _publicar(empresa, df, version)
+        try:
+            meta = guardar_snapshot(empresa, df, version)
+            _generacion[empresa] = meta["generacion"]
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el snapshot de '{empresa}': {e}")
+        estado.update({"estado": "ok", "fin": time.time(), "ultimo_error": None})
+    estado["duracion"] = round(estado["fin"] - estado["inicio"], 3)
+
+
+def _arranque_en_caliente(empresa):
+    """
+    Publica el snapshot en disco de la fuente, si existe. Retorna True si conviene
+    revalidarlo contra el origen (es más antiguo que REVALIDAR_SNAPSHOT_TRAS).
+    """
+    meta = _adoptar_snapshot(empresa)
+    if meta is None:
+        return None
+    guardado = datetime.fromisoformat(meta["guardado"])
+    _estado_refresco.setdefault(empresa, {}).update({"estado": "snapshot_disco", "ultimo_error": None})
+    return (datetime.now().astimezone() - guardado).total_seconds() > REVALIDAR_SNAPSHOT_TRAS
+
+
+def _fallo_reciente(empresa):
+    return time.time() - _fallo_en_frio.get(empresa, 0) < ESPERA_TRAS_FALLO
+
+
+def _sin_datos(empresa, raise_errors):
+    if raise_errors:
+        raise Exception(f"La fuente '{empresa}' no está disponible (falló hace menos de {ESPERA_TRAS_FALLO}s)")
+    return pd.DataFrame(columns=COLUMNAS_BASE)
 
-# Reemplaza la función completa en utils/sheet_cache.py
 
 def obtener_datos(empresa="comercial", raise_errors=False):
     if empresa not in _cache:
-        url_o_id = URLS.get(empresa)
+        if _fallo_reciente(empresa):
+            return _sin_datos(empresa, raise_errors)
+        revalidar = False
+        with _lock_de(empresa):
+            # Otro hilo pudo terminar la carga (o fallar) mientras esperábamos el lock
+            if empresa not in _cache:
+                if _fallo_reciente(empresa):
+                    return _sin_datos(empresa, raise_errors)
+                revalidar = _arranque_en_caliente(empresa)
+                if revalidar is None:
+                    try:
+                        _recargar(empresa, reintentos=1)
+                    except Exception as e:
+                        _fallo_en_frio[empresa] = time.time()
+                        print(f"❌ Error crítico procesando '{empresa}': {e}")
+                        if raise_errors:
+                            raise
+                        return pd.DataFrame(columns=COLUMNAS_BASE)
+        if revalidar:
+            refrescar_en_segundo_plano(empresa)
+    else:
+        _revisar_generacion(empresa)
 
-        # "agricola" no usa url_o_id porque lee directo de la Base de Datos
-        if not url_o_id and empresa != "agricola":
-            if raise_errors:
-                raise Exception(f"No se ha definido la URL o ID para '{empresa}'")
-            return pd.DataFrame()
+    return _vista_solo_lectura(_cache[empresa])
 
-        elif empresa == "mayor":
-            try:
-                SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
-                BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-                ROOT_DIR = os.path.dirname(BASE_DIR)
-                SERVICE_ACCOUNT_FILE = os.path.join(ROOT_DIR, 'credenciales_google.json')
-
-                creds = service_account.Credentials.from_service_account_file(
-                    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-                drive_service = build('drive', 'v3', credentials=creds)
-                folder_id = url_o_id
-                file_name = 'mayor.xlsx'
-
-                query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
-                results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-                items = results.get('files', [])
-
-                if not items:
-                    raise Exception(f"No se encontró el archivo '{file_name}' en la carpeta de Drive.")
-
-                file_id = items[0]['id']
-                request = drive_service.files().get_media(fileId=file_id)
-                file_content = io.BytesIO()
-                downloader = MediaIoBaseDownload(file_content, request)
-                
-                done = False
-                while done is False:
-                    status, done = downloader.next_chunk()
-                
-                file_content.seek(0)
-                df = pd.read_excel(file_content, engine="openpyxl")
-                df.columns = df.columns.str.strip().str.upper()
-                df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
-                df = df.dropna(subset=["FECHA", "NOMBRE", "DEBE", "HABER"])
-                df["AÑO"] = df["FECHA"].dt.year
-                df["MES"] = df["FECHA"].dt.month
-            
-            except Exception as e:
-                print(f"ERROR al cargar 'mayor.xlsx' desde la API de Drive: {e}")
-            if raise_errors:
-                raise e
-                return pd.DataFrame()
 
-        elif empresa == "agricola":
-            try:
-                # --- LEER DESDE LA BASE DE DATOS LOCAL ---
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
-                # Optimizamos la consulta para traer SOLO las columnas necesarias
-                # y filtrar directo en MySQL, reduciendo drásticamente el uso de RAM y tiempo.
-                query = """
-                    SELECT fecha, des_articu, rubro, n_comp, sub_rengl, des_client, cantidad
-                    FROM ventas_agricola
-                    WHERE UPPER(TRIM(estado)) IN ('COBRADO', 'COBRADA', 'DESPACH./COBRADA')
-                      AND fecha IS NOT NULL
-                """
-                cursor.execute(query)
-                rows = cursor.fetchall()
-                conn.close()
-                
-                cols_base = ["FECHA", "DESCRIPCION", "NETO", "CANTIDAD", "SUCURSAL", "FAMILIA", "AÑO", "SEMANA"]
-                if not rows:
-                    return pd.DataFrame(columns=cols_base)
-                    
-                df = pd.DataFrame(rows)
-                df.columns = df.columns.str.strip().str.upper()
-
-                # 1. Renombrar para el Dashboard estándar (El filtro de estado ya se hizo en SQL)
-                df.rename(columns={
-                    "DES_ARTICU": "DESCRIPCION",
-                    "RUBRO": "FAMILIA",
-                    "N_COMP": "N_BOLETA"
-                }, inplace=True)
-                
-                # Usamos 'SUB_RENGL' de la base de datos y lo dividimos por 1.19 para obtener el Neto real por línea.
-                df["NETO"] = pd.to_numeric(df["SUB_RENGL"], errors='coerce').fillna(0) / 1.19
-
-                # 3. Clasificar Sucursal usando DES_CLIENT
-                def clasificar_cliente(cliente):
-                    if pd.isna(cliente):
-                        return "FACTURA"
-                    cliente_str = str(cliente).upper()
-                    if "OCASIONAL" in cliente_str:
-                        return "BOLETAS"
-                    elif "TRABAJADOR" in cliente_str:
-                        return "TRABAJADOR"
-                    else:
-                        return "FACTURA"
-
-                if "DES_CLIENT" in df.columns:
-                    df["SUCURSAL"] = df["DES_CLIENT"].apply(clasificar_cliente)
-                else:
-                    df["SUCURSAL"] = "FACTURA"
-
-                columnas_requeridas = ["FECHA", "DESCRIPCION", "NETO", "CANTIDAD"]
-                df = df.dropna(subset=columnas_requeridas)
-                df["FECHA"] = pd.to_datetime(df["FECHA"], errors="coerce")
-                df["CANTIDAD"] = pd.to_numeric(df["CANTIDAD"], errors="coerce").fillna(0)
-                df["SEMANA"] = df["FECHA"].dt.isocalendar().week
-                df["AÑO"] = df["FECHA"].dt.year
+def _revisar_generacion(empresa):
+    """Adopta el snapshot si otro worker publicó una generación más nueva."""
+    ahora = time.time()
+    if ahora - _ultima_revision.get(empresa, 0) < INTERVALO_REVISION_COMPARTIDA:
+        return
+    _ultima_revision[empresa] = ahora
+    if meta_publicada(empresa).get("generacion", 0) <= _generacion.get(empresa, 0):
+        return
+    lock = _lock_de(empresa)
+    if not lock.acquire(blocking=False):
+        return  # Este worker ya está recargando la fuente; se sigue con el snapshot actual
+    try:
+        if _adoptar_snapshot(empresa) is not None:
+            _estado_refresco.setdefault(empresa, {}).update({"estado": "compartido", "ultimo_error": None})
+            _precalcular(empresa)
+    except Exception as e:
+        print(f"⚠️ No se pudo adoptar el snapshot compartido de '{empresa}': {e}")
+    finally:
+        lock.release()
 
-            except Exception as e:
-                print(f"❌ Error crítico procesando '{empresa}': {e}")
-                if raise_errors:
-                    raise e
-                return pd.DataFrame(columns=["FECHA", "DESCRIPCION", "NETO", "CANTIDAD", "SUCURSAL", "FAMILIA", "AÑO", "SEMANA"])
+def obtener_derivado(empresa, clave, constructor):
+    """
+    Estructura derivada del snapshot (índices, agregados...) construida con
+    constructor(df) una sola vez por versión de la fuente y compartida por todos
+    los requests. El constructor no debe modificar el DataFrame que recibe.
+    """
+    obtener_datos(empresa)
+    return _construir_derivado(empresa, clave, constructor)
 
-        else:
-            try:
-                # --- INICIO DE LA SOLUCIÓN ---
-                # Añadimos un User-Agent para simular una petición de navegador
-                storage_options = {'User-Agent': 'Mozilla/5.0'}
-                df = pd.read_csv(url_o_id, encoding="utf-8", storage_options=storage_options, low_memory=False)
-                # --- FIN DE LA SOLUCIÓN ---
-                
-                df.columns = df.columns.str.strip().str.upper()
-
-                if empresa == "comercial":
-                    df.rename(columns={"AÃ‘O": "AÑO"}, inplace=True)
-                    columnas_requeridas = ["FECHA", "DESCRIPCION", "NETO", "CANTIDAD"]
-                    faltantes = [col for col in columnas_requeridas if col not in df.columns]
-                    if faltantes:
-                        raise KeyError(f"❌ Columnas faltantes en '{empresa}': {faltantes}")
-
-                    # FIX: Asegurarse de que la columna FAMILIA siempre exista para evitar que el dashboard se caiga.
-                    if "FAMILIA" not in df.columns:
-                        df["FAMILIA"] = "SIN FAMILIA"
-
-                    df = df.dropna(subset=columnas_requeridas)
-                    df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True, errors="coerce")
-                    df["CANTIDAD"] = pd.to_numeric(df["CANTIDAD"], errors="coerce").fillna(0)
-                    df["NETO"] = pd.to_numeric(df["NETO"], errors="coerce").fillna(0)
-                    df["SEMANA"] = df["FECHA"].dt.isocalendar().week
-                    df["AÑO"] = df["FECHA"].dt.year
 
-            except Exception as e:
-                print(f"❌ Error crítico procesando '{empresa}': {e}")
-                if raise_errors:
-                    raise e
-                return pd.DataFrame(columns=["FECHA", "DESCRIPCION", "NETO", "CANTIDAD", "SUCURSAL", "FAMILIA", "AÑO", "SEMANA"])
+def _construir_derivado(empresa, clave, constructor):
+    df = _cache.get(empresa)
+    if df is None:
+        return constructor(pd.DataFrame(columns=COLUMNAS_BASE))
+    guardado = _derivados.get((empresa, clave))
+    if guardado is not None and guardado[0] is df:
+        return guardado[1]
+    with _lock_de(f"{empresa}:{clave}"):
+        guardado = _derivados.get((empresa, clave))
+        if guardado is not None and guardado[0] is df:
+            return guardado[1]
+        valor = constructor(df)
+        if _cache.get(empresa) is df:
+            _derivados[(empresa, clave)] = (df, valor)
+    return valor
 
-        _cache[empresa] = df
-        chile = pytz.timezone("America/Santiago")
-        _ultima_actualizacion[empresa] = datetime.now(chile)
 
-    return _cache[empresa].copy()
+def registrar_derivado(empresa, clave, constructor):
+    """
+    Registra una estructura derivada para construirla apenas se publica un snapshot
+    nuevo (en el hilo de la recarga), y no en el primer request que la pida.
+    """
+    _precalculos.setdefault(empresa, {})[clave] = constructor
+
+
+def _precalcular(empresa):
+    for clave, constructor in list(_precalculos.get(empresa, {}).items()):
+        try:
+            _construir_derivado(empresa, clave, constructor)
+        except Exception as e:
+            print(f"⚠️ No se pudo precalcular '{clave}' de '{empresa}': {e}")
+
+def _vista_solo_lectura(df):
+    """
+    Devuelve un snapshot del DataFrame cacheado sin copiar los datos.
+    Con Copy-on-Write, agregar o modificar columnas en la vista no toca el caché.
+    Si la versión de pandas no soporta CoW, se vuelve a la copia completa.
+    """
+    if _copy_on_write_activo():
+        return df.copy(deep=False)
+    return df.copy()
+
+def obtener_datos_mutable(empresa="comercial", raise_errors=False):
+    """
+    Copia profunda e independiente del caché, para los pocos llamadores que
+    modifican el DataFrame en sitio (inplace) y necesitan su propia memoria.
+    """
+    return obtener_datos(empresa, raise_errors=raise_errors).copy()
 
 def obtener_fecha_actualizacion(empresa="comercial"):
     return _ultima_actualizacion.get(empresa)
 
 
+def obtener_version(empresa="comercial"):
+    """Número de versión del snapshot: cambia cada vez que la fuente se recarga."""
+    return _version.get(empresa, 0)
+
+
+def obtener_estado_refresco():
+    """Estado, duración y último error de cada fuente (para el endpoint JSON)."""
+    estado = {}
+    for key in _fuentes():
+        e = _estado_refresco.get(key, {})
+        fecha = _ultima_actualizacion.get(key)
+        estado[key] = {
+            "estado": e.get("estado", "en_cache" if key in _cache else "sin_cargar"),
+            "en_curso": _lock_de(key).locked(),
+            "duracion": e.get("duracion"),
+            "ultimo_error": e.get("ultimo_error"),
+            "ultima_actualizacion": fecha.isoformat() if fecha else None,
+            "version": obtener_version(key),
+            "filas": len(_cache[key]) if key in _cache else 0,
+        }
+    return estado
+
+
 def forzar_actualizacion(empresa="comercial"):
-    global _cache
-    if empresa in _cache:
-        del _cache[empresa]
+    """Recarga la fuente en segundo plano; mientras tanto se sigue sirviendo el snapshot anterior."""
+    return refrescar_en_segundo_plano(empresa)
+
+
+def refrescar_en_segundo_plano(empresa):
+    lock = _lock_de(empresa)
+    if not lock.acquire(blocking=False):
+        return False  # Ya hay un cargador corriendo para esta fuente
+
+    def _tarea():
+        try:
+            _recargar(empresa)
+        except Exception as e:
+            print(f"⚠️ Error recargando '{empresa}': {e}")
+        finally:
+            lock.release()
+
+    threading.Thread(target=_tarea, name=f"refresco-{empresa}", daemon=True).start()
+    return True
+
+
+def _refrescar_fuente(key):
+    inicio = time.time()
+    with _lock_de(key):
+        previo = _estado_refresco.get(key, {})
+        # Si otro hilo terminó de recargarla mientras esperábamos, no repetimos la descarga
+        if previo.get("fin", 0) < inicio:
+            try:
+                _recargar(key)
+            except Exception as e:
+                print(f"⚠️ Error recargando '{key}': {e}")
+        estado = _estado_refresco.get(key, {})
+        if estado.get("estado") == "error":
+            return {"fuente": key, "status": "error", "error": estado.get("ultimo_error"), "duracion": estado.get("duracion")}
+        if estado.get("estado") == "sin_cambios":
+            return {"fuente": key, "status": "unchanged", "error": None, "duracion": estado.get("duracion")}
+        return {"fuente": key, "status": "success", "error": None, "duracion": estado.get("duracion")}
+
 
 def refrescar_todo_el_cache():
+    """
+    Recarga todas las fuentes en paralelo sin vaciar el caché: los requests concurrentes
+    siguen viendo el snapshot anterior hasta que cada fuente nueva está lista.
+    Retorna una fila por fuente con su estado y duración en segundos.
+    """
+    fuentes = _fuentes()
+    pool = ThreadPoolExecutor(max_workers=MAX_CARGAS_PARALELAS, thread_name_prefix="carga")
+    futuros = {key: pool.submit(_refrescar_fuente, key) for key in fuentes}
+    wait(futuros.values(), timeout=TIMEOUT_REFRESCO_TOTAL)
+    # No esperamos a las que siguen corriendo: terminarán y publicarán su snapshot solas
+    pool.shutdown(wait=False)
+
     resultados = []
-    fuentes = list(URLS.keys())
-    if "agricola" not in fuentes:
-        fuentes.append("agricola")
-        
     for key in fuentes:
+        futuro = futuros[key]
+        if not futuro.done():
+            resultados.append({"fuente": key, "status": "timeout", "error": f"Sin respuesta tras {TIMEOUT_REFRESCO_TOTAL}s", "duracion": None})
+            continue
         try:
-            if key in _cache:
-                del _cache[key]
-            obtener_datos(key, raise_errors=True)  # Forza recarga y lanza error si hay problema
-            resultados.append({"fuente": key, "status": "success", "error": None})
+            resultados.append(futuro.result())
         except Exception as e:
-            print(f"⚠️ Error recargando '{key}': {e}")
-            resultados.append({"fuente": key, "status": "error", "error": str(e)})
+            resultados.append({"fuente": key, "status": "error", "error": str(e), "duracion": None})
     return resultados
+
+
+def refrescar_todo_en_segundo_plano():
+    """Lanza refrescar_todo_el_cache en un hilo y retorna de inmediato."""
+    threading.Thread(target=refrescar_todo_el_cache, name="refresco-global", daemon=True).start()
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import pickle
+import threading
+from datetime import datetime
+from utils.archivos import escribir_atomico, bloqueo_archivo
+
+# pyarrow es opcional: si no está instalado, los snapshots se guardan con pickle.
+try:
+    import pyarrow  # noqa: F401
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Snapshots en disco de las fuentes ya normalizadas de sheet_cache. Sobreviven a los
+# reinicios y al reciclaje de workers de cPanel/Passenger, así un worker nuevo arranca
+# leyendo un archivo columnar local en vez de volver a descargar y parsear todo.
+#
+# También es el almacén compartido entre workers: cada guardado sube la 'generacion'
+# de la fuente en el manifest y los demás procesos la adoptan leyendo el archivo
+# Arrow con memory-map (las columnas numéricas quedan en el page cache del sistema,
+# compartido por todos los workers) en vez de volver a descargar.
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNAPSHOT_DIR = os.path.join(BASE_DIR, "cache", "snapshots")
+MANIFEST_FILE = os.path.join(SNAPSHOT_DIR, "manifest.json")
+
+_manifest_lock = threading.Lock()
+_manifest_leido = {"mtime": None, "data": {}}
+
+
+def _bloqueo(nombre):
+    """Lock entre procesos sobre SNAPSHOT_DIR/<nombre>.lock."""
+    return bloqueo_archivo(os.path.join(SNAPSHOT_DIR, nombre))
+
+
+def bloqueo_carga(empresa):
+    """Serializa la descarga de una fuente entre todos los workers de la máquina."""
+    return _bloqueo(f"carga_{empresa}")
+
+
+def leer_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Manifest de snapshots ilegible, se ignora: {e}")
+        return {}
+
+
+def _guardar_manifest(manifest):
+    def escribir(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    escribir_atomico(MANIFEST_FILE, escribir)
+
+
+def meta_publicada(empresa):
+    """
+    Metadatos vigentes de la fuente en el manifest compartido. Solo vuelve a
+    parsear el JSON si el archivo cambió (un stat por llamada).
+    """
+    try:
+        mtime = os.stat(MANIFEST_FILE).st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _manifest_leido["mtime"]:
+        _manifest_leido["data"] = leer_manifest()
+        _manifest_leido["mtime"] = mtime
+    return _manifest_leido["data"].get(empresa, {})
+
+
+def _escribir_feather(df, ruta):
+    # Arrow exige índice por defecto y no acepta columnas object con tipos mezclados
+    # (ej: CUENTA con números y textos); en ese caso se lanza y usamos pickle.
+    # Sin compresión, para que la lectura con memory-map no tenga que copiar.
+    df.reset_index(drop=True).to_feather(ruta, compression="uncompressed")
+
+
+def _escribir_pickle(df, ruta):
+    with open(ruta, "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def guardar_snapshot(empresa, df, version=None):
+    """Persiste el DataFrame normalizado de una fuente y registra su versión en el manifest."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    formato = None
+    if feather is not None:
+        ruta = os.path.join(SNAPSHOT_DIR, f"{empresa}.feather")
+        try:
+            escribir_atomico(ruta, lambda tmp: _escribir_feather(df, tmp))
+            formato = "feather"
+        except Exception as e:
+            print(f"⚠️ Snapshot '{empresa}' no es compatible con Arrow ({e}); se guarda con pickle")
+    if formato is None:
+        ruta = os.path.join(SNAPSHOT_DIR, f"{empresa}.pkl")
+        escribir_atomico(ruta, lambda tmp: _escribir_pickle(df, tmp))
+        formato = "pickle"
+
+    with _manifest_lock, _bloqueo("manifest"):
+        manifest = leer_manifest()
+        generacion = manifest.get(empresa, {}).get("generacion", 0) + 1
+        manifest[empresa] = {
+            "archivo": os.path.basename(ruta),
+            "formato": formato,
+            "version": version,
+            "generacion": generacion,
+            "filas": int(len(df)),
+            "guardado": datetime.now().astimezone().isoformat(timespec="seconds"),
+            "guardado_ts": time.time(),
+        }
+        _guardar_manifest(manifest)
+    return manifest[empresa]
+
+
+def leer_snapshot(empresa):
+    """Retorna (df, meta) del snapshot en disco, o (None, None) si no existe o está dañado."""
+    meta = leer_manifest().get(empresa)
+    if not meta:
+        return None, None
+    ruta = os.path.join(SNAPSHOT_DIR, meta["archivo"])
+    if not os.path.exists(ruta):
+        return None, None
+    try:
+        if meta["formato"] == "feather":
+            if feather is None:
+                return None, None
+            # El rename atómico deja intacto el archivo que otros workers tengan mapeado
+            df = feather.read_table(ruta, memory_map=True).to_pandas(split_blocks=True)
+        else:
+            with open(ruta, "rb") as f:
+                df = pickle.load(f)
+    except Exception as e:
+        print(f"⚠️ No se pudo leer el snapshot de '{empresa}': {e}")
+        return None, None
+    return df, meta
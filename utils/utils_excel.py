@@ -1,6 +1,139 @@
-from openpyxl.styles import numbers
+import os
+import zlib
+import tempfile
+import pandas as pd
+from flask import Response
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+# Formato personalizado: separador de miles punto y decimal coma
+FORMATO_NUMERICO = '#.##0,00'
+FORMATO_FECHA = 'YYYY-MM-DD HH:MM:SS'
+FILAS_POR_LOTE = 10_000
+TAMANO_CHUNK = 64 * 1024
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
 def aplicar_formato_numerico_excel(cell):
     if isinstance(cell.value, (int, float)):
         # Esto es formato personalizado: separador de miles punto y decimal coma
-        cell.number_format = '#.##0,00'
+        cell.number_format = FORMATO_NUMERICO
+
+def _valores_columna(serie):
+    # Valores Python por columna; NaN/NaT quedan como celdas vacías
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return [None if pd.isna(v) else v for v in serie.tolist()]
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        if not serie.hasnans:
+            return serie.tolist()
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+def escribir_excel(df, ruta, columnas_numericas=None):
+    """
+    Escribe df a un .xlsx en modo write-only (memoria constante, fila a fila).
+    Los formatos se resuelven una vez por columna: fecha para las datetime y
+    FORMATO_NUMERICO para los números de 'columnas_numericas' (None = todas).
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append([str(c) for c in df.columns])
+
+    # Una celda plantilla por columna: openpyxl escribe cada fila al hacer append,
+    # así que se reutiliza en vez de crear y estilar una celda por valor.
+    plantillas = {}
+    por_valor = {}  # columnas object: el formato depende de cada valor
+    for i, col in enumerate(df.columns):
+        serie = df[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            formato = FORMATO_FECHA
+        elif columnas_numericas is not None and col not in columnas_numericas:
+            continue
+        elif pd.api.types.is_numeric_dtype(serie):
+            formato = FORMATO_NUMERICO
+        elif serie.dtype == object:
+            formato = FORMATO_NUMERICO
+            por_valor[i] = True
+        else:
+            continue
+        celda = WriteOnlyCell(ws)
+        celda.number_format = formato
+        plantillas[i] = celda
+
+    for inicio in range(0, len(df), FILAS_POR_LOTE):
+        lote = df.iloc[inicio:inicio + FILAS_POR_LOTE]
+        columnas = [_valores_columna(lote[col]) for col in lote.columns]
+        for fila in zip(*columnas):
+            fila = list(fila)
+            for i, celda in plantillas.items():
+                valor = fila[i]
+                if valor is None or (i in por_valor and not isinstance(valor, (int, float))):
+                    continue
+                celda.value = valor
+                fila[i] = celda
+            ws.append(fila)
+
+    wb.save(ruta)
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+def _leer_en_chunks(ruta):
+    try:
+        with open(ruta, "rb") as f:
+            while True:
+                chunk = f.read(TAMANO_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        _borrar_archivo(ruta)
+
+def respuesta_excel(df, nombre_archivo, columnas_numericas=None):
+    """Arma el .xlsx en un temporal y lo envía en chunks; el temporal se borra al cerrar."""
+    fd, ruta = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        escribir_excel(df, ruta, columnas_numericas)
+        tamano = os.path.getsize(ruta)
+    except Exception:
+        _borrar_archivo(ruta)
+        raise
+    respuesta = Response(_leer_en_chunks(ruta), mimetype=MIMETYPE_XLSX, direct_passthrough=True,
+                         headers={"Content-Disposition": f"attachment; filename={nombre_archivo}",
+                                  "Content-Length": str(tamano)})
+    # Si el cliente corta antes de empezar a leer, el generador nunca corre su finally
+    respuesta.call_on_close(lambda: _borrar_archivo(ruta))
+    return respuesta
+
+def _chunks_csv(df, comprimir):
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None  # wbits 31 = formato gzip
+    for inicio in range(0, max(len(df), 1), FILAS_POR_LOTE):
+        lote = df.iloc[inicio:inicio + FILAS_POR_LOTE]
+        texto = lote.to_csv(index=False, header=(inicio == 0), sep=";", decimal=",")
+        # BOM al inicio para que Excel en español lo abra como UTF-8
+        datos = (("\ufeff" if inicio == 0 else "") + texto).encode("utf-8")
+        if compresor is None:
+            yield datos
+        else:
+            comprimido = compresor.compress(datos)
+            if comprimido:
+                yield comprimido
+    if compresor is not None:
+        yield compresor.flush()
+
+def respuesta_csv(df, nombre_archivo, comprimir=False):
+    """CSV (separador ';' y decimal ',') generado y enviado por lotes, opcionalmente en gzip."""
+    if comprimir:
+        nombre_archivo += ".gz"
+    return Response(_chunks_csv(df, comprimir), mimetype="application/gzip" if comprimir else "text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"})
+
+def respuesta_exportacion(df, nombre_base, formato="xlsx", columnas_numericas=None):
+    """Exporta df como xlsx (por defecto), csv o csv.gz según 'formato'."""
+    if formato == "csv":
+        return respuesta_csv(df, f"{nombre_base}.csv")
+    if formato in ("csv.gz", "gz"):
+        return respuesta_csv(df, f"{nombre_base}.csv", comprimir=True)
+    return respuesta_excel(df, f"{nombre_base}.xlsx", columnas_numericas)